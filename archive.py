@@ -0,0 +1,42 @@
+import argparse
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+from config import ARCHIVE_INTERVAL_SECONDS, HISTORY_LIMIT, WEIGHT_HISTORY_LIMIT_PER_STUDENT
+from database import init_db, compact_group, get_compactable_groups
+from render_cache import queue_render_cache
+import async_db
+
+def compact(group_ids: Optional[Iterable[int]] = None, keep_queues: int = HISTORY_LIMIT, keep_history: int = WEIGHT_HISTORY_LIMIT_PER_STUDENT) -> List[Dict[str, Any]]:
+    results = []
+    for gid in (group_ids if group_ids is not None else get_compactable_groups()):
+        result = compact_group(gid, keep_queues, keep_history)
+        queue_render_cache.invalidate(result["queues"])
+        results.append(result)
+    return results
+
+async def run_compaction(interval: float = ARCHIVE_INTERVAL_SECONDS) -> None:
+    while True:
+        try:
+            for gid in await async_db.get_compactable_groups():
+                result = await async_db.compact_group(gid)
+                queue_render_cache.invalidate(result["queues"])
+                if result["queues"] or result["weight_history"]:
+                    logging.info(f"Archived group {gid}: {len(result['queues'])} queues, {result['weight_history']} history rows")
+        except Exception as e:
+            logging.error(f"Compaction failed: {e}")
+        await asyncio.sleep(interval)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Перенос старых очередей и истории весов в архив")
+    parser.add_argument("--group", type=int, nargs="+", help="группы (по умолчанию все)")
+    parser.add_argument("--keep-queues", type=int, default=HISTORY_LIMIT)
+    parser.add_argument("--keep-history", type=int, default=WEIGHT_HISTORY_LIMIT_PER_STUDENT)
+    args = parser.parse_args()
+    init_db()
+    print(json.dumps(compact(args.group, args.keep_queues, args.keep_history), ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict
+
+import database
+import queue_logic
+from config import DB_READ_POOL_SIZE
+
+_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+_read_executor = ThreadPoolExecutor(max_workers=DB_READ_POOL_SIZE, thread_name_prefix="db-read")
+
+def _run_in(executor: ThreadPoolExecutor, fn: Callable[..., Any]) -> Callable[..., Awaitable[Any]]:
+    @functools.wraps(fn)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(executor, functools.partial(ctx.run, fn, *args, **kwargs))
+    return wrapper
+
+def _reader(fn: Callable[..., Any]) -> Callable[..., Awaitable[Any]]:
+    return _run_in(_read_executor, fn)
+
+def _writer(fn: Callable[..., Any]) -> Callable[..., Awaitable[Any]]:
+    return _run_in(_write_executor, fn)
+
+def pending() -> Dict[str, int]:
+    return {"write": _write_executor._work_queue.qsize(), "read": _read_executor._work_queue.qsize()}
+
+def shutdown() -> None:
+    _write_executor.shutdown(wait=True)
+    _read_executor.shutdown(wait=True)
+
+get_student_name = _reader(database.get_student_name)
+get_active_students = _reader(database.get_active_students)
+get_full_list = _reader(database.get_full_list)
+get_all_weights = _reader(database.get_all_weights)
+get_weight_history = _reader(database.get_weight_history)
+get_group_weight_history = _reader(database.get_group_weight_history)
+get_recent_queues = _reader(database.get_recent_queues)
+get_queues_by_subject = _reader(database.get_queues_by_subject)
+get_queue = _reader(database.get_queue)
+get_queue_items_page = _reader(database.get_queue_items_page)
+get_archived_queue = _reader(database.get_archived_queue)
+get_archived_queues = _reader(database.get_archived_queues)
+get_compactable_groups = _reader(database.get_compactable_groups)
+get_student_stats = _reader(database.get_student_stats)
+get_students_page = _reader(database.get_students_page)
+get_student_initials = _reader(database.get_student_initials)
+get_queue_version = _reader(database.get_queue_version)
+get_latest_queue_version = _reader(database.get_latest_queue_version)
+get_student_current_weight = _reader(database.get_student_current_weight)
+get_queue_by_index_from_latest = _reader(database.get_queue_by_index_from_latest)
+get_latest_queue = _reader(queue_logic.get_latest_queue)
+get_marks = _reader(database.get_marks)
+fsm_get = _reader(database.fsm_get)
+get_group_settings = _reader(database.get_group_settings)
+
+init_db = _writer(database.init_db)
+add_student = _writer(database.add_student)
+reset_all_weights = _writer(database.reset_all_weights)
+enable_all_students = _writer(database.enable_all_students)
+toggle_student_status = _writer(database.toggle_student_status)
+create_queue_record = _writer(database.create_queue_record)
+update_queue_timestamp_and_log = _writer(database.update_queue_timestamp_and_log)
+swap_queue_positions = _writer(database.swap_queue_positions)
+set_marks = _writer(database.set_marks)
+fsm_set_state = _writer(database.fsm_set_state)
+fsm_set_data = _writer(database.fsm_set_data)
+fsm_purge = _writer(database.fsm_purge)
+compact_group = _writer(database.compact_group)
+save_group = _writer(database.save_group)
+add_group_admin = _writer(database.add_group_admin)
+remove_group_admin = _writer(database.remove_group_admin)
+
+generate_and_save_queue = _writer(queue_logic.generate_and_save_queue)
+swap_and_cascade = _writer(queue_logic.swap_and_cascade)
+delete_student_from_queue_and_apply_penalty = _writer(queue_logic.delete_student_from_queue_and_apply_penalty)
+add_new_student_to_queue_and_penalize = _writer(queue_logic.add_new_student_to_queue_and_penalize)
+remove_students = _writer(queue_logic.remove_students)
+add_students = _writer(queue_logic.add_students)
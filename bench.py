@@ -0,0 +1,157 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from config import DEFAULT_GROUP_ID
+from database import (
+    open_db, close_db, init_db, transaction, student_directory,
+    register_trace_hook, unregister_trace_hook, get_queue, get_recent_queues,
+    get_oldest_queue_id,
+)
+from render_cache import queue_render_cache
+from queue_logic import generate_and_save_queue, swap_and_cascade, delete_student_from_queue_and_apply_penalty
+from handlers import format_queue_message, get_selection_keyboard
+
+class StatementCounter:
+    def __init__(self) -> None:
+        self.statements = 0
+        self.commits = 0
+
+    def __call__(self, statement: str) -> None:
+        self.statements += 1
+        if statement.startswith("COMMIT"):
+            self.commits += 1
+
+    def reset(self) -> None:
+        self.statements = 0
+        self.commits = 0
+
+def measure(
+    counter: StatementCounter,
+    fn: Callable[[Any], Any],
+    iterations: int,
+    setup: Optional[Callable[[int], Any]] = None,
+) -> Dict[str, float]:
+    durations = np.empty(iterations)
+    statements = np.empty(iterations)
+    commits = np.empty(iterations)
+    for i in range(iterations):
+        arg = setup(i) if setup is not None else i
+        counter.reset()
+        started = time.perf_counter()
+        fn(arg)
+        durations[i] = time.perf_counter() - started
+        statements[i] = counter.statements
+        commits[i] = counter.commits
+    return {
+        "iterations": iterations,
+        "p50_ms": float(np.percentile(durations, 50) * 1000),
+        "p95_ms": float(np.percentile(durations, 95) * 1000),
+        "mean_ms": float(durations.mean() * 1000),
+        "ops_per_sec": float(iterations / durations.sum()) if durations.sum() else None,
+        "statements_per_op": float(statements.mean()),
+        "commits_per_op": float(commits.mean()),
+    }
+
+def seed_group(n_students: int, n_queues: int, rng: random.Random, group_id: int = DEFAULT_GROUP_ID) -> None:
+    with transaction() as conn:
+        conn.cursor().executemany(
+            "INSERT INTO students (name, weight, active, group_id) VALUES (?, 1.0, 1, ?)",
+            [(f"Студент {i:05d}", group_id) for i in range(n_students)]
+        )
+    student_directory.reload()
+    for i in range(n_queues):
+        generate_and_save_queue(f"Предмет {i % 7}", seed=rng.randrange(2 ** 32), group_id=group_id)
+
+def _regular_positions(q: Dict[str, Any]) -> List[int]:
+    return [it[0] for it in q["items"] if not (it[2] or it[3] or it[6])]
+
+def run_case(n_students: int, n_queues: int, iterations: int, seed: int) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    counter = StatementCounter()
+    loop = asyncio.new_event_loop()
+    with tempfile.TemporaryDirectory() as tmp:
+        register_trace_hook(counter)
+        try:
+            open_db(os.path.join(tmp, "bench.db"))
+            queue_render_cache.clear()
+            init_db()
+            started = time.perf_counter()
+            seed_group(n_students, n_queues, rng)
+            seeded = time.perf_counter() - started
+
+            def latest_id() -> int:
+                return get_recent_queues(1)[0][0]
+
+            def oldest_id() -> int:
+                return get_oldest_queue_id()
+
+            def swap_args(qid: int) -> Any:
+                a, b = rng.sample(_regular_positions(get_queue(qid)), 2)
+                return qid, a, b
+
+            def delete_args(_: int) -> Any:
+                qid = latest_id()
+                q = get_queue(qid)
+                if len(q["items"]) < 3:
+                    qid = generate_and_save_queue("Удаление", seed=rng.randrange(2 ** 32))
+                    q = get_queue(qid)
+                return qid, rng.choice(q["items"])[0]
+
+            operations = {
+                "generate_and_save_queue": measure(
+                    counter, lambda i: generate_and_save_queue(f"Предмет {i % 7}", seed=rng.randrange(2 ** 32)), iterations),
+                "swap_and_cascade_latest": measure(
+                    counter, lambda a: swap_and_cascade(*a), iterations, lambda i: swap_args(latest_id())),
+                "swap_and_cascade_oldest": measure(
+                    counter, lambda a: swap_and_cascade(*a), iterations, lambda i: swap_args(oldest_id())),
+                "delete_student_from_queue_and_apply_penalty": measure(
+                    counter, lambda a: delete_student_from_queue_and_apply_penalty(*a), iterations, delete_args),
+                "format_queue_message": measure(
+                    counter, format_queue_message, iterations, lambda i: get_queue(latest_id())),
+                "get_selection_keyboard_swap": measure(
+                    counter, lambda data: loop.run_until_complete(get_selection_keyboard(data)), iterations,
+                    lambda i: {"action": "swap", "selected": [], "queue_id": latest_id()}),
+                "get_selection_keyboard_add": measure(
+                    counter, lambda data: loop.run_until_complete(get_selection_keyboard(data)), iterations,
+                    lambda i: {"action": "admin_add", "selected": [], "queue_id": latest_id()}),
+            }
+        finally:
+            unregister_trace_hook(counter)
+            close_db()
+            loop.close()
+    return {"students": n_students, "queues": n_queues, "seed_seconds": seeded, "operations": operations}
+
+def run(students: Sequence[int], queues: Sequence[int], iterations: int, seed: int) -> Dict[str, Any]:
+    return {
+        "params": {"students": list(students), "queues": list(queues), "iterations": iterations, "seed": seed},
+        "results": [run_case(n, m, iterations, seed) for n in students for m in queues],
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк операций с очередями на временной базе")
+    parser.add_argument("--students", type=int, nargs="+", default=[30, 300, 3000])
+    parser.add_argument("--queues", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="записать JSON в файл вместо stdout")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    report = run(args.students, args.queues, args.iterations, args.seed)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
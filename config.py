@@ -4,16 +4,57 @@ from datetime import timedelta
 
 load_dotenv()
 ADMINS = {1607498152, 5174581416}
+DEFAULT_GROUP_ID = int(os.getenv("DEFAULT_GROUP_ID", "0"))
 
 TOKEN = os.getenv("DEV_TOKEN")
 
+RUN_MODE = os.getenv("RUN_MODE", "polling")
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+HEALTH_PATH = os.getenv("HEALTH_PATH", "/health")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+
 K_FACTOR = float(os.getenv("K_FACTOR", "1.0"))
 RECENT_QUEUE_LIMIT = int(os.getenv("RECENT_QUEUE_LIMIT", "5"))
 HISTORY_LIMIT = int(os.getenv("HISTORY_LIMIT", "10"))
 WEIGHT_HISTORY_LIMIT_PER_STUDENT = int(os.getenv("WEIGHT_HISTORY_LIMIT_PER_STUDENT", "10"))
+SNAPSHOT_INTERVAL = int(os.getenv("SNAPSHOT_INTERVAL", "5"))
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))
+GROUP_HISTORY_TRANSITIONS = int(os.getenv("GROUP_HISTORY_TRANSITIONS", "10"))
 
 DB_NAME = os.getenv("DB_NAME", "students.db")
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "8192"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(64 * 1024 * 1024)))
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "256"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
 
 MIN_WEIGHT_THRESHOLD = float(os.getenv("MIN_WEIGHT_THRESHOLD", "0.0001"))
 WEIGHT_MIN_LIMIT = float(os.getenv("WEIGHT_MIN_LIMIT", "0.1"))
-WEIGHT_MAX_LIMIT = float(os.getenv("WEIGHT_MAX_LIMIT", "10.0"))
\ No newline at end of file
+WEIGHT_MAX_LIMIT = float(os.getenv("WEIGHT_MAX_LIMIT", "10.0"))
+
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "64"))
+PICKER_PAGE_SIZE = int(os.getenv("PICKER_PAGE_SIZE", "20"))
+INLINE_SEARCH_LIMIT = int(os.getenv("INLINE_SEARCH_LIMIT", "20"))
+
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory")
+SELECTION_TIMEOUT_SECONDS = int(os.getenv("SELECTION_TIMEOUT_SECONDS", "300"))
+FSM_PURGE_INTERVAL_SECONDS = int(os.getenv("FSM_PURGE_INTERVAL_SECONDS", "60"))
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv("EVENT_LOOP_LAG_INTERVAL", "1.0"))
+
+OUTBOUND_THROTTLE = os.getenv("OUTBOUND_THROTTLE", "1") == "1"
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+OUTBOUND_CHAT_BURST = float(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+OUTBOUND_GROUP_RATE = float(os.getenv("OUTBOUND_GROUP_RATE", str(20 / 60)))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+OUTBOUND_TRACKED_MESSAGES = int(os.getenv("OUTBOUND_TRACKED_MESSAGES", "1024"))
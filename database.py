@@ -1,198 +1,672 @@
+import json
+import queue
+from bisect import bisect_left
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
 from datetime import datetime
-from typing import List, Tuple, Optional, Dict, Any
-from config import DB_NAME, HISTORY_LIMIT, WEIGHT_HISTORY_LIMIT_PER_STUDENT
+from typing import List, Tuple, Optional, Dict, Any, Iterator, ContextManager, Callable, Iterable
+from student_directory import StudentDirectory
+from group_directory import GroupDirectory, GroupSettings, DEFAULT_SETTINGS
+from migrations import run_migrations
+import position_stats
+from timeutil import now_ts
+from config import (
+    DB_NAME, HISTORY_LIMIT, WEIGHT_HISTORY_LIMIT_PER_STUDENT,
+    DB_READ_POOL_SIZE, DB_SYNCHRONOUS, DB_CACHE_SIZE_KB, DB_MMAP_SIZE,
+    DB_STATEMENT_CACHE, DB_BUSY_TIMEOUT_MS, DEFAULT_GROUP_ID, SNAPSHOT_INTERVAL, EXPORT_BATCH_SIZE
+)
 
-def _connect() -> sqlite3.Connection:
-    return sqlite3.connect(DB_NAME)
+class ConnectionManager:
+    def __init__(self, path: str, readers: int = DB_READ_POOL_SIZE) -> None:
+        self.path = path
+        self._max_readers = max(1, readers)
+        self._readers: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        self._opened_readers: List[sqlite3.Connection] = []
+        self._pool_lock = threading.Lock()
+        self._writer: Optional[sqlite3.Connection] = None
+        self._write_lock = threading.RLock()
+        self._write_owner: Optional[int] = None
+        self._write_depth = 0
+        self._on_commit: List[Callable[[], None]] = []
+        self._savepoint_marks: List[int] = []
 
-def migrate_database() -> None:
-    with _connect() as conn:
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path, isolation_level=None, check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE
+        )
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        if _trace_hooks:
+            conn.set_trace_callback(_run_trace_hooks)
+        return conn
+
+    def _acquire_reader(self) -> sqlite3.Connection:
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._pool_lock:
+            if len(self._opened_readers) < self._max_readers:
+                conn = self._open()
+                self._opened_readers.append(conn)
+                return conn
+        return self._readers.get()
+
+    @contextmanager
+    def write(self) -> Iterator[sqlite3.Connection]:
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self._open()
+            conn = self._writer
+            depth = self._write_depth
+            if depth == 0:
+                started = time.perf_counter()
+                conn.execute("BEGIN IMMEDIATE")
+                self._write_owner = threading.get_ident()
+            else:
+                conn.execute(f"SAVEPOINT sp{depth}")
+                self._savepoint_marks.append(len(self._on_commit))
+            self._write_depth += 1
+            try:
+                yield conn
+            except BaseException:
+                self._write_depth -= 1
+                if depth == 0:
+                    conn.execute("ROLLBACK")
+                    self._write_owner = None
+                    self._on_commit.clear()
+                    _run_timing_hooks("write", time.perf_counter() - started)
+                else:
+                    conn.execute(f"ROLLBACK TO sp{depth}")
+                    conn.execute(f"RELEASE sp{depth}")
+                    del self._on_commit[self._savepoint_marks.pop():]
+                _run_rollback_hooks()
+                raise
+            self._write_depth -= 1
+            if depth == 0:
+                try:
+                    conn.execute("COMMIT")
+                except BaseException:
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                    self._write_owner = None
+                    self._on_commit.clear()
+                    _run_timing_hooks("write", time.perf_counter() - started)
+                    _run_rollback_hooks()
+                    raise
+                self._write_owner = None
+                _run_timing_hooks("write", time.perf_counter() - started)
+                published, self._on_commit = self._on_commit, []
+                for publish in published:
+                    publish()
+            else:
+                conn.execute(f"RELEASE sp{depth}")
+                self._savepoint_marks.pop()
+
+    def after_commit(self, publish: Callable[[], None]) -> None:
+        if self._write_owner == threading.get_ident():
+            self._on_commit.append(publish)
+        else:
+            publish()
+
+    @contextmanager
+    def read(self) -> Iterator[sqlite3.Connection]:
+        if self._write_owner == threading.get_ident():
+            yield self._writer
+            return
+        conn = self._acquire_reader()
+        started = time.perf_counter()
+        try:
+            conn.execute("BEGIN")
+            try:
+                yield conn
+            finally:
+                conn.execute("COMMIT")
+        finally:
+            self._readers.put(conn)
+            _run_timing_hooks("read", time.perf_counter() - started)
+
+    def close(self) -> None:
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._pool_lock:
+            for conn in self._opened_readers:
+                conn.close()
+            self._opened_readers.clear()
+            self._readers = queue.Queue()
+
+_manager: Optional[ConnectionManager] = None
+_manager_lock = threading.Lock()
+_rollback_hooks: List[Callable[[], None]] = []
+_trace_hooks: List[Callable[[str], None]] = []
+_timing_hooks: List[Callable[[str, float], None]] = []
+
+def register_rollback_hook(hook: Callable[[], None]) -> None:
+    _rollback_hooks.append(hook)
+
+def _run_rollback_hooks() -> None:
+    for hook in _rollback_hooks:
+        hook()
+
+def register_trace_hook(hook: Callable[[str], None]) -> None:
+    _trace_hooks.append(hook)
+
+def unregister_trace_hook(hook: Callable[[str], None]) -> None:
+    if hook in _trace_hooks:
+        _trace_hooks.remove(hook)
+
+def _run_trace_hooks(statement: str) -> None:
+    for hook in _trace_hooks:
+        hook(statement)
+
+def register_timing_hook(hook: Callable[[str, float], None]) -> None:
+    _timing_hooks.append(hook)
+
+def _run_timing_hooks(mode: str, seconds: float) -> None:
+    for hook in _timing_hooks:
+        hook(mode, seconds)
+
+def get_manager() -> ConnectionManager:
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = ConnectionManager(DB_NAME)
+    return _manager
+
+def open_db(path: str) -> ConnectionManager:
+    global _manager
+    with _manager_lock:
+        if _manager is not None:
+            _manager.close()
+        _manager = ConnectionManager(path)
+    student_directory.invalidate()
+    group_directory.invalidate()
+    return _manager
+
+def close_db() -> None:
+    global _manager
+    with _manager_lock:
+        if _manager is not None:
+            _manager.close()
+            _manager = None
+
+def transaction() -> ContextManager[sqlite3.Connection]:
+    return get_manager().write()
+
+def _read() -> ContextManager[sqlite3.Connection]:
+    return get_manager().read()
+
+def _write() -> ContextManager[sqlite3.Connection]:
+    return get_manager().write()
+
+def _after_commit(publish: Callable[[], None]) -> None:
+    get_manager().after_commit(publish)
+
+def _load_students() -> List[Tuple[int, str, float, int, int]]:
+    with _read() as conn:
         cur = conn.cursor()
-        cur.execute("PRAGMA table_info(queue_items)")
-        cols = [r[1] for r in cur.fetchall()]
-        if 'is_added' not in cols:
-            cur.execute("ALTER TABLE queue_items ADD COLUMN is_added INTEGER NOT NULL DEFAULT 0")
-            conn.commit()
+        cur.execute("SELECT id, name, weight, active, group_id FROM students ORDER BY id")
+        return cur.fetchall()
 
-def init_db() -> None:
-    with _connect() as conn:
+def _load_groups() -> Tuple[List[Tuple[int, Optional[str], Optional[float], Optional[float], Optional[float]]], List[Tuple[int, int]]]:
+    with _read() as conn:
         cur = conn.cursor()
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS students (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            weight REAL NOT NULL DEFAULT 1.0,
-            active INTEGER NOT NULL DEFAULT 1
-        )""")
+        cur.execute("SELECT id, title, k_factor, weight_min, weight_max FROM groups")
+        groups = cur.fetchall()
+        cur.execute("SELECT group_id, user_id FROM group_admins")
+        return groups, cur.fetchall()
 
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS queues (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            subject TEXT,
-            created_at TEXT,
-            updated_at TEXT,
-            change_log TEXT
-        )""")
+student_directory = StudentDirectory(_load_students)
+group_directory = GroupDirectory(_load_groups)
 
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS queue_items (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            queue_id INTEGER NOT NULL,
-            position INTEGER NOT NULL,
-            student_id INTEGER NOT NULL,
-            is_priority INTEGER NOT NULL DEFAULT 0,
-            is_late INTEGER NOT NULL DEFAULT 0,
-            weight_before REAL,
-            weight_after REAL,
-            FOREIGN KEY(queue_id) REFERENCES queues(id),
-            FOREIGN KEY(student_id) REFERENCES students(id)
-        )""")
+def migrate_database() -> None:
+    with _write() as conn:
+        run_migrations(conn)
 
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS weight_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            student_id INTEGER NOT NULL,
-            weight REAL NOT NULL,
-            timestamp TEXT NOT NULL,
-            place_info TEXT,
-            FOREIGN KEY(student_id) REFERENCES students(id)
-        )""")
+def init_db() -> None:
+    migrate_database()
+    student_directory.reload()
+    group_directory.reload()
 
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS meta (
-            key TEXT PRIMARY KEY,
-            value TEXT
-        )""")
-        conn.commit()
-        migrate_database()
-
-def add_student(name: str, initial_weight: float = 1.0, active: int = 1) -> int:
-    with _connect() as conn:
-        cur = conn.cursor()
-        cur.execute("INSERT INTO students (name, weight, active) VALUES (?, ?, ?)", (name, initial_weight, active))
-        conn.commit()
-        return cur.lastrowid
+def add_student(name: str, initial_weight: float = 1.0, active: int = 1, group_id: int = DEFAULT_GROUP_ID) -> int:
+    with _write() as conn:
+        cur = conn.cursor()
+        cur.execute("INSERT INTO students (name, weight, active, group_id) VALUES (?, ?, ?, ?)", (name, initial_weight, active, group_id))
+        sid = cur.lastrowid
+        _after_commit(partial(student_directory.put, sid, name, initial_weight, active, group_id))
+        return sid
 
 def get_student_name(student_id: int) -> str:
-    with _connect() as conn:
+    return student_directory.name(student_id)
+
+def get_active_students(group_id: int = DEFAULT_GROUP_ID) -> List[Tuple[int, str, float]]:
+    return [(sid, name, w) for sid, name, w, active in student_directory.rows(group_id) if active]
+
+def get_full_list(group_id: int = DEFAULT_GROUP_ID) -> List[Tuple[int, str, int]]:
+    return [(sid, name, active) for sid, name, w, active in student_directory.rows(group_id)]
+
+def get_group_weights(group_id: int = DEFAULT_GROUP_ID) -> Dict[int, float]:
+    return {sid: w for sid, name, w, active in student_directory.rows(group_id)}
+
+def get_all_weights(group_id: int = DEFAULT_GROUP_ID) -> List[Tuple[str, float]]:
+    return sorted(((name, w) for sid, name, w, active in student_directory.rows(group_id)), key=lambda r: r[1], reverse=True)
+
+def get_students_page(
+    group_id: int = DEFAULT_GROUP_ID,
+    cursor: Optional[Tuple[str, int]] = None,
+    backward: bool = False,
+    limit: int = 20,
+    exclude_queue_id: Optional[int] = None,
+) -> Tuple[List[Tuple[int, str, int]], bool, bool]:
+    where = "group_id=?"
+    params: List[Any] = [group_id]
+    if exclude_queue_id is not None:
+        where += " AND id NOT IN (SELECT student_id FROM queue_items WHERE queue_id=?)"
+        params.append(exclude_queue_id)
+    op, order = ("<", "DESC") if backward else (">", "ASC")
+    with _read() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT name FROM students WHERE id=?", (student_id,))
-        r = cur.fetchone()
-        return r[0] if r else str(student_id)
+        if cursor is None:
+            cur.execute(f"SELECT id, name, active FROM students WHERE {where} ORDER BY name {order}, id {order} LIMIT ?", (*params, limit + 1))
+        else:
+            cur.execute(f"SELECT id, name, active FROM students WHERE {where} AND (name, id) {op} (?, ?) ORDER BY name {order}, id {order} LIMIT ?",
+                        (*params, *cursor, limit + 1))
+        rows = cur.fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if backward:
+            rows.reverse()
+        if not rows:
+            return rows, False, False
+        if backward:
+            return rows, more, True
+        edge = rows[0]
+        cur.execute(f"SELECT 1 FROM students WHERE {where} AND (name, id) < (?, ?) LIMIT 1", (*params, edge[1], edge[0]))
+        return rows, cur.fetchone() is not None, more
 
-def get_active_students() -> List[Tuple[int, str, float]]:
-    with _connect() as conn:
+def get_student_initials(group_id: int = DEFAULT_GROUP_ID) -> List[str]:
+    with _read() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT id, name, weight FROM students WHERE active=1")
-        return cur.fetchall()
+        cur.execute("SELECT DISTINCT substr(name, 1, 1) FROM students WHERE group_id=? ORDER BY 1", (group_id,))
+        return [r[0] for r in cur.fetchall() if r[0]]
+
+def apply_weight_updates(updates: List[Tuple[int, float, Optional[str]]]) -> None:
+    if not updates:
+        return
+    with _write():
+        set_student_weights([(sid, w) for sid, w, _ in updates])
+        record_weight_history(updates)
 
-def get_full_list() -> List[Tuple[int, str, int]]:
-    with _connect() as conn:
+def set_student_weights(updates: List[Tuple[int, float]]) -> None:
+    if not updates:
+        return
+    with _write() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT id, name, active FROM students ORDER BY id")
-        return cur.fetchall()
+        cur.executemany("UPDATE students SET weight=? WHERE id=?", [(w, sid) for sid, w in updates])
+        _after_commit(partial(student_directory.set_weights, updates))
 
-def get_all_weights() -> List[Tuple[str, float]]:
-    with _connect() as conn:
+def record_weight_history(entries: List[Tuple[int, float, Optional[str]]]) -> None:
+    if not entries:
+        return
+    ts = now_ts()
+    with _write() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT name, weight FROM students ORDER BY weight DESC")
-        return cur.fetchall()
+        cur.executemany("INSERT INTO weight_history (student_id, weight, timestamp, place_info) VALUES (?, ?, ?, ?)",
+                        [(sid, w, ts, place) for sid, w, place in entries])
 
-def update_weight(student_id: int, new_weight: float, place_info: Optional[str] = None) -> None:
-    ts = datetime.now().strftime("%d.%m.%Y %H:%M:%S")
-    with _connect() as conn:
+def get_weight_history(student_id: int, limit: int = 10, since: Optional[int] = None) -> List[Tuple[float, int, Optional[str]]]:
+    with _read() as conn:
         cur = conn.cursor()
-        cur.execute("UPDATE students SET weight=? WHERE id=?", (new_weight, student_id))
-        cur.execute("INSERT INTO weight_history (student_id, weight, timestamp, place_info) VALUES (?, ?, ?, ?)",
-                    (student_id, new_weight, ts, place_info))
-        cur.execute("""
-            DELETE FROM weight_history WHERE id IN (
-                SELECT id FROM weight_history WHERE student_id=? ORDER BY id DESC LIMIT -1 OFFSET ?
-            )
-        """, (student_id, WEIGHT_HISTORY_LIMIT_PER_STUDENT))
-        conn.commit()
+        if since is None:
+            cur.execute("""
+                SELECT weight, timestamp, place_info FROM (
+                    SELECT id, weight, timestamp, place_info FROM weight_history WHERE student_id=?
+                    UNION ALL
+                    SELECT id, weight, timestamp, place_info FROM weight_history_archive WHERE student_id=?
+                ) ORDER BY id DESC LIMIT ?
+            """, (student_id, student_id, limit))
+        else:
+            cur.execute("""
+                SELECT weight, timestamp, place_info FROM (
+                    SELECT id, weight, timestamp, place_info FROM weight_history WHERE student_id=? AND timestamp >= ?
+                    UNION ALL
+                    SELECT id, weight, timestamp, place_info FROM weight_history_archive WHERE student_id=? AND timestamp >= ?
+                ) ORDER BY timestamp DESC, id DESC LIMIT ?
+            """, (student_id, since, student_id, since, limit))
+        return cur.fetchall()
 
-def get_weight_history(student_id: int, limit: int = 10) -> List[Tuple[float, str, Optional[str]]]:
-    with _connect() as conn:
+def get_group_weight_history(group_id: int = DEFAULT_GROUP_ID, per_student: int = 11, since: Optional[int] = None) -> List[Tuple[int, float, int, Optional[str]]]:
+    with _read() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT weight, timestamp, place_info FROM weight_history WHERE student_id=? ORDER BY id DESC LIMIT ?",
-                    (student_id, limit))
+        cur.execute("""
+            SELECT student_id, weight, timestamp, place_info FROM (
+                SELECT id, student_id, weight, timestamp, place_info,
+                       ROW_NUMBER() OVER (PARTITION BY student_id ORDER BY id DESC) AS rn
+                FROM (
+                    SELECT id, student_id, weight, timestamp, place_info FROM weight_history
+                    WHERE student_id IN (SELECT id FROM students WHERE group_id=?) AND timestamp >= ?
+                    UNION ALL
+                    SELECT id, student_id, weight, timestamp, place_info FROM weight_history_archive
+                    WHERE student_id IN (SELECT id FROM students WHERE group_id=?) AND timestamp >= ?
+                )
+            ) WHERE rn <= ? ORDER BY student_id, id
+        """, (group_id, since or 0, group_id, since or 0, per_student))
         return cur.fetchall()
 
-def enable_all_students() -> None:
-    with _connect() as conn:
+def enable_all_students(group_id: int = DEFAULT_GROUP_ID) -> None:
+    with _write() as conn:
         cur = conn.cursor()
-        cur.execute("UPDATE students SET active=1")
-        conn.commit()
+        cur.execute("UPDATE students SET active=1 WHERE group_id=?", (group_id,))
+        _after_commit(partial(student_directory.set_all_active, 1, group_id))
 
-def toggle_student_status(student_id: int, status: int) -> None:
-    with _connect() as conn:
+def reset_all_weights(group_id: int = DEFAULT_GROUP_ID) -> None:
+    with _write() as conn:
         cur = conn.cursor()
-        cur.execute("UPDATE students SET active=? WHERE id=?", (status, student_id))
-        conn.commit()
+        cur.execute("UPDATE students SET weight=1.0 WHERE group_id=?", (group_id,))
+        cur.execute("DELETE FROM weight_history WHERE student_id IN (SELECT id FROM students WHERE group_id=?)", (group_id,))
+        cur.execute("DELETE FROM weight_history_archive WHERE student_id IN (SELECT id FROM students WHERE group_id=?)", (group_id,))
+        cur.execute("SELECT MAX(id) FROM queues WHERE group_id=?", (group_id,))
+        append_op(group_id, cur.fetchone()[0], "reset", {})
+        _after_commit(partial(student_directory.set_all_weights, 1.0, group_id))
 
-def create_queue_record(subject: str) -> int:
-    now = datetime.now().strftime("%d.%m.%Y %H:%M:%S")
-    with _connect() as conn:
+def toggle_student_status(student_id: int, status: int, group_id: int = DEFAULT_GROUP_ID) -> None:
+    with _write() as conn:
         cur = conn.cursor()
-        cur.execute("INSERT INTO queues (subject, created_at, updated_at, change_log) VALUES (?, ?, ?, ?)",
-                    (subject, now, now, f"Создана очередь '{subject}'"))
-        conn.commit()
-        qid = cur.lastrowid
-        _enforce_queue_history_limit(cur)
-        conn.commit()
-        return qid
+        cur.execute("UPDATE students SET active=? WHERE id=? AND group_id=?", (status, student_id, group_id))
+        if cur.rowcount:
+            _after_commit(partial(student_directory.set_active, student_id, status))
 
-def _enforce_queue_history_limit(cur: sqlite3.Cursor) -> None:
-    cur.execute("SELECT COUNT(*) FROM queues")
-    total = cur.fetchone()[0]
-    if total > HISTORY_LIMIT:
-        to_delete = total - HISTORY_LIMIT
-        cur.execute("DELETE FROM queue_items WHERE queue_id IN (SELECT id FROM queues ORDER BY id ASC LIMIT ?)", (to_delete,))
-        cur.execute("DELETE FROM queues WHERE id IN (SELECT id FROM queues ORDER BY id ASC LIMIT ?)", (to_delete,))
+def _bump_queue_versions(cur: sqlite3.Cursor, queue_ids: Iterable[int]) -> None:
+    cur.executemany("UPDATE queues SET version = version + 1 WHERE id=?", [(qid,) for qid in set(queue_ids)])
 
-def add_queue_item(queue_id: int, position: int, student_id: int, is_priority: int, is_late: int, weight_before: float, weight_after: Optional[float] = None) -> int:
-    with _connect() as conn:
+def create_queue_record(subject: str, group_id: int = DEFAULT_GROUP_ID, settings: GroupSettings = DEFAULT_SETTINGS) -> int:
+    now = now_ts()
+    with _write() as conn:
         cur = conn.cursor()
         cur.execute("""
-            INSERT INTO queue_items
-            (queue_id, position, student_id, is_priority, is_late, weight_before, weight_after, is_added)
-            VALUES (?, ?, ?, ?, ?, ?, ?, 0)
-        """, (queue_id, position, student_id, is_priority, is_late, weight_before, weight_after))
-        conn.commit()
+            INSERT INTO queues (subject, created_at, updated_at, change_log, group_id, k_factor, weight_min, weight_max)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (subject, now, now, f"Создана очередь '{subject}'", group_id, *settings))
         return cur.lastrowid
 
-def get_recent_queues(limit: Optional[int] = None) -> List[Tuple[int, str, str, str, str]]:
+def add_queue_items(queue_id: int, items: List[Tuple[int, int, int, int, float, Optional[float], Optional[int], Optional[int]]]) -> None:
+    with _write() as conn:
+        cur = conn.cursor()
+        cur.executemany("""
+            INSERT INTO queue_items
+            (queue_id, position, student_id, is_priority, is_late, weight_before, weight_after, is_added, slot, slot_total)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?, ?)
+        """, [(queue_id, *itm) for itm in items])
+        _bump_queue_versions(cur, [queue_id])
+
+def get_recent_queues(limit: Optional[int] = None, group_id: int = DEFAULT_GROUP_ID) -> List[Tuple[int, str, int, int, str]]:
+    limit = limit or HISTORY_LIMIT
+    with _read() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, subject, created_at, updated_at, change_log FROM queues WHERE group_id=? ORDER BY id DESC LIMIT ?",
+                    (group_id, limit))
+        return cur.fetchall()
+
+def get_queues_by_subject(
+    subject: str,
+    since: Optional[int] = None,
+    until: Optional[int] = None,
+    group_id: int = DEFAULT_GROUP_ID,
+    limit: Optional[int] = None,
+) -> List[Tuple[int, str, int, int, str]]:
     limit = limit or HISTORY_LIMIT
-    with _connect() as conn:
+    with _read() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT id, subject, created_at, updated_at, change_log FROM queues ORDER BY id DESC LIMIT ?", (limit,))
+        bounds = (group_id, subject, since if since is not None else 0, until if until is not None else 2 ** 62)
+        cur.execute("""
+            SELECT id, subject, created_at, updated_at, change_log FROM (
+                SELECT id, subject, created_at, updated_at, change_log FROM queues
+                WHERE group_id=? AND subject=? AND created_at BETWEEN ? AND ?
+                UNION ALL
+                SELECT id, subject, created_at, updated_at, change_log FROM queues_archive
+                WHERE group_id=? AND subject=? AND created_at BETWEEN ? AND ?
+            ) ORDER BY created_at DESC, id DESC LIMIT ?
+        """, (*bounds, *bounds, limit))
         return cur.fetchall()
 
 def get_queue(queue_id: int) -> Optional[Dict[str, Any]]:
-    with _connect() as conn:
+    with _read() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT id, subject, created_at, updated_at, change_log FROM queues WHERE id=?", (queue_id,))
-        qmeta = cur.fetchone()
-        if not qmeta:
+        cur.execute("SELECT id, subject, created_at, updated_at, change_log, version, group_id, frozen FROM queues WHERE id=?", (queue_id,))
+        row = cur.fetchone()
+        if not row:
             return None
+        qmeta, version, group_id, frozen = row[:5], row[5], row[6], row[7]
         cur.execute("""
             SELECT position, student_id, is_priority, is_late, weight_before, weight_after, is_added
             FROM queue_items WHERE queue_id=? ORDER BY position
         """, (queue_id,))
         items = cur.fetchall()
-        return {"meta": qmeta, "items": items}
+        return {"meta": qmeta, "items": items, "version": version, "group_id": group_id, "frozen": frozen}
+
+def get_archived_queue(queue_id: int) -> Optional[Dict[str, Any]]:
+    with _read() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, subject, created_at, updated_at, change_log, version, group_id FROM queues_archive WHERE id=?", (queue_id,))
+        row = cur.fetchone()
+        if not row:
+            return None
+        cur.execute("""
+            SELECT position, student_id, is_priority, is_late, weight_before, weight_after, is_added
+            FROM queue_items_archive WHERE queue_id=? ORDER BY position
+        """, (queue_id,))
+        return {"meta": row[:5], "items": cur.fetchall(), "version": row[5], "group_id": row[6], "archived": True}
+
+def get_archived_queues(group_id: int = DEFAULT_GROUP_ID, before_id: Optional[int] = None, limit: Optional[int] = None) -> List[Tuple[int, str, int, int, str]]:
+    limit = limit or HISTORY_LIMIT
+    with _read() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT id, subject, created_at, updated_at, change_log FROM queues_archive
+            WHERE group_id=? AND id < ? ORDER BY id DESC LIMIT ?
+        """, (group_id, before_id if before_id is not None else 2 ** 62, limit))
+        return cur.fetchall()
+
+def compact_group(group_id: int = DEFAULT_GROUP_ID, keep_queues: int = HISTORY_LIMIT, keep_history: int = WEIGHT_HISTORY_LIMIT_PER_STUDENT) -> Dict[str, Any]:
+    with _write() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM queues WHERE group_id=? ORDER BY id DESC LIMIT 1 OFFSET ?", (group_id, max(keep_queues, 1) - 1))
+        row = cur.fetchone()
+        archived: List[int] = []
+        if row is not None:
+            cur.execute("SELECT id FROM queues WHERE group_id=? AND id < ?", (group_id, row[0]))
+            archived = [r[0] for r in cur.fetchall()]
+        if archived:
+            old = "SELECT id FROM queues WHERE group_id=? AND id < ?"
+            cur.execute(f"""
+                INSERT INTO queue_items_archive
+                (id, queue_id, position, student_id, is_priority, is_late, weight_before, weight_after, is_added, slot, slot_total)
+                SELECT id, queue_id, position, student_id, is_priority, is_late, weight_before, weight_after, is_added, slot, slot_total
+                FROM queue_items WHERE queue_id IN ({old})
+            """, (group_id, row[0]))
+            cur.execute(f"""
+                INSERT INTO queues_archive
+                (id, subject, created_at, updated_at, change_log, version, group_id, frozen, k_factor, weight_min, weight_max)
+                SELECT id, subject, created_at, updated_at, change_log, version, group_id, frozen, k_factor, weight_min, weight_max
+                FROM queues WHERE id IN ({old})
+            """, (group_id, row[0]))
+            cur.execute(f"DELETE FROM queue_items WHERE queue_id IN ({old})", (group_id, row[0]))
+            cur.execute(f"DELETE FROM queues WHERE id IN ({old})", (group_id, row[0]))
+
+        stale = """
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (PARTITION BY student_id ORDER BY id DESC) AS rn
+                FROM weight_history WHERE student_id IN (SELECT id FROM students WHERE group_id=?)
+            ) WHERE rn > ?
+        """
+        cur.execute(f"""
+            INSERT INTO weight_history_archive (id, student_id, weight, timestamp, place_info)
+            SELECT id, student_id, weight, timestamp, place_info FROM weight_history WHERE id IN ({stale})
+        """, (group_id, keep_history))
+        history = cur.rowcount
+        if history:
+            cur.execute(f"DELETE FROM weight_history WHERE id IN ({stale})", (group_id, keep_history))
+        prune_snapshots(group_id)
+        return {"group_id": group_id, "queues": archived, "weight_history": history}
+
+def get_compactable_groups() -> List[int]:
+    with _read() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT DISTINCT group_id FROM queues")
+        return [r[0] for r in cur.fetchall()]
+
+_STATS_COLUMNS = ", ".join(position_stats.FIELDS)
+
+def get_position_stats(group_id: int, keys: Iterable[position_stats.StatsKey]) -> Dict[position_stats.StatsKey, Dict[str, Any]]:
+    keys = set(keys)
+    if not keys:
+        return {}
+    sids = sorted({k[0] for k in keys})
+    subjects = sorted({k[1] for k in keys})
+    with _read() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT student_id, subject, {_STATS_COLUMNS} FROM student_stats
+            WHERE group_id=? AND student_id IN ({",".join("?" * len(sids))}) AND subject IN ({",".join("?" * len(subjects))})
+        """, (group_id, *sids, *subjects))
+        found = {(r[0], r[1]): dict(zip(position_stats.FIELDS, r[2:])) for r in cur.fetchall()}
+    return {k: found.get(k) or position_stats.empty_stats() for k in keys}
+
+def save_position_stats(group_id: int, stats: Dict[position_stats.StatsKey, Dict[str, Any]]) -> None:
+    if not stats:
+        return
+    columns = ("group_id", "student_id", "subject") + position_stats.FIELDS
+    with _write() as conn:
+        cur = conn.cursor()
+        cur.executemany(
+            f"INSERT OR REPLACE INTO student_stats ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            [(group_id, sid, subject, *(entry[f] for f in position_stats.FIELDS)) for (sid, subject), entry in stats.items()]
+        )
+
+def get_queue_placements(queue_id: int, positions: Iterable[int]) -> Dict[int, position_stats.Placement]:
+    positions = sorted(set(positions))
+    with _read() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT position, student_id, slot, slot_total, is_added FROM queue_items
+            WHERE queue_id=? AND position IN ({",".join("?" * len(positions))})
+        """, (queue_id, *positions))
+        return {r[0]: r[1:] for r in cur.fetchall()}
+
+def get_student_placements(group_id: int, student_ids: Iterable[int]) -> List[Tuple[int, int, str, int, int]]:
+    sids = sorted(set(student_ids))
+    if not sids:
+        return []
+    marks = ",".join("?" * len(sids))
+    with _read() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT i.student_id, q.id, q.subject, i.slot, i.slot_total, i.position FROM queue_items i
+            JOIN queues q ON q.id = i.queue_id WHERE q.group_id=? AND i.student_id IN ({marks}) AND i.slot IS NOT NULL
+            UNION ALL
+            SELECT i.student_id, q.id, q.subject, i.slot, i.slot_total, i.position FROM queue_items_archive i
+            JOIN queues_archive q ON q.id = i.queue_id WHERE q.group_id=? AND i.student_id IN ({marks}) AND i.slot IS NOT NULL
+            ORDER BY 2, 6
+        """, (group_id, *sids, group_id, *sids))
+        return [r[:5] for r in cur.fetchall()]
+
+def get_student_stats(student_id: int, group_id: int = DEFAULT_GROUP_ID) -> List[Tuple[str, Dict[str, Any]]]:
+    with _read() as conn:
+        cur = conn.cursor()
+        cur.execute(f"SELECT subject, {_STATS_COLUMNS} FROM student_stats WHERE group_id=? AND student_id=? ORDER BY subject",
+                    (group_id, student_id))
+        return [(r[0], dict(zip(position_stats.FIELDS, r[1:]))) for r in cur.fetchall()]
+
+_EXPORT_QUERIES: Dict[str, Tuple[Tuple[str, str], ...]] = {
+    "students": (
+        ("SELECT id, name, weight, active, group_id FROM students {where} ORDER BY id", "group_id"),
+    ),
+    "queues": (
+        ("SELECT id, subject, created_at, updated_at, change_log, version, group_id, 0 FROM queues {where} ORDER BY id", "group_id"),
+        ("SELECT id, subject, created_at, updated_at, change_log, version, group_id, 1 FROM queues_archive {where} ORDER BY id", "group_id"),
+    ),
+    "queue_items": (
+        ("""SELECT i.queue_id, i.position, i.student_id, i.is_priority, i.is_late, i.weight_before, i.weight_after, i.is_added, i.slot, i.slot_total, 0
+            FROM queue_items i JOIN queues q ON q.id = i.queue_id {where} ORDER BY i.id""", "q.group_id"),
+        ("""SELECT i.queue_id, i.position, i.student_id, i.is_priority, i.is_late, i.weight_before, i.weight_after, i.is_added, i.slot, i.slot_total, 1
+            FROM queue_items_archive i JOIN queues_archive q ON q.id = i.queue_id {where} ORDER BY i.id""", "q.group_id"),
+    ),
+    "weight_history": (
+        ("""SELECT h.id, h.student_id, h.weight, h.timestamp, h.place_info, 0
+            FROM weight_history h JOIN students s ON s.id = h.student_id {where} ORDER BY h.id""", "s.group_id"),
+        ("""SELECT h.id, h.student_id, h.weight, h.timestamp, h.place_info, 1
+            FROM weight_history_archive h JOIN students s ON s.id = h.student_id {where} ORDER BY h.id""", "s.group_id"),
+    ),
+}
+
+def iter_export_rows(table: str, group_id: Optional[int] = None, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[List[Tuple[Any, ...]]]:
+    with _read() as conn:
+        cur = conn.cursor()
+        for sql, group_column in _EXPORT_QUERIES[table]:
+            if group_id is None:
+                cur.execute(sql.format(where=""))
+            else:
+                cur.execute(sql.format(where=f"WHERE {group_column}=?"), (group_id,))
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+
+def get_queue_items_page(queue_id: int, cursor: Optional[int] = None, backward: bool = False, limit: int = 20) -> Tuple[List[Tuple[int, int, int, int, float, float, int]], bool, bool]:
+    op, order = ("<", "DESC") if backward else (">", "ASC")
+    with _read() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT position, student_id, is_priority, is_late, weight_before, weight_after, is_added
+            FROM queue_items WHERE queue_id=? AND position {op} ? ORDER BY position {order} LIMIT ?
+        """, (queue_id, cursor if cursor is not None else (2 ** 62 if backward else 0), limit + 1))
+        rows = cur.fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if backward:
+            rows.reverse()
+            return rows, more, bool(rows)
+        return rows, bool(rows) and rows[0][0] > 1, more
+
+def get_queue_version(queue_id: int, group_id: int = DEFAULT_GROUP_ID) -> Optional[int]:
+    with _read() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT version FROM queues WHERE id=? AND group_id=?", (queue_id, group_id))
+        r = cur.fetchone()
+        return r[0] if r else None
+
+def get_latest_queue_version(group_id: int = DEFAULT_GROUP_ID) -> Optional[Tuple[int, int]]:
+    with _read() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, version FROM queues WHERE group_id=? ORDER BY id DESC LIMIT 1", (group_id,))
+        return cur.fetchone()
+
+def get_oldest_queue_id(group_id: int = DEFAULT_GROUP_ID) -> Optional[int]:
+    with _read() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT MIN(id) FROM queues WHERE group_id=?", (group_id,))
+        return cur.fetchone()[0]
 
 def update_queue_timestamp_and_log(queue_id: int, log_text: str) -> None:
-    now = datetime.now().strftime("%d.%m.%Y %H:%M:%S")
-    with _connect() as conn:
+    now = now_ts()
+    with _write() as conn:
         cur = conn.cursor()
-        cur.execute("UPDATE queues SET updated_at=?, change_log=? WHERE id=?", (now, log_text, queue_id))
-        conn.commit()
+        cur.execute("UPDATE queues SET updated_at=?, change_log=?, version = version + 1 WHERE id=?", (now, log_text, queue_id))
 
 def swap_queue_positions(queue_id: int, pos1: int, pos2: int) -> None:
-    with _connect() as conn:
+    with _write() as conn:
         cur = conn.cursor()
         cur.execute("SELECT id, student_id, is_priority, is_late, weight_before, weight_after FROM queue_items WHERE queue_id=? AND position=?",
                     (queue_id, pos1))
@@ -210,27 +684,55 @@ def swap_queue_positions(queue_id: int, pos1: int, pos2: int) -> None:
         cur.execute("""
             UPDATE queue_items SET student_id=?, is_priority=?, is_late=?, weight_before=?, weight_after=?, is_added=? WHERE queue_id=? AND position=?
         """, (r1[1], r1[2], r1[3], r1[4], r1[5], r1[6] if len(r1) > 6 else 0, queue_id, pos2))
-        conn.commit()
+        _bump_queue_versions(cur, [queue_id])
 
-def delete_queue_item(queue_id: int, position: int) -> Tuple[int, Optional[float], Optional[float]]:
-    with _connect() as conn:
+def delete_queue_items(queue_id: int, positions: List[int]) -> None:
+    positions = sorted(set(positions))
+    if not positions:
+        return
+    with _write() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT student_id, weight_before, weight_after FROM queue_items WHERE queue_id=? AND position=?", (queue_id, position))
-        row = cur.fetchone()
-        if not row:
-            raise ValueError("No such position")
-        student_id, weight_before, weight_after = row
-        cur.execute("DELETE FROM queue_items WHERE queue_id=? AND position=?", (queue_id, position))
-        cur.execute("UPDATE queue_items SET position = position - 1 WHERE queue_id=? AND position > ?", (queue_id, position))
-        conn.commit()
-        return student_id, weight_before, weight_after
+        cur.executemany("DELETE FROM queue_items WHERE queue_id=? AND position=?", [(queue_id, p) for p in positions])
+        cur.execute("SELECT position FROM queue_items WHERE queue_id=? AND position > ? ORDER BY position", (queue_id, positions[0]))
+        shifts = [(pos - bisect_left(positions, pos), queue_id, pos) for pos, in cur.fetchall()]
+        cur.executemany("UPDATE queue_items SET position=? WHERE queue_id=? AND position=?", shifts)
+        _bump_queue_versions(cur, [queue_id])
+
+def add_students_to_existing_queue(queue_id: int, student_ids: List[int]) -> List[Tuple[int, float]]:
+    if not student_ids:
+        return []
+    with _write() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT MAX(position) FROM queue_items WHERE queue_id=?", (queue_id,))
+        last = cur.fetchone()[0] or 0
+        cur.execute("SELECT group_id FROM queues WHERE id=?", (queue_id,))
+        group_id = cur.fetchone()[0]
+        marks = ",".join("?" * len(student_ids))
+        cur.execute(f"""
+            SELECT id, weight FROM students
+            WHERE group_id=? AND id IN ({marks})
+        """, (group_id, *student_ids))
+        weights = dict(cur.fetchall())
+        missing = [sid for sid in student_ids if sid not in weights]
+        if missing:
+            raise ValueError(f"Student {missing[0]} not found")
+        added = [(last + i, weights[sid]) for i, sid in enumerate(student_ids, start=1)]
+        cur.executemany("""
+            INSERT INTO queue_items (queue_id, position, student_id, is_priority, is_late, weight_before, weight_after, is_added)
+            VALUES (?, ?, ?, 0, 0, ?, ?, 1)
+        """, [(queue_id, pos, sid, w, w) for sid, (pos, w) in zip(student_ids, added)])
+        _bump_queue_versions(cur, [queue_id])
+        append_op(group_id, queue_id, "add", {"students": student_ids})
+        return added
 
 def add_student_to_existing_queue(queue_id: int, student_id: int, is_priority: int = 0, is_late: int = 0) -> Tuple[int, float]:
-    with _connect() as conn:
+    with _write() as conn:
         cur = conn.cursor()
         cur.execute("SELECT MAX(position) FROM queue_items WHERE queue_id=?", (queue_id,))
         last = cur.fetchone()[0] or 0
-        cur.execute("SELECT weight FROM students WHERE id=?", (student_id,))
+        cur.execute("SELECT group_id FROM queues WHERE id=?", (queue_id,))
+        group_id = cur.fetchone()[0]
+        cur.execute("SELECT weight FROM students WHERE id=? AND group_id=?", (student_id, group_id))
         student_row = cur.fetchone()
         if not student_row:
             raise ValueError(f"Student {student_id} not found")
@@ -239,39 +741,240 @@ def add_student_to_existing_queue(queue_id: int, student_id: int, is_priority: i
             INSERT INTO queue_items (queue_id, position, student_id, is_priority, is_late, weight_before, weight_after, is_added)
             VALUES (?, ?, ?, ?, ?, ?, ?, 1)
         """, (queue_id, last+1, student_id, is_priority, is_late, w, None))
-        conn.commit()
+        _bump_queue_versions(cur, [queue_id])
+        append_op(group_id, queue_id, "add", {"students": [student_id], "priority": is_priority, "late": is_late})
         return last+1, w
 
-def set_queue_item_weights(queue_id: int, pos: int, weight_before: float, weight_after: float) -> None:
-    with _connect() as conn:
+def set_queue_items_weights(updates: List[Tuple[int, int, float, float]]) -> None:
+    if not updates:
+        return
+    with _write() as conn:
         cur = conn.cursor()
-        cur.execute("""
+        cur.executemany("""
             UPDATE queue_items SET weight_before=?, weight_after=? WHERE queue_id=? AND position=?
-        """, (weight_before, weight_after, queue_id, pos))
-        conn.commit()
+        """, [(wb, wa, qid, pos) for qid, pos, wb, wa in updates])
+        _bump_queue_versions(cur, (u[0] for u in updates))
 
-def get_following_queue_ids(start_queue_id: int) -> List[int]:
-    with _connect() as conn:
+def get_queue_items_from(start_queue_id: int, group_id: int = DEFAULT_GROUP_ID) -> List[Tuple[int, int, int, int, int, float, float, int, Optional[int], Optional[int]]]:
+    with _read() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT id FROM queues WHERE id > ? ORDER BY id ASC LIMIT ?", (start_queue_id, HISTORY_LIMIT))
-        return [r[0] for r in cur.fetchall()]
+        cur.execute("""
+            SELECT queue_id, position, student_id, is_priority, is_late, weight_before, weight_after, is_added, slot, slot_total
+            FROM queue_items
+            WHERE queue_id IN (SELECT id FROM queues WHERE group_id = ? AND id >= ?)
+            ORDER BY queue_id, position
+        """, (group_id, start_queue_id))
+        return cur.fetchall()
+
+def get_queue_items_between(group_id: int, start_queue_id: int, end_queue_id: int) -> List[Tuple[int, int, int, int, int, float, float, int, Optional[int], Optional[int]]]:
+    with _read() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT i.queue_id, i.position, i.student_id, i.is_priority, i.is_late, i.weight_before, i.weight_after, i.is_added, i.slot, i.slot_total
+            FROM queue_items i JOIN queues q ON q.id = i.queue_id WHERE q.group_id=? AND q.id >= ? AND q.id < ?
+            UNION ALL
+            SELECT i.queue_id, i.position, i.student_id, i.is_priority, i.is_late, i.weight_before, i.weight_after, i.is_added, i.slot, i.slot_total
+            FROM queue_items_archive i JOIN queues_archive q ON q.id = i.queue_id WHERE q.group_id=? AND q.id >= ? AND q.id < ?
+            ORDER BY 1, 2
+        """, (group_id, start_queue_id, end_queue_id, group_id, start_queue_id, end_queue_id))
+        return cur.fetchall()
 
 def get_student_current_weight(student_id: int) -> Optional[float]:
-    with _connect() as conn:
+    return student_directory.weight(student_id)
+
+def get_queue_by_index_from_latest(offset: int = 0, group_id: int = DEFAULT_GROUP_ID) -> Optional[int]:
+    with _read() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT weight FROM students WHERE id=?", (student_id,))
+        cur.execute("SELECT id FROM queues WHERE group_id=? ORDER BY id DESC LIMIT 1 OFFSET ?", (group_id, offset))
         r = cur.fetchone()
         return r[0] if r else None
 
-def set_student_weight_direct(student_id: int, new_weight: float) -> None:
-    with _connect() as conn:
+def get_marks(kind: str, group_id: int = DEFAULT_GROUP_ID) -> List[int]:
+    with _read() as conn:
         cur = conn.cursor()
-        cur.execute("UPDATE students SET weight=? WHERE id=?", (new_weight, student_id))
-        conn.commit()
+        cur.execute("SELECT value FROM meta WHERE key=?", (f"marks:{group_id}:{kind}",))
+        r = cur.fetchone()
+        return json.loads(r[0]) if r and r[0] else []
 
-def get_queue_by_index_from_latest(offset: int = 0) -> Optional[int]:
-    with _connect() as conn:
+def set_marks(kind: str, student_ids: List[int], group_id: int = DEFAULT_GROUP_ID) -> None:
+    with _write() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT id FROM queues ORDER BY id DESC LIMIT 1 OFFSET ?", (offset,))
-        r = cur.fetchone()
-        return r[0] if r else None
\ No newline at end of file
+        cur.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                    (f"marks:{group_id}:{kind}", json.dumps(list(student_ids))))
+
+def get_group_settings(group_id: int = DEFAULT_GROUP_ID) -> GroupSettings:
+    return group_directory.settings(group_id)
+
+def save_group(group_id: int, title: Optional[str] = None, settings: Optional[GroupSettings] = None) -> None:
+    settings = settings or group_directory.settings(group_id)
+    with _write() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO groups (id, title, k_factor, weight_min, weight_max) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                title=COALESCE(excluded.title, groups.title),
+                k_factor=excluded.k_factor,
+                weight_min=excluded.weight_min,
+                weight_max=excluded.weight_max
+        """, (group_id, title, *settings))
+        _after_commit(partial(group_directory.put, group_id, title or group_directory.title(group_id), settings))
+
+def add_group_admin(group_id: int, user_id: int) -> None:
+    with _write() as conn:
+        cur = conn.cursor()
+        cur.execute("INSERT OR IGNORE INTO group_admins (group_id, user_id) VALUES (?, ?)", (group_id, user_id))
+        _after_commit(partial(group_directory.add_admin, group_id, user_id))
+
+def remove_group_admin(group_id: int, user_id: int) -> None:
+    with _write() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM group_admins WHERE group_id=? AND user_id=?", (group_id, user_id))
+        _after_commit(partial(group_directory.remove_admin, group_id, user_id))
+
+def is_group_admin(group_id: int, user_id: int) -> bool:
+    return group_directory.is_admin(group_id, user_id)
+
+def fsm_get(key: str, now: float) -> Optional[Tuple[Optional[str], Optional[str]]]:
+    with _read() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT state, data FROM fsm_storage WHERE key=? AND expires_at > ?", (key, now))
+        return cur.fetchone()
+
+def fsm_set_state(key: str, state: Optional[str], expires_at: float) -> None:
+    with _write() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO fsm_storage (key, state, data, expires_at) VALUES (?, ?, NULL, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                state=excluded.state,
+                data=CASE WHEN fsm_storage.expires_at > ? THEN fsm_storage.data END,
+                expires_at=excluded.expires_at
+        """, (key, state, expires_at, datetime.now().timestamp()))
+        cur.execute("DELETE FROM fsm_storage WHERE key=? AND state IS NULL AND data IS NULL", (key,))
+
+def fsm_set_data(key: str, data: Optional[str], expires_at: float) -> None:
+    with _write() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO fsm_storage (key, state, data, expires_at) VALUES (?, NULL, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                state=CASE WHEN fsm_storage.expires_at > ? THEN fsm_storage.state END,
+                data=excluded.data,
+                expires_at=excluded.expires_at
+        """, (key, data, expires_at, datetime.now().timestamp()))
+        cur.execute("DELETE FROM fsm_storage WHERE key=? AND state IS NULL AND data IS NULL", (key,))
+
+def fsm_purge(now: float) -> int:
+    with _write() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM fsm_storage WHERE expires_at <= ?", (now,))
+        return cur.rowcount
+
+def append_op(group_id: int, queue_id: Optional[int], kind: str, params: Dict[str, Any], seed: Optional[int] = None) -> int:
+    now = now_ts()
+    with _write() as conn:
+        cur = conn.cursor()
+        cur.execute("INSERT INTO ops (group_id, queue_id, kind, params, seed, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (group_id, queue_id, kind, json.dumps(params, ensure_ascii=False), seed, now))
+        return cur.lastrowid
+
+def get_ops(group_id: int = DEFAULT_GROUP_ID, from_queue_id: int = 0) -> List[Tuple[int, Optional[int], str, Dict[str, Any], Optional[int]]]:
+    with _read() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, queue_id, kind, params, seed FROM ops WHERE group_id=? AND queue_id >= ? ORDER BY id",
+                    (group_id, from_queue_id))
+        return [(oid, qid, kind, json.loads(params), seed) for oid, qid, kind, params, seed in cur.fetchall()]
+
+def get_reset_queue_ids(group_id: int, start_queue_id: int) -> List[int]:
+    with _read() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT DISTINCT queue_id FROM ops WHERE group_id=? AND queue_id >= ? AND kind='reset'", (group_id, start_queue_id))
+        return [r[0] for r in cur.fetchall()]
+
+def get_frozen_queue_ids(group_id: int, start_queue_id: int = 0) -> List[int]:
+    with _read() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT id FROM queues WHERE group_id=? AND id >= ? AND frozen=1
+            UNION ALL
+            SELECT id FROM queues_archive WHERE group_id=? AND id >= ? AND frozen=1
+        """, (group_id, start_queue_id, group_id, start_queue_id))
+        return [r[0] for r in cur.fetchall()]
+
+def get_queue_settings(group_id: int, start_queue_id: int = 0) -> Dict[int, GroupSettings]:
+    with _read() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT id, k_factor, weight_min, weight_max FROM queues WHERE group_id=? AND id >= ?
+            UNION ALL
+            SELECT id, k_factor, weight_min, weight_max FROM queues_archive WHERE group_id=? AND id >= ?
+        """, (group_id, start_queue_id, group_id, start_queue_id))
+        return {qid: GroupSettings(k, lo, hi) for qid, k, lo, hi in cur.fetchall()}
+
+def get_rebases(group_id: int, start_queue_id: int) -> Dict[int, Dict[int, float]]:
+    with _read() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT queue_id, params FROM ops WHERE group_id=? AND queue_id >= ? AND kind='rebase' ORDER BY id", (group_id, start_queue_id))
+        return {qid: {int(sid): w for sid, w in json.loads(params)["weights"].items()} for qid, params in cur.fetchall()}
+
+def get_frozen_items(group_id: int, start_queue_id: int = 0) -> List[Tuple[int, int, int, int, int, float, float, int, Optional[int], Optional[int]]]:
+    with _read() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT i.queue_id, i.position, i.student_id, i.is_priority, i.is_late, i.weight_before, i.weight_after, i.is_added, i.slot, i.slot_total
+            FROM queue_items i JOIN queues q ON q.id = i.queue_id
+            WHERE q.group_id=? AND q.id >= ? AND q.frozen=1
+            UNION ALL
+            SELECT i.queue_id, i.position, i.student_id, i.is_priority, i.is_late, i.weight_before, i.weight_after, i.is_added, i.slot, i.slot_total
+            FROM queue_items_archive i JOIN queues_archive q ON q.id = i.queue_id
+            WHERE q.group_id=? AND q.id >= ? AND q.frozen=1
+            ORDER BY 1, 2
+        """, (group_id, start_queue_id, group_id, start_queue_id))
+        return cur.fetchall()
+
+def get_snapshot_queue_ids(group_id: int, start_queue_id: int = 0) -> List[int]:
+    with _read() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT DISTINCT queue_id FROM weight_snapshots WHERE group_id=? AND queue_id >= ? ORDER BY queue_id",
+                    (group_id, start_queue_id))
+        return [r[0] for r in cur.fetchall()]
+
+def get_snapshot(group_id: int, at_or_before: int) -> Optional[Tuple[int, Dict[int, float]]]:
+    with _read() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT MAX(queue_id) FROM weight_snapshots WHERE group_id=? AND queue_id <= ?", (group_id, at_or_before))
+        qid = cur.fetchone()[0]
+        if qid is None:
+            return None
+        cur.execute("SELECT student_id, weight FROM weight_snapshots WHERE group_id=? AND queue_id=?", (group_id, qid))
+        return qid, dict(cur.fetchall())
+
+def write_snapshots(group_id: int, snapshots: Dict[int, Dict[int, float]]) -> None:
+    if not snapshots:
+        return
+    with _write() as conn:
+        cur = conn.cursor()
+        cur.executemany("DELETE FROM weight_snapshots WHERE group_id=? AND queue_id=?", [(group_id, qid) for qid in snapshots])
+        cur.executemany("INSERT INTO weight_snapshots (group_id, queue_id, student_id, weight) VALUES (?, ?, ?, ?)",
+                        [(group_id, qid, sid, w) for qid, weights in snapshots.items() for sid, w in weights.items()])
+
+def snapshot_due(group_id: int) -> bool:
+    with _read() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT MAX(queue_id) FROM weight_snapshots WHERE group_id=?", (group_id,))
+        last = cur.fetchone()[0]
+        if last is None:
+            return True
+        cur.execute("SELECT COUNT(*) FROM queues WHERE group_id=? AND id >= ?", (group_id, last))
+        return cur.fetchone()[0] >= SNAPSHOT_INTERVAL
+
+def prune_snapshots(group_id: int) -> None:
+    with _write() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            DELETE FROM weight_snapshots WHERE group_id=? AND queue_id < (
+                SELECT MAX(queue_id) FROM weight_snapshots WHERE group_id=? AND queue_id <= (
+                    SELECT MIN(id) FROM queues WHERE group_id=?
+                )
+            )
+        """, (group_id, group_id, group_id))
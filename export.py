@@ -0,0 +1,148 @@
+import argparse
+import csv
+import json
+import os
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from config import EXPORT_BATCH_SIZE
+from database import init_db, iter_export_rows
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+Column = Tuple[str, str]
+
+SCHEMAS: Dict[str, List[Column]] = {
+    "students": [("id", "int"), ("name", "str"), ("weight", "float"), ("active", "int"), ("group_id", "int")],
+    "queues": [
+        ("id", "int"), ("subject", "str"), ("created_at", "int?"), ("updated_at", "int?"), ("change_log", "str"),
+        ("version", "int"), ("group_id", "int"), ("archived", "int"),
+    ],
+    "queue_items": [
+        ("queue_id", "int"), ("position", "int"), ("student_id", "int"), ("is_priority", "int"), ("is_late", "int"),
+        ("weight_before", "float"), ("weight_after", "float"), ("is_added", "int"), ("slot", "int?"), ("slot_total", "int?"),
+        ("archived", "int"),
+    ],
+    "weight_history": [
+        ("id", "int"), ("student_id", "int"), ("weight", "float"), ("timestamp", "int"), ("place_info", "str"), ("archived", "int"),
+    ],
+}
+
+COLUMNAR_FORMATS = ("parquet", "arrow", "chunked")
+EXTENSIONS = {"csv": "csv", "parquet": "parquet", "arrow": "arrow", "chunked": "npys"}
+
+def _numpy_column(values: Sequence[Any], kind: str) -> np.ndarray:
+    if kind == "int":
+        return np.array(values, dtype=np.int64)
+    if kind == "str":
+        return np.array(["" if v is None else str(v) for v in values], dtype=np.str_)
+    return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+class CsvSink:
+    def __init__(self, path: str, schema: List[Column]) -> None:
+        self._file = open(path, "w", encoding="utf-8", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow([name for name, _ in schema])
+
+    def write(self, rows: List[Tuple[Any, ...]]) -> None:
+        self._writer.writerows(rows)
+
+    def close(self) -> None:
+        self._file.close()
+
+class ChunkedSink:
+    def __init__(self, path: str, schema: List[Column]) -> None:
+        self.schema = schema
+        self._file = open(path, "wb")
+        np.save(self._file, np.array(json.dumps(schema)), allow_pickle=False)
+
+    def write(self, rows: List[Tuple[Any, ...]]) -> None:
+        for i, (_, kind) in enumerate(self.schema):
+            np.save(self._file, _numpy_column([r[i] for r in rows], kind), allow_pickle=False)
+
+    def close(self) -> None:
+        self._file.close()
+
+def read_chunked(path: str) -> Iterator[Dict[str, np.ndarray]]:
+    with open(path, "rb") as f:
+        schema = json.loads(str(np.load(f, allow_pickle=False)))
+        while True:
+            try:
+                first = np.load(f, allow_pickle=False)
+            except EOFError:
+                return
+            chunk = {schema[0][0]: first}
+            for name, _ in schema[1:]:
+                chunk[name] = np.load(f, allow_pickle=False)
+            yield chunk
+
+class ArrowSink:
+    def __init__(self, path: str, schema: List[Column], fmt: str) -> None:
+        types = {"int": pa.int64(), "int?": pa.int64(), "float": pa.float64(), "str": pa.string()}
+        self.arrow_schema = pa.schema([(name, types[kind]) for name, kind in schema])
+        if fmt == "parquet":
+            self._writer = pq.ParquetWriter(path, self.arrow_schema)
+        else:
+            self._writer = pa_ipc.new_file(path, self.arrow_schema)
+
+    def write(self, rows: List[Tuple[Any, ...]]) -> None:
+        columns = [pa.array([r[i] for r in rows], type=field.type) for i, field in enumerate(self.arrow_schema)]
+        self._writer.write_batch(pa.record_batch(columns, schema=self.arrow_schema))
+
+    def close(self) -> None:
+        self._writer.close()
+
+def open_sink(fmt: str, path: str, schema: List[Column]) -> Any:
+    if fmt == "csv":
+        return CsvSink(path, schema)
+    if fmt == "chunked":
+        return ChunkedSink(path, schema)
+    if pa is None:
+        raise RuntimeError(f"Формат {fmt} требует pyarrow")
+    return ArrowSink(path, schema, fmt)
+
+def export_table(table: str, out_dir: str, formats: Sequence[str], group_id: Optional[int] = None, batch_size: int = EXPORT_BATCH_SIZE) -> Dict[str, Any]:
+    schema = SCHEMAS[table]
+    paths = {fmt: os.path.join(out_dir, f"{table}.{EXTENSIONS[fmt]}") for fmt in formats}
+    sinks = []
+    rows_written = 0
+    try:
+        for fmt, path in paths.items():
+            sinks.append(open_sink(fmt, path, schema))
+        for rows in iter_export_rows(table, group_id, batch_size):
+            for sink in sinks:
+                sink.write(rows)
+            rows_written += len(rows)
+    finally:
+        for sink in sinks:
+            sink.close()
+    return {"table": table, "rows": rows_written, "files": list(paths.values())}
+
+def default_columnar() -> str:
+    return "parquet" if pa is not None else "chunked"
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Потоковая выгрузка очередей и истории весов для анализа")
+    parser.add_argument("out_dir", help="каталог для файлов выгрузки")
+    parser.add_argument("--tables", nargs="+", choices=list(SCHEMAS), default=list(SCHEMAS))
+    parser.add_argument("--group", type=int, help="только одна группа")
+    parser.add_argument("--columnar", choices=COLUMNAR_FORMATS + ("none",), default=default_columnar(),
+                        help="колоночный формат в дополнение к CSV (по умолчанию parquet при наличии pyarrow)")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    args = parser.parse_args()
+    if args.columnar in ("parquet", "arrow") and pa is None:
+        parser.error(f"формат {args.columnar} требует pyarrow")
+    formats = ["csv"] + ([args.columnar] if args.columnar != "none" else [])
+    os.makedirs(args.out_dir, exist_ok=True)
+    init_db()
+    report = [export_table(t, args.out_dir, formats, args.group, args.batch_size) for t in args.tables]
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import threading
+from typing import Callable, Dict, Iterable, NamedTuple, Optional, Set, Tuple
+
+from config import ADMINS, K_FACTOR, WEIGHT_MIN_LIMIT, WEIGHT_MAX_LIMIT
+
+class GroupSettings(NamedTuple):
+    k_factor: float = K_FACTOR
+    weight_min: float = WEIGHT_MIN_LIMIT
+    weight_max: float = WEIGHT_MAX_LIMIT
+
+DEFAULT_SETTINGS = GroupSettings()
+
+GroupRow = Tuple[int, Optional[str], Optional[float], Optional[float], Optional[float]]
+
+class GroupDirectory:
+    def __init__(self, loader: Callable[[], Tuple[Iterable[GroupRow], Iterable[Tuple[int, int]]]]) -> None:
+        self._loader = loader
+        self._lock = threading.RLock()
+        self._settings: Optional[Dict[int, GroupSettings]] = None
+        self._titles: Dict[int, Optional[str]] = {}
+        self._admins: Dict[int, Set[int]] = {}
+
+    def reload(self) -> None:
+        groups, admins = self._loader()
+        settings, titles, by_group = {}, {}, {}
+        for gid, title, k, lo, hi in groups:
+            titles[gid] = title
+            settings[gid] = GroupSettings(
+                K_FACTOR if k is None else k,
+                WEIGHT_MIN_LIMIT if lo is None else lo,
+                WEIGHT_MAX_LIMIT if hi is None else hi,
+            )
+        for gid, uid in admins:
+            by_group.setdefault(gid, set()).add(uid)
+        with self._lock:
+            self._titles = titles
+            self._admins = by_group
+            self._settings = settings
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._settings = None
+
+    def _ensure(self) -> Dict[int, GroupSettings]:
+        settings = self._settings
+        if settings is None:
+            self.reload()
+            settings = self._settings
+        return settings
+
+    def __contains__(self, group_id: int) -> bool:
+        return group_id in self._ensure()
+
+    def settings(self, group_id: int) -> GroupSettings:
+        return self._ensure().get(group_id, DEFAULT_SETTINGS)
+
+    def title(self, group_id: int) -> Optional[str]:
+        self._ensure()
+        return self._titles.get(group_id)
+
+    def is_admin(self, group_id: int, user_id: int) -> bool:
+        if user_id in ADMINS:
+            return True
+        self._ensure()
+        return user_id in self._admins.get(group_id, ())
+
+    def admin_groups(self, user_id: int) -> Set[int]:
+        settings = self._ensure()
+        if user_id in ADMINS:
+            return set(settings)
+        return {gid for gid, admins in self._admins.items() if user_id in admins}
+
+    def put(self, group_id: int, title: Optional[str], settings: GroupSettings) -> None:
+        with self._lock:
+            if self._settings is None:
+                return
+            self._settings[group_id] = settings
+            self._titles[group_id] = title
+
+    def add_admin(self, group_id: int, user_id: int) -> None:
+        with self._lock:
+            if self._settings is not None:
+                self._admins.setdefault(group_id, set()).add(user_id)
+
+    def remove_admin(self, group_id: int, user_id: int) -> None:
+        with self._lock:
+            if self._settings is not None:
+                self._admins.get(group_id, set()).discard(user_id)
@@ -1,65 +1,104 @@
+import asyncio
+import html
 import logging
 import re
-import time
-from typing import Dict, List, Optional, Any, Set
+from functools import lru_cache
+from typing import Dict, List, Optional, Any, Tuple
 from aiogram import Router, F
-from aiogram.filters import Command, CommandObject
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from aiogram.filters import Command, CommandObject, StateFilter
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import (
+    Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, Chat,
+    InlineQuery, InlineQueryResultArticle, InputTextMessageContent, BufferedInputFile
+)
 from aiogram.exceptions import TelegramBadRequest
 
-from config import ADMINS, RECENT_QUEUE_LIMIT
-from database import (
-    get_active_students, get_full_list, get_all_weights,
-    toggle_student_status, enable_all_students, get_recent_queues,
-    get_queue, get_student_current_weight, get_weight_history,
-    get_student_name, add_student_to_existing_queue, set_queue_item_weights,
-    update_queue_timestamp_and_log
+from config import HISTORY_LIMIT, RECENT_QUEUE_LIMIT, RENDER_CACHE_SIZE, DEFAULT_GROUP_ID, PICKER_PAGE_SIZE, INLINE_SEARCH_LIMIT, GROUP_HISTORY_TRANSITIONS
+from database import student_directory, group_directory
+from group_directory import GroupSettings
+from render_cache import queue_render_cache
+from timeutil import format_ts, parse_date, days_ago
+import position_stats
+import history_report
+from selection_keyboard import (
+    MODEL_KEY, build_model, page_rows, parse_page,
+    render as render_selection, toggle as toggle_selection, clear as clear_selection
 )
-from queue_logic import (
+from metrics import register_cache
+from queue_locks import queue_locks
+from queue_logic import QueueConflictError, FROZEN_MESSAGE
+from async_db import (
+    add_student, save_group, add_group_admin, get_group_settings,
+    get_full_list, get_all_weights,
+    toggle_student_status, enable_all_students, get_recent_queues, get_queues_by_subject,
+    get_queue, get_queue_items_page, get_students_page, get_student_initials, get_weight_history,
+    get_group_weight_history, get_archived_queue, get_archived_queues, get_student_stats,
+    reset_all_weights, get_queue_version, get_latest_queue_version,
     generate_and_save_queue, swap_and_cascade, delete_student_from_queue_and_apply_penalty,
-    add_new_student_to_queue_and_penalize
+    add_new_student_to_queue_and_penalize, get_marks, set_marks, remove_students, add_students
 )
 
 logging.basicConfig(level=logging.INFO)
 router = Router()
 
-priority_list: List[int] = []
-late_list: List[int] = []
-user_selections: Dict[int, Dict[str, Any]] = {}
+class QueueStates(StatesGroup):
+    selecting = State()
+    awaiting_subject = State()
 
-SELECTION_TIMEOUT_SECONDS = 300
+def chat_group(chat: Chat) -> int:
+    return chat.id if chat.type in ("group", "supergroup") else DEFAULT_GROUP_ID
 
-def is_admin(user_id: int) -> bool:
-    return user_id in ADMINS
+def is_admin(user_id: int, group_id: int = DEFAULT_GROUP_ID) -> bool:
+    return group_directory.is_admin(group_id, user_id)
 
-def cleanup_old_selections() -> None:
-    current_time = time.time()
-    expired_users = [
-        user_id for user_id, data in user_selections.items()
-        if data.get("timestamp", 0) + SELECTION_TIMEOUT_SECONDS < current_time
-    ]
-    for user_id in expired_users:
-        user_selections.pop(user_id, None)
+async def start_selection_state(state: FSMContext, group_id: int, **data: Any) -> Optional[InlineKeyboardMarkup]:
+    markup = await get_selection_keyboard(data, group_id)
+    await state.set_state(QueueStates.selecting)
+    await state.set_data(data)
+    return markup
 
 def format_queue_message(q: Dict[str, Any]) -> str:
     meta = q["meta"]
     items = q["items"]
     qid, subject, created_at, updated_at, change_log = meta
-    text = f"Очередь {subject}\nСоздана {created_at}\n"
-    if (str(updated_at) != str(created_at)) or not (change_log and change_log.startswith("Создана")):
-        text += f"Изменена {updated_at} ({change_log})\n\n"
+    text = f"Очередь {html.escape(subject)}\nСоздана {format_ts(created_at)}\n"
+    if updated_at != created_at or not (change_log and change_log.startswith("Создана")):
+        text += f"Изменена {format_ts(updated_at)} ({html.escape(change_log or '')})\n\n"
     else:
         text += "\n"
     for itm in items:
         pos, sid, is_p, is_l, w_before, w_after, is_added = itm
         pref = "⭐ " if is_p else "🐌 " if is_l else "😭 " if is_added else ""
-        name = get_student_name(sid)
+        name = html.escape(student_directory.name(sid))
         weight_display = w_after if w_after is not None else w_before
         text += f"{pos}. {pref}{name} — {weight_display:.2f}\n"
     return text
 
-def get_keyboard(user_id: int, queue_id: Optional[int] = None) -> InlineKeyboardMarkup:
-    if is_admin(user_id):
+async def render_queue(queue_id: int, group_id: int = DEFAULT_GROUP_ID, version: Optional[int] = None) -> Optional[str]:
+    if version is None:
+        version = await get_queue_version(queue_id, group_id)
+        if version is None:
+            return None
+    text = queue_render_cache.get(queue_id, version)
+    if text is None:
+        q = await get_group_queue(queue_id, group_id)
+        if not q:
+            return None
+        text = format_queue_message(q)
+        queue_render_cache.put(queue_id, q["version"], text)
+    return text
+
+async def get_group_queue(queue_id: int, group_id: int) -> Optional[Dict[str, Any]]:
+    q = await get_queue(queue_id)
+    return q if q and q["group_id"] == group_id else None
+
+def get_keyboard(user_id: int, group_id: int = DEFAULT_GROUP_ID, queue_id: Optional[int] = None) -> InlineKeyboardMarkup:
+    return _build_keyboard(is_admin(user_id, group_id), queue_id)
+
+@lru_cache(maxsize=RENDER_CACHE_SIZE)
+def _build_keyboard(admin: bool, queue_id: Optional[int]) -> InlineKeyboardMarkup:
+    if admin:
         buttons = []
         buttons.append([InlineKeyboardButton(text="🎲 Сгенерировать", callback_data="admin_gen")])
         if queue_id:
@@ -70,125 +109,122 @@ def get_keyboard(user_id: int, queue_id: Optional[int] = None) -> InlineKeyboard
         if queue_id:
             buttons.append([InlineKeyboardButton(text="➕ Добавить студента", callback_data=f"admin_add_{queue_id}"), InlineKeyboardButton(text="➖ Удалить студента", callback_data=f"admin_del_{queue_id}")])
         buttons.append([InlineKeyboardButton(text="📝 Список", callback_data="pub_list"), InlineKeyboardButton(text="📊 Веса", callback_data="pub_weights")])
-        buttons.append([InlineKeyboardButton(text="🔄 Включить всех", callback_data="admin_enable_all")])
-        buttons.append([InlineKeyboardButton(text="📈 История весов", callback_data="pub_weight_history")])
+        buttons.append([InlineKeyboardButton(text="🔄 Включить всех", callback_data="admin_enable_all"), InlineKeyboardButton(text="👥 История группы", callback_data="group_history")])
+        buttons.append([InlineKeyboardButton(text="📈 История весов", callback_data="pub_weight_history"), InlineKeyboardButton(text="📊 Статистика", callback_data="pub_stats")])
     else:
         buttons = [
             [InlineKeyboardButton(text="📌 Текущая очередь", callback_data="open_latest_queue"), InlineKeyboardButton(text="📜 Очереди", callback_data="pub_queues")],
             [InlineKeyboardButton(text="📝 Список ID", callback_data="pub_list"), InlineKeyboardButton(text="📊 Шансы", callback_data="pub_weights")],
-            [InlineKeyboardButton(text="📈 История весов", callback_data="pub_weight_history")]
+            [InlineKeyboardButton(text="📈 История весов", callback_data="pub_weight_history"), InlineKeyboardButton(text="📊 Статистика", callback_data="pub_stats")]
         ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
-def get_selection_keyboard(user_id: int) -> Optional[InlineKeyboardMarkup]:
-    cleanup_old_selections()
-    data = user_selections.get(user_id)
-    if not data:
-        return None
+register_cache("keyboard", lambda: _build_keyboard.cache_info()[:2])
+
+async def fetch_students_page(group_id: int, page: Optional[List[str]], exclude_queue_id: Optional[int] = None) -> Tuple[List[Tuple[int, str, int]], bool, bool]:
+    cursor, backward = None, False
+    if page:
+        kind, value = page
+        if kind == "jump":
+            cursor = (value, 0)
+        else:
+            key = int(value)
+            cursor, backward = (student_directory.name(key), key), kind == "prev"
+    return await get_students_page(group_id, cursor, backward, PICKER_PAGE_SIZE, exclude_queue_id)
+
+async def fetch_queue_items_page(queue_id: int, page: Optional[List[str]]) -> Tuple[List[Tuple], bool, bool]:
+    if not page or page[0] == "jump":
+        return await get_queue_items_page(queue_id, None, False, PICKER_PAGE_SIZE)
+    return await get_queue_items_page(queue_id, int(page[1]), page[0] == "prev", PICKER_PAGE_SIZE)
+
+async def build_selection_model(data: Dict[str, Any], group_id: int = DEFAULT_GROUP_ID) -> Dict[str, Any]:
     action = data["action"]
-    temp_selected = data["selected"]
+    page = data.get("page")
+    cancel_row = [("🚫 Отмена", "cancel_selection")]
+    clear_row = [("🧹 Сбросить выбор", "clear_current_list")]
 
     if action == "swap":
-        data = user_selections.get(user_id)
-        use_qid = data.get("queue_id") if data else None
-        if use_qid:
-            q = get_queue(use_qid)
-        else:
-            latest = get_recent_queues(1)
+        if not data.get("queue_id"):
+            latest = await get_recent_queues(1, group_id=group_id)
             if not latest:
-                return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="⚠️ Нет очередей", callback_data="cancel_selection")]])
-            qid = latest[0][0]
-            q = get_queue(qid)
+                return build_model((), [[("⚠️ Нет очередей", "cancel_selection")]])
+            data["queue_id"] = latest[0][0]
+        items, has_prev, has_next = await fetch_queue_items_page(data["queue_id"], page)
         buttons = []
-        row = []
-        for item in q["items"]:
-            pos, sid, is_p, is_l, w_before, w_after, is_added = item
+        locked = []
+        for pos, sid, is_p, is_l, w_before, w_after, is_added in items:
             prefix = "⭐ " if is_p else "🐌 " if is_l else "😭 " if is_added else ""
-            check = "✅ " if pos in temp_selected else ""
-            name = get_student_name(sid)
-            row.append(InlineKeyboardButton(text=f"{check}{pos}. {prefix}{name}", callback_data=f"swap_toggle_{pos}"))
-            if len(row) == 2:
-                buttons.append(row)
-                row = []
-        if row:
-            buttons.append(row)
-        confirm_text = "🚀 ПОМЕНЯТЬ" if len(temp_selected) == 2 else "Выбери двоих"
-        buttons.append([InlineKeyboardButton(text=confirm_text, callback_data="confirm_swap")])
-        buttons.append([InlineKeyboardButton(text="🚫 Отмена", callback_data="cancel_selection")])
-        return InlineKeyboardMarkup(inline_keyboard=buttons)
+            buttons.append((pos, f"{pos}. {prefix}{student_directory.name(sid)}", f"swap_toggle_{pos}"))
+            if is_p or is_l or is_added:
+                locked.append(pos)
+        nav = page_rows("page_", items[0][0] if items else None, items[-1][0] if items else None, has_prev, has_next, search=False)
+        return build_model(buttons, nav + [cancel_row], ("confirm_swap", "🚀 ПОМЕНЯТЬ", "Выбери двоих", 2), locked)
 
     if action in ("admin_add", "admin_del"):
         qid = data.get("queue_id")
         if qid is None:
-            return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="⚠️ Нет очереди", callback_data="cancel_selection")]])
-        buttons = []
-        row = []
+            return build_model((), [[("⚠️ Нет очереди", "cancel_selection")]])
         if action == "admin_del":
-            q = get_queue(qid)
-            for itm in q["items"]:
-                pos, sid, is_p, is_l, w_before, w_after, is_added = itm
-                name = get_student_name(sid)
-                check = "✅ " if pos in temp_selected else ""
-                label = f"{check}{pos}. {name} {'⭐' if is_p else '🐌' if is_l else ''}"
-                row.append(InlineKeyboardButton(text=label, callback_data=f"admin_del_toggle_{qid}_{pos}"))
-                if len(row) == 2:
-                    buttons.append(row)
-                    row = []
-        else:
-            students = get_full_list()
-            q = get_queue(qid)
-            present_ids = {itm[1] for itm in q["items"]}
-            for s_id, name, active in students:
-                if s_id in present_ids:
-                    continue
-                check = "✅ " if s_id in temp_selected else ""
-                row.append(InlineKeyboardButton(text=f"{check}{name}", callback_data=f"admin_add_toggle_{qid}_{s_id}"))
-                if len(row) == 2:
-                    buttons.append(row)
-                    row = []
-        if row:
-            buttons.append(row)
-        if action == "admin_add":
-            buttons.append([InlineKeyboardButton(text="🚀 ДОБАВИТЬ", callback_data="admin_confirm_add")])
+            items, has_prev, has_next = await fetch_queue_items_page(qid, page)
+            buttons = [
+                (pos, f"{pos}. {student_directory.name(sid)} {'⭐' if is_p else '🐌' if is_l else ''}", f"admin_del_toggle_{qid}_{pos}")
+                for pos, sid, is_p, is_l, w_before, w_after, is_added in items
+            ]
+            nav = page_rows("page_", items[0][0] if items else None, items[-1][0] if items else None, has_prev, has_next, search=False)
+            confirm = ("admin_confirm_del", "🚀 УДАЛИТЬ", "🚀 УДАЛИТЬ", None)
         else:
-            buttons.append([InlineKeyboardButton(text="🚀 УДАЛИТЬ", callback_data="admin_confirm_del")])
-        buttons.append([InlineKeyboardButton(text="🧹 Сбросить выбор", callback_data="clear_current_list")])
-        buttons.append([InlineKeyboardButton(text="🚫 Отмена", callback_data="cancel_selection")])
-        return InlineKeyboardMarkup(inline_keyboard=buttons)
+            students, has_prev, has_next = await fetch_students_page(group_id, page, exclude_queue_id=qid)
+            buttons = [(s_id, name, f"admin_add_toggle_{qid}_{s_id}") for s_id, name, active in students]
+            nav = await student_page_rows(data, group_id, "page_", students, has_prev, has_next)
+            confirm = ("admin_confirm_add", "🚀 ДОБАВИТЬ", "🚀 ДОБАВИТЬ", None)
+        return build_model(buttons, nav + [clear_row, cancel_row], confirm)
 
-    students = get_full_list()
+    students, has_prev, has_next = await fetch_students_page(group_id, page)
+    priority_list = set(await get_marks("priority", group_id))
+    late_list = set(await get_marks("late", group_id))
     buttons = []
-    row = []
     for s_id, name, active in students:
         prefix = "⭐ " if s_id in priority_list else "🐌 " if s_id in late_list else ""
-        check = "✅ " if s_id in temp_selected else ""
         status_dot = "🟢 " if active else "🔴 "
-        row.append(InlineKeyboardButton(text=f"{check}{prefix}{status_dot} {name}", callback_data=f"toggle_{s_id}"))
-        if len(row) == 2:
-            buttons.append(row)
-            row = []
-    if row:
-        buttons.append(row)
-    buttons.append([InlineKeyboardButton(text="🚀 ПРИМЕНИТЬ", callback_data="confirm_selection")])
-    buttons.append([InlineKeyboardButton(text="🧹 Сбросить выбор", callback_data="clear_current_list")])
-    buttons.append([InlineKeyboardButton(text="🚫 Отмена", callback_data="cancel_selection")])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+        buttons.append((s_id, f"{prefix}{status_dot} {name}", f"toggle_{s_id}"))
+    nav = await student_page_rows(data, group_id, "page_", students, has_prev, has_next)
+    return build_model(buttons, nav + [clear_row, cancel_row], ("confirm_selection", "🚀 ПРИМЕНИТЬ", "🚀 ПРИМЕНИТЬ", None))
+
+async def student_page_rows(data: Dict[str, Any], group_id: int, prefix: str, students: List[Tuple[int, str, int]], has_prev: bool, has_next: bool) -> List[List[Any]]:
+    initials = []
+    if has_prev or has_next:
+        if "initials" not in data:
+            data["initials"] = await get_student_initials(group_id)
+        initials = data["initials"]
+    first = students[0][0] if students else None
+    last = students[-1][0] if students else None
+    return page_rows(prefix, first, last, has_prev, has_next, initials)
+
+async def get_selection_keyboard(data: Dict[str, Any], group_id: int = DEFAULT_GROUP_ID) -> Optional[InlineKeyboardMarkup]:
+    if not data:
+        return None
+    model = data.get(MODEL_KEY)
+    if model is None:
+        model = data[MODEL_KEY] = await build_selection_model(data, group_id)
+    return render_selection(model, data["selected"])
 
 @router.callback_query(F.data.startswith("sel_"))
-async def start_selection(callback: CallbackQuery) -> None:
-    if not is_admin(callback.from_user.id):
+async def start_selection(callback: CallbackQuery, state: FSMContext) -> None:
+    gid = chat_group(callback.message.chat)
+    if not is_admin(callback.from_user.id, gid):
         await callback.answer("⛔ Нет прав! Знай свой место!", show_alert=True)
         return
     action = callback.data.replace("sel_", "")
-    initial_selected = priority_list.copy() if action == "priority" else late_list.copy() if action == "late" else []
-    user_selections[callback.from_user.id] = {"action": action, "selected": initial_selected, "timestamp": time.time()}
+    initial_selected = await get_marks(action, gid) if action in ("priority", "late") else []
+    markup = await start_selection_state(state, gid, action=action, selected=initial_selected)
     titles = {"priority": "⭐ Приоритеты", "late": "🐌 Опоздания", "enable": "✅ Включение", "disable": "❌ Исключение"}
-    await callback.message.answer(titles[action], reply_markup=get_selection_keyboard(callback.from_user.id))
+    await callback.message.answer(titles[action], reply_markup=markup)
     await callback.answer()
 
 @router.callback_query(F.data.startswith("admin_swap_start"))
-async def start_swap_ui(callback: CallbackQuery) -> None:
-    if not is_admin(callback.from_user.id):
+async def start_swap_ui(callback: CallbackQuery, state: FSMContext) -> None:
+    gid = chat_group(callback.message.chat)
+    if not is_admin(callback.from_user.id, gid):
         await callback.answer("⛔ Нет прав! Знай свой место!", show_alert=True)
         return
     data = callback.data
@@ -200,33 +236,45 @@ async def start_swap_ui(callback: CallbackQuery) -> None:
             logging.error(f"Error parsing queue ID: {e}")
             qid = None
     if qid is None:
-        recent = get_recent_queues(1)
+        recent = await get_recent_queues(1, group_id=gid)
         if not recent:
             await callback.answer("⚠️ Очередь пуста!", show_alert=True)
             return
         qid = recent[0][0]
-    user_selections[callback.from_user.id] = {"action": "swap", "selected": [], "queue_id": qid, "timestamp": time.time()}
-    await callback.message.answer("🔀 Выбери двух человек:", reply_markup=get_selection_keyboard(callback.from_user.id))
+    q = await get_group_queue(qid, gid)
+    if not q:
+        await callback.answer("⚠️ Очередь не найдена", show_alert=True)
+        return
+    if q["frozen"]:
+        await callback.answer(f"⚠️ {FROZEN_MESSAGE}", show_alert=True)
+        return
+    markup = await start_selection_state(state, gid, action="swap", selected=[], queue_id=qid, version=q["version"])
+    await callback.message.answer("🔀 Выбери двух человек:", reply_markup=markup)
     await callback.answer()
 
 @router.callback_query(lambda c: re.match(r"^admin_del_\d+$", getattr(c, "data", "") or ""))
-async def admin_delete_student_start(callback: CallbackQuery) -> None:
-    if not is_admin(callback.from_user.id):
+async def admin_delete_student_start(callback: CallbackQuery, state: FSMContext) -> None:
+    gid = chat_group(callback.message.chat)
+    if not is_admin(callback.from_user.id, gid):
         await callback.answer("⛔ Нет прав! Знай свой место!", show_alert=True)
         return
     rest = callback.data[len("admin_del_"):]
     qid = int(rest)
-    q = get_queue(qid)
+    q = await get_group_queue(qid, gid)
     if not q:
         await callback.answer("⚠️ Очередь не найдена", show_alert=True)
         return
-    user_selections[callback.from_user.id] = {"action": "admin_del", "selected": [], "queue_id": qid, "timestamp": time.time()}
-    await callback.message.answer(f"Выбери позиции для удаления из очереди {qid}:", reply_markup=get_selection_keyboard(callback.from_user.id))
+    if q["frozen"]:
+        await callback.answer(f"⚠️ {FROZEN_MESSAGE}", show_alert=True)
+        return
+    markup = await start_selection_state(state, gid, action="admin_del", selected=[], queue_id=qid, version=q["version"])
+    await callback.message.answer(f"Выбери позиции для удаления из очереди {qid}:", reply_markup=markup)
     await callback.answer()
 
 @router.callback_query(F.data.startswith("admin_del_confirm_"))
 async def admin_delete_confirm(callback: CallbackQuery) -> None:
-    if not is_admin(callback.from_user.id):
+    gid = chat_group(callback.message.chat)
+    if not is_admin(callback.from_user.id, gid):
         await callback.answer("⛔ Нет прав! Знай свой место!", show_alert=True)
         return
     rest = callback.data[len("admin_del_confirm_"):]
@@ -238,33 +286,39 @@ async def admin_delete_confirm(callback: CallbackQuery) -> None:
         logging.error(f"Data split error: {e}")
         await callback.answer("⚠️ Неверные данные", show_alert=True)
         return
+    if not await get_group_queue(qid, gid):
+        await callback.answer("⚠️ Очередь не найдена", show_alert=True)
+        return
     try:
-        sid = delete_student_from_queue_and_apply_penalty(qid, pos)
+        async with queue_locks.hold(qid):
+            sid = await delete_student_from_queue_and_apply_penalty(qid, pos)
     except Exception as e:
         logging.error(f"Penalty apply error: {e}")
         await callback.answer(f"Ошибка: {e}", show_alert=True)
         return
-    await callback.message.answer(f"Удалён студент {get_student_name(sid)}")
+    await callback.message.answer(f"Удалён студент {student_directory.name(sid)}")
     await callback.answer()
 
 @router.callback_query(lambda c: re.match(r"^admin_add_\d+$", getattr(c, "data", "") or ""))
-async def admin_add_student_start(callback: CallbackQuery) -> None:
-    if not is_admin(callback.from_user.id):
+async def admin_add_student_start(callback: CallbackQuery, state: FSMContext) -> None:
+    gid = chat_group(callback.message.chat)
+    if not is_admin(callback.from_user.id, gid):
         await callback.answer("⛔ Нет прав! Знай свой место!", show_alert=True)
         return
     rest = callback.data[len("admin_add_"):]
     qid = int(rest)
-    q = get_queue(qid)
+    q = await get_group_queue(qid, gid)
     if not q:
         await callback.answer("⚠️ Очередь не найдена", show_alert=True)
         return
-    user_selections[callback.from_user.id] = {"action": "admin_add", "selected": [], "queue_id": qid, "timestamp": time.time()}
-    await callback.message.answer(f"Выбери студентов для добавления в очереди {qid}:", reply_markup=get_selection_keyboard(callback.from_user.id))
+    markup = await start_selection_state(state, gid, action="admin_add", selected=[], queue_id=qid, version=q["version"])
+    await callback.message.answer(f"Выбери студентов для добавления в очереди {qid}:", reply_markup=markup)
     await callback.answer()
 
 @router.callback_query(F.data.startswith("admin_add_confirm_"))
 async def admin_add_confirm(callback: CallbackQuery) -> None:
-    if not is_admin(callback.from_user.id):
+    gid = chat_group(callback.message.chat)
+    if not is_admin(callback.from_user.id, gid):
         await callback.answer("⛔ Нет прав! Знай свой место!", show_alert=True)
         return
     rest = callback.data[len("admin_add_confirm_"):]
@@ -276,19 +330,24 @@ async def admin_add_confirm(callback: CallbackQuery) -> None:
         logging.error(f"Data parse error: {e}")
         await callback.answer("⚠️ Неверные данные", show_alert=True)
         return
+    if not await get_group_queue(qid, gid):
+        await callback.answer("⚠️ Очередь не найдена", show_alert=True)
+        return
     try:
-        pos = add_new_student_to_queue_and_penalize(qid, sid)
+        async with queue_locks.hold(qid):
+            pos = await add_new_student_to_queue_and_penalize(qid, sid)
     except Exception as e:
         logging.error(f"Add penalize error: {e}")
         await callback.answer(f"Ошибка: {e}", show_alert=True)
         return
-    await callback.message.answer(f"Добавлен студент {get_student_name(sid)} на место {pos}")
+    await callback.message.answer(f"Добавлен студент {student_directory.name(sid)} на место {pos}")
     await callback.answer()
 
 @router.callback_query(F.data.startswith("admin_add_toggle_"))
-async def admin_add_toggle(callback: CallbackQuery) -> None:
-    u_id = callback.from_user.id
-    if u_id not in user_selections or user_selections[u_id].get("action") != "admin_add":
+async def admin_add_toggle(callback: CallbackQuery, state: FSMContext) -> None:
+    gid = chat_group(callback.message.chat)
+    data = await state.get_data()
+    if data.get("action") != "admin_add":
         return
     rest = callback.data[len("admin_add_toggle_"):]
     try:
@@ -297,18 +356,16 @@ async def admin_add_toggle(callback: CallbackQuery) -> None:
     except Exception as e:
         logging.error(f"Toggle error: {e}")
         return
-    sel = user_selections[u_id]["selected"]
-    if sid in sel:
-        sel.remove(sid)
-    else:
-        sel.append(sid)
-    await callback.message.edit_reply_markup(reply_markup=get_selection_keyboard(u_id))
+    if toggle_selection(data, sid) in ("added", "removed"):
+        await state.set_data(data)
+        await callback.message.edit_reply_markup(reply_markup=await get_selection_keyboard(data, gid))
     await callback.answer()
 
 @router.callback_query(F.data.startswith("admin_del_toggle_"))
-async def admin_del_toggle(callback: CallbackQuery) -> None:
-    u_id = callback.from_user.id
-    if u_id not in user_selections or user_selections[u_id].get("action") != "admin_del":
+async def admin_del_toggle(callback: CallbackQuery, state: FSMContext) -> None:
+    gid = chat_group(callback.message.chat)
+    data = await state.get_data()
+    if data.get("action") != "admin_del":
         return
     rest = callback.data[len("admin_del_toggle_"):]
     try:
@@ -317,215 +374,349 @@ async def admin_del_toggle(callback: CallbackQuery) -> None:
     except Exception as e:
         logging.error(f"Del toggle error: {e}")
         return
-    sel = user_selections[u_id]["selected"]
-    if pos in sel:
-        sel.remove(pos)
-    else:
-        sel.append(pos)
-    await callback.message.edit_reply_markup(reply_markup=get_selection_keyboard(u_id))
+    if toggle_selection(data, pos) in ("added", "removed"):
+        await state.set_data(data)
+        await callback.message.edit_reply_markup(reply_markup=await get_selection_keyboard(data, gid))
     await callback.answer()
 
 @router.callback_query(F.data == "admin_confirm_add")
-async def admin_confirm_add(callback: CallbackQuery) -> None:
+async def admin_confirm_add(callback: CallbackQuery, state: FSMContext) -> None:
+    gid = chat_group(callback.message.chat)
     u_id = callback.from_user.id
-    if u_id not in user_selections or user_selections[u_id].get("action") != "admin_add":
+    data = await state.get_data()
+    if data.get("action") != "admin_add":
         await callback.answer("⚠️ Ничего не выбрано", show_alert=True)
         return
-    qid = user_selections[u_id].get("queue_id")
-    ids = user_selections[u_id].get("selected", [])
+    qid = data.get("queue_id")
+    ids = data.get("selected", [])
     if not ids:
         await callback.answer("⚠️ Ничего не выбрано", show_alert=True)
         return
-    added = []
-    for sid in ids:
-        try:
-            pos, w_before = add_student_to_existing_queue(qid, sid)
-            cur_w = get_student_current_weight(sid)
-            set_queue_item_weights(qid, pos, w_before, cur_w)
-            added.append((sid, pos))
-        except Exception as e:
-            logging.error(f"Error adding student: {e}")
-            await callback.message.answer(f"Ошибка при добавлении {get_student_name(sid)}: {e}")
-    if added:
-        names = ", ".join(get_student_name(sid) for sid, _ in added)
-        log_text = f"Добавлен студент {names}" if len(added) == 1 else f"Добавлены студенты: {names}"
-        update_queue_timestamp_and_log(qid, log_text)
+    try:
+        async with queue_locks.hold(qid):
+            await add_students(qid, ids, expected_version=data.get("version"))
+    except QueueConflictError as e:
+        await callback.answer(f"⚠️ {e}", show_alert=True)
+        return
+    except Exception as e:
+        logging.error(f"Error adding students: {e}")
+        await callback.message.answer(f"Ошибка при добавлении: {e}")
     try:
         await callback.message.delete()
     except TelegramBadRequest as e:
         logging.error(f"Could not delete message: {e}")
     except Exception as e:
         logging.error(f"Unexpected error deleting message: {e}")
-    user_selections.pop(u_id, None)
-    q = get_queue(qid)
-    if q:
-        text = format_queue_message(q)
-        await callback.message.answer(text, reply_markup=get_keyboard(u_id, queue_id=qid))
+    await state.clear()
+    text = await render_queue(qid, gid)
+    if text:
+        await callback.message.answer(text, parse_mode="HTML", reply_markup=get_keyboard(u_id, gid, queue_id=qid))
     else:
         await callback.message.answer("Добавление выполнено")
     await callback.answer()
 
 @router.callback_query(F.data == "admin_confirm_del")
-async def admin_confirm_del(callback: CallbackQuery) -> None:
+async def admin_confirm_del(callback: CallbackQuery, state: FSMContext) -> None:
+    gid = chat_group(callback.message.chat)
     u_id = callback.from_user.id
-    if u_id not in user_selections or user_selections[u_id].get("action") != "admin_del":
+    data = await state.get_data()
+    if data.get("action") != "admin_del":
         await callback.answer("⚠️ Ничего не выбрано", show_alert=True)
         return
-    qid = user_selections[u_id].get("queue_id")
-    positions = sorted(user_selections[u_id].get("selected", []))
+    qid = data.get("queue_id")
+    positions = sorted(data.get("selected", []))
     if not positions:
         await callback.answer("⚠️ Ничего не выбрано", show_alert=True)
         return
-    removed = []
-    q_snapshot = get_queue(qid)
-    pos_to_sid = {itm[0]: itm[1] for itm in q_snapshot["items"]}
-    sids = [pos_to_sid.get(p) for p in positions if pos_to_sid.get(p) is not None]
-    for sid in sids:
-        q_now = get_queue(qid)
-        cur_item = next((it for it in q_now["items"] if it[1] == sid), None)
-        if not cur_item:
-            continue
-        cur_pos = cur_item[0]
-        try:
-            deleted_sid = delete_student_from_queue_and_apply_penalty(qid, cur_pos, defer_log=True)
-            removed.append(deleted_sid)
-        except Exception as e:
-            logging.error(f"Error deleting student {sid}: {e}")
-            await callback.message.answer(f"Ошибка при удалении {get_student_name(sid)}: {e}")
-    if removed:
-        names = ", ".join(get_student_name(sid) for sid in removed)
-        log_text = f"Удалён студент {names}" if len(removed) == 1 else f"Удалены студенты: {names}"
-        update_queue_timestamp_and_log(qid, log_text)
+    try:
+        async with queue_locks.hold(qid):
+            await remove_students(qid, positions, expected_version=data.get("version"))
+    except QueueConflictError as e:
+        await callback.answer(f"⚠️ {e}", show_alert=True)
+        return
+    except Exception as e:
+        logging.error(f"Error deleting students: {e}")
+        await callback.message.answer(f"Ошибка при удалении: {e}")
     try:
         await callback.message.delete()
     except TelegramBadRequest as e:
         logging.error(f"Could not delete message: {e}")
     except Exception as e:
         logging.error(f"Unexpected error deleting message: {e}")
-    user_selections.pop(u_id, None)
-    q = get_queue(qid)
-    if q:
-        text = format_queue_message(q)
-        await callback.message.answer(text, reply_markup=get_keyboard(u_id, queue_id=qid))
+    await state.clear()
+    text = await render_queue(qid, gid)
+    if text:
+        await callback.message.answer(text, parse_mode="HTML", reply_markup=get_keyboard(u_id, gid, queue_id=qid))
     else:
         await callback.message.answer("Удаление выполнено")
     await callback.answer()
 
 @router.callback_query(F.data == "open_latest_queue")
 async def open_latest(callback: CallbackQuery) -> None:
-    recent = get_recent_queues(1)
-    if not recent:
+    gid = chat_group(callback.message.chat)
+    latest = await get_latest_queue_version(gid)
+    if not latest:
         await callback.answer("⚠️ Нет сохранённых очередей!", show_alert=True)
         return
-    qid = recent[0][0]
-    q = get_queue(qid)
-    if not q:
+    qid, version = latest
+    text = await render_queue(qid, gid, version)
+    if not text:
         await callback.answer("⚠️ Очередь не найдена", show_alert=True)
         return
-    text = format_queue_message(q)
-    kb = get_keyboard(callback.from_user.id, queue_id=qid)
-    await callback.message.answer(text, reply_markup=kb)
+    kb = get_keyboard(callback.from_user.id, gid, queue_id=qid)
+    await callback.message.answer(text, parse_mode="HTML", reply_markup=kb)
     await callback.answer()
 
 @router.callback_query(F.data == "pub_queues")
 async def show_queues_list(callback: CallbackQuery) -> None:
-    qlist = get_recent_queues()
+    gid = chat_group(callback.message.chat)
+    qlist = await get_recent_queues(group_id=gid)
     if not qlist:
         await callback.answer("⚠️ Нет сохранённых очередей!", show_alert=True)
         return
     text = "📜 <b>Список очередей:</b>\n\n"
+    kb = queue_list_keyboard(qlist, [[InlineKeyboardButton(text="📦 Архив", callback_data="pub_archive")]])
+    await callback.message.answer(text, parse_mode="HTML", reply_markup=kb)
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("pub_archive"))
+async def show_archive_list(callback: CallbackQuery) -> None:
+    gid = chat_group(callback.message.chat)
+    before = callback.data.replace("pub_archive", "").lstrip("_")
+    qlist = await get_archived_queues(gid, int(before) if before.isdigit() else None)
+    if not qlist:
+        await callback.answer("⚠️ Архив пуст", show_alert=True)
+        return
+    extra = [[InlineKeyboardButton(text="◀️ Раньше", callback_data=f"pub_archive_{qlist[-1][0]}")]] if len(qlist) == HISTORY_LIMIT else []
+    await callback.message.answer("📦 <b>Архив очередей:</b>\n\n", parse_mode="HTML", reply_markup=queue_list_keyboard(qlist, extra))
+    await callback.answer()
+
+def queue_list_keyboard(qlist: List[Tuple[int, str, int, int, str]], extra: Optional[List[List[InlineKeyboardButton]]] = None) -> InlineKeyboardMarkup:
     kb_rows = []
     for q in qlist:
         qid, subject, created, updated, changelog = q
-        display = f"{created} — {subject}"
+        display = f"{format_ts(created)} — {subject}"
         kb_rows.append([InlineKeyboardButton(text=display, callback_data=f"open_queue_{qid}")])
-    kb = InlineKeyboardMarkup(inline_keyboard=kb_rows)
-    await callback.message.answer(text, parse_mode="HTML", reply_markup=kb)
-    await callback.answer()
+    return InlineKeyboardMarkup(inline_keyboard=kb_rows + (extra or []))
 
 @router.callback_query(F.data.startswith("open_queue_"))
 async def open_queue(callback: CallbackQuery) -> None:
+    gid = chat_group(callback.message.chat)
     try:
         qid = int(callback.data.replace("open_queue_", ""))
     except Exception as e:
         logging.error(f"Open queue error: {e}")
         await callback.answer("⚠️ Ошибка данных", show_alert=True)
         return
-    q = get_queue(qid)
-    if not q:
-        await callback.answer("⚠️ Очередь не найдена", show_alert=True)
+    text = await render_queue(qid, gid)
+    if not text:
+        archived = await get_archived_queue(qid)
+        if not archived or archived["group_id"] != gid:
+            await callback.answer("⚠️ Очередь не найдена", show_alert=True)
+            return
+        await callback.message.answer("📦 Из архива\n" + format_queue_message(archived), parse_mode="HTML", reply_markup=get_keyboard(callback.from_user.id, gid))
+        await callback.answer()
         return
-    text = format_queue_message(q)
-    kb = get_keyboard(callback.from_user.id, queue_id=qid)
-    await callback.message.answer(text, reply_markup=kb)
+    kb = get_keyboard(callback.from_user.id, gid, queue_id=qid)
+    await callback.message.answer(text, parse_mode="HTML", reply_markup=kb)
     await callback.answer()
 
 @router.callback_query(F.data == "pub_list")
 async def pub_list(callback: CallbackQuery) -> None:
-    students = get_full_list()
+    gid = chat_group(callback.message.chat)
+    students = await get_full_list(gid)
     text = "📝 <b>Список:</b>\n\n"
     for s_id, name, active in students:
-        text += f"<code>{s_id}</code>: {name} {'✅' if active else '❌'}\n"
-    await callback.message.answer(text, parse_mode="HTML", reply_markup=get_keyboard(callback.from_user.id))
+        text += f"<code>{s_id}</code>: {html.escape(name)} {'✅' if active else '❌'}\n"
+    await callback.message.answer(text, parse_mode="HTML", reply_markup=get_keyboard(callback.from_user.id, gid))
     await callback.answer()
 
 @router.callback_query(F.data == "pub_weights")
 async def pub_weights(callback: CallbackQuery) -> None:
-    students = get_all_weights()
+    gid = chat_group(callback.message.chat)
+    students = await get_all_weights(gid)
     text = "📊 <b>Веса:</b>\n\n"
     for name, weight in students:
-        text += f"{name}: <code>{weight:.2f}</code>\n"
-    await callback.message.answer(text, parse_mode="HTML", reply_markup=get_keyboard(callback.from_user.id))
+        text += f"{html.escape(name)}: <code>{weight:.2f}</code>\n"
+    await callback.message.answer(text, parse_mode="HTML", reply_markup=get_keyboard(callback.from_user.id, gid))
     await callback.answer()
 
+async def student_picker(group_id: int, select_prefix: str, page_prefix: str, page: Optional[List[str]] = None) -> InlineKeyboardMarkup:
+    students, has_prev, has_next = await fetch_students_page(group_id, page)
+    buttons = [(s_id, name, f"{select_prefix}{s_id}") for s_id, name, active in students]
+    initials = await get_student_initials(group_id) if has_prev or has_next else []
+    first = students[0][0] if students else None
+    last = students[-1][0] if students else None
+    nav = page_rows(page_prefix, first, last, has_prev, has_next, initials)
+    return render_selection(build_model(buttons, nav + [[("🚫 Отмена", "cancel_selection")]]), ())
+
+async def weight_history_picker(group_id: int, page: Optional[List[str]] = None) -> InlineKeyboardMarkup:
+    return await student_picker(group_id, "hist_weights_select_", "hist_page_", page)
+
+async def stats_picker(group_id: int, page: Optional[List[str]] = None) -> InlineKeyboardMarkup:
+    return await student_picker(group_id, "stats_select_", "stats_page_", page)
+
 @router.callback_query(F.data == "pub_weight_history")
 async def pub_weight_history(callback: CallbackQuery) -> None:
-    students = get_full_list()
-    buttons = []
-    row = []
-    for s_id, name, active in students:
-        row.append(InlineKeyboardButton(text=f"{name}", callback_data=f"hist_weights_select_{s_id}"))
-        if len(row) == 2:
-            buttons.append(row)
-            row = []
-    if row:
-        buttons.append(row)
-    buttons.append([InlineKeyboardButton(text="🚫 Отмена", callback_data="cancel_selection")])
-    await callback.message.answer("Выбери студента для просмотра истории весов:", reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
+    gid = chat_group(callback.message.chat)
+    await callback.message.answer("Выбери студента для просмотра истории весов:", reply_markup=await weight_history_picker(gid))
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("hist_page_"))
+async def weight_history_page(callback: CallbackQuery) -> None:
+    gid = chat_group(callback.message.chat)
+    page = parse_page(callback.data, "hist_page_")
+    if page is None:
+        await callback.answer()
+        return
+    try:
+        await callback.message.edit_reply_markup(reply_markup=await weight_history_picker(gid, page))
+    except TelegramBadRequest as e:
+        logging.error(f"Failed to switch history page: {e}")
     await callback.answer()
 
 @router.callback_query(F.data.startswith("hist_weights_select_"))
 async def show_weight_history(callback: CallbackQuery) -> None:
+    gid = chat_group(callback.message.chat)
     try:
-        sid = int(callback.data.replace("hist_weights_select_", ""))
+        sid_s, _, days_s = callback.data.replace("hist_weights_select_", "").partition("_")
+        sid = int(sid_s)
+        days = int(days_s) if days_s else None
     except Exception as e:
         logging.error(f"History select error: {e}")
         return
-    history = get_weight_history(sid, limit=11)
+    if not student_directory.in_group(sid, gid):
+        await callback.answer("⚠️ Нет истории для этого студента", show_alert=True)
+        return
+    history = await get_weight_history(sid, limit=11, since=days_ago(days) if days else None)
     if not history:
         await callback.answer("⚠️ Нет истории для этого студента", show_alert=True)
         return
     hist_chrono = list(reversed(history))
-    transitions = []
-    for i in range(1, len(hist_chrono)):
-        prev_w, prev_ts, _ = hist_chrono[i-1]
-        cur_w, cur_ts, place = hist_chrono[i]
-        place_txt = f" [{place}]" if place else ""
-        transitions.append((prev_ts, cur_ts, prev_w, cur_w, place_txt))
-    text = f"📈 <b>История весов студента {sid} (последние {min(10, len(transitions) if transitions else 1)}):</b>\n\n"
+    transitions = [(prev_ts, cur_ts, prev_w, cur_w, f" [{place}]" if place else "")
+                   for prev_ts, cur_ts, prev_w, cur_w, place in history_report.transitions(hist_chrono)]
+    period = f", за {days} дн." if days else ""
+    text = f"📈 <b>История весов студента {sid} (последние {min(10, len(transitions) if transitions else 1)}{period}):</b>\n\n"
     if transitions:
         for prev_ts, cur_ts, prev_w, cur_w, place_txt in transitions[-10:]:
-            text += f"{cur_ts}: {prev_w:.2f} → {cur_w:.2f}{place_txt}\n"
+            text += f"{format_ts(cur_ts)}: {prev_w:.2f} → {cur_w:.2f}{place_txt}\n"
     else:
         w, ts, place = hist_chrono[-1]
         place_txt = f" [{place}]" if place else ""
-        text += f"{ts}: {w:.2f}{place_txt}\n"
-    await callback.message.answer(text, parse_mode="HTML", reply_markup=get_keyboard(callback.from_user.id))
+        text += f"{format_ts(ts)}: {w:.2f}{place_txt}\n"
+    periods = [InlineKeyboardButton(text=label, callback_data=f"hist_weights_select_{sid}_{d}" if d else f"hist_weights_select_{sid}")
+               for label, d in (("7 дней", 7), ("30 дней", 30), ("Всё", None)) if d != days]
+    await callback.message.answer(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(inline_keyboard=[periods]))
+    await callback.answer()
+
+async def fetch_group_histories(group_id: int) -> Dict[int, List[history_report.HistoryRow]]:
+    rows = await get_group_weight_history(group_id, GROUP_HISTORY_TRANSITIONS + 1)
+    return history_report.group_by_student(rows)
+
+@router.callback_query(F.data == "group_history")
+async def show_group_history(callback: CallbackQuery) -> None:
+    gid = chat_group(callback.message.chat)
+    if not is_admin(callback.from_user.id, gid):
+        await callback.answer("⛔ Только для админов", show_alert=True)
+        return
+    histories = await fetch_group_histories(gid)
+    if not histories:
+        await callback.answer("⚠️ История весов пуста", show_alert=True)
+        return
+    chunks = history_report.format_table(histories, student_directory.name)
+    export_row = [InlineKeyboardButton(text="📄 CSV", callback_data="group_history_csv")]
+    if history_report.plt is not None:
+        export_row.insert(0, InlineKeyboardButton(text="🖼 График", callback_data="group_history_png"))
+    header = f"👥 <b>История весов группы</b> (вес, изменение и последние {GROUP_HISTORY_TRANSITIONS} переходов):\n"
+    for i, chunk in enumerate(chunks):
+        text = (header if i == 0 else "") + f"<pre>{chunk}</pre>"
+        markup = InlineKeyboardMarkup(inline_keyboard=[export_row]) if i == len(chunks) - 1 else None
+        await callback.message.answer(text, parse_mode="HTML", reply_markup=markup)
+    await callback.answer()
+
+@router.callback_query(F.data.in_({"group_history_csv", "group_history_png"}))
+async def export_group_history(callback: CallbackQuery) -> None:
+    gid = chat_group(callback.message.chat)
+    if not is_admin(callback.from_user.id, gid):
+        await callback.answer("⛔ Только для админов", show_alert=True)
+        return
+    histories = await fetch_group_histories(gid)
+    if not histories:
+        await callback.answer("⚠️ История весов пуста", show_alert=True)
+        return
+    if callback.data == "group_history_csv":
+        data = history_report.to_csv(histories, student_directory.name)
+        await callback.message.answer_document(BufferedInputFile(data, filename="weight_history.csv"))
+    else:
+        title = group_directory.title(gid) or "История весов"
+        png = await asyncio.to_thread(history_report.render_chart, histories, student_directory.name, title)
+        if png is None:
+            await callback.answer("⚠️ Графики недоступны: не установлен matplotlib", show_alert=True)
+            return
+        await callback.message.answer_photo(BufferedInputFile(png, filename="weight_history.png"))
+    await callback.answer()
+
+@router.callback_query(F.data == "pub_stats")
+async def pub_stats(callback: CallbackQuery) -> None:
+    gid = chat_group(callback.message.chat)
+    await callback.message.answer("Выбери студента для просмотра статистики мест:", reply_markup=await stats_picker(gid))
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("stats_page_"))
+async def stats_page(callback: CallbackQuery) -> None:
+    gid = chat_group(callback.message.chat)
+    page = parse_page(callback.data, "stats_page_")
+    if page is None:
+        await callback.answer()
+        return
+    try:
+        await callback.message.edit_reply_markup(reply_markup=await stats_picker(gid, page))
+    except TelegramBadRequest as e:
+        logging.error(f"Failed to switch stats page: {e}")
+    await callback.answer()
+
+def format_position_stats(name: str, rows: List[Tuple[str, Dict[str, Any]]]) -> str:
+    text = f"📊 <b>Статистика мест: {html.escape(name)}</b>\n"
+    for subject, st in sorted(rows, key=lambda r: r[0] != position_stats.ALL_SUBJECTS):
+        if not st["queues"] and not st["added_count"]:
+            continue
+        title = "Все предметы" if subject == position_stats.ALL_SUBJECTS else html.escape(subject)
+        text += f"\n<b>{title}</b>: очередей {st['queues']}"
+        mean = position_stats.mean_position(st)
+        if mean is not None:
+            text += f", среднее место {mean * 100:.0f}% от начала"
+        text += f"\n🥇 первым {st['first_count']} · последним {st['last_count']}"
+        if st["added_count"]:
+            text += f" · добавлен {st['added_count']}"
+        text += f"\nЧетверти: {st['q1']} / {st['q2']} / {st['q3']} / {st['q4']}\n"
+        streak = st["streak"]
+        if streak:
+            text += f"Серия: {abs(streak)} подряд {'в первой' if streak > 0 else 'во второй'} половине\n"
+        text += f"Рекорды: {st['best_front']} подряд в начале, {st['best_back']} в конце\n"
+    return text
+
+@router.callback_query(F.data.startswith("stats_select_"))
+async def show_position_stats(callback: CallbackQuery) -> None:
+    gid = chat_group(callback.message.chat)
+    try:
+        sid = int(callback.data.replace("stats_select_", ""))
+    except Exception as e:
+        logging.error(f"Stats select error: {e}")
+        return
+    if not student_directory.in_group(sid, gid):
+        await callback.answer("⚠️ Нет статистики для этого студента", show_alert=True)
+        return
+    rows = await get_student_stats(sid, gid)
+    if not rows:
+        await callback.answer("⚠️ Нет статистики для этого студента", show_alert=True)
+        return
+    await callback.message.answer(format_position_stats(student_directory.name(sid), rows), parse_mode="HTML",
+                                  reply_markup=get_keyboard(callback.from_user.id, gid))
     await callback.answer()
 
 @router.callback_query(F.data == "cancel_selection")
-async def cancel_selection_handler(callback: CallbackQuery) -> None:
-    user_selections.pop(callback.from_user.id, None)
+async def cancel_selection_handler(callback: CallbackQuery, state: FSMContext) -> None:
+    await state.clear()
     try:
         await callback.message.delete()
     except TelegramBadRequest as e:
@@ -537,140 +728,156 @@ async def cancel_selection_handler(callback: CallbackQuery) -> None:
     await callback.answer()
 
 @router.callback_query(F.data == "clear_current_list")
-async def clear_selection_handler(callback: CallbackQuery) -> None:
-    u_id = callback.from_user.id
-    if u_id in user_selections:
-        user_selections[u_id]["selected"] = []
-        try:
-            await callback.message.edit_reply_markup(reply_markup=get_selection_keyboard(u_id))
-        except Exception as e:
-            logging.error(f"Failed to clear selection UI: {e}")
+async def clear_selection_handler(callback: CallbackQuery, state: FSMContext) -> None:
+    gid = chat_group(callback.message.chat)
+    data = await state.get_data()
+    if data.get("action"):
+        if clear_selection(data):
+            await state.set_data(data)
+            try:
+                await callback.message.edit_reply_markup(reply_markup=await get_selection_keyboard(data, gid))
+            except Exception as e:
+                logging.error(f"Failed to clear selection UI: {e}")
         await callback.answer("Выбор очищен")
 
+@router.callback_query(F.data.startswith("page_"))
+async def selection_page(callback: CallbackQuery, state: FSMContext) -> None:
+    gid = chat_group(callback.message.chat)
+    data = await state.get_data()
+    page = parse_page(callback.data, "page_")
+    if not data.get("action") or page is None:
+        await callback.answer()
+        return
+    data["page"] = page
+    data.pop(MODEL_KEY, None)
+    markup = await get_selection_keyboard(data, gid)
+    await state.set_data(data)
+    try:
+        await callback.message.edit_reply_markup(reply_markup=markup)
+    except TelegramBadRequest as e:
+        logging.error(f"Failed to switch selection page: {e}")
+    await callback.answer()
+
 @router.callback_query(F.data.startswith("swap_toggle_"))
-async def toggle_swap_item(callback: CallbackQuery) -> None:
-    u_id = callback.from_user.id
-    if u_id not in user_selections or user_selections[u_id]["action"] != "swap":
+async def toggle_swap_item(callback: CallbackQuery, state: FSMContext) -> None:
+    gid = chat_group(callback.message.chat)
+    data = await state.get_data()
+    if data.get("action") != "swap":
         return
     try:
         pos = int(callback.data.replace("swap_toggle_", ""))
     except Exception as e:
         logging.error(f"Swap toggle parse error: {e}")
         return
-    selected = user_selections[u_id]["selected"]
-    qid = user_selections[u_id].get("queue_id")
-    if qid is None:
-        recent = get_recent_queues(1)
-        qid = recent[0][0] if recent else None
-    if qid:
-        q = get_queue(qid)
-        item = next((it for it in q["items"] if it[0] == pos), None)
-        if item and (item[2] or item[3] or (len(item) >= 7 and item[6])):
-            await callback.answer("⚠️ Нельзя выбирать приоритетных/опоздавших/добавленных", show_alert=True)
-            return
-    if pos in selected:
-        selected.remove(pos)
-    elif len(selected) < 2:
-        selected.append(pos)
-    else:
+    result = toggle_selection(data, pos, limit=2)
+    if result == "locked":
+        await callback.answer("⚠️ Нельзя выбирать приоритетных/опоздавших/добавленных", show_alert=True)
+        return
+    if result == "full":
         await callback.answer("⚠️ Можно выбрать только двоих", show_alert=True)
         return
+    if result == "missing":
+        await callback.answer()
+        return
+    await state.set_data(data)
     try:
-        await callback.message.edit_reply_markup(reply_markup=get_selection_keyboard(u_id))
+        await callback.message.edit_reply_markup(reply_markup=await get_selection_keyboard(data, gid))
     except Exception as e:
         logging.error(f"Error updating swap keyboard: {e}")
     await callback.answer()
 
 @router.callback_query(F.data == "confirm_swap")
-async def confirm_swap_ui(callback: CallbackQuery) -> None:
+async def confirm_swap_ui(callback: CallbackQuery, state: FSMContext) -> None:
+    gid = chat_group(callback.message.chat)
     u_id = callback.from_user.id
-    if u_id not in user_selections or len(user_selections[u_id]["selected"]) != 2:
+    data = await state.get_data()
+    if data.get("action") != "swap" or len(data["selected"]) != 2:
         await callback.answer("⚠️ Выбери двоих!", show_alert=True)
         return
-    p1, p2 = user_selections[u_id]["selected"]
-    qid = user_selections[u_id].get("queue_id")
+    p1, p2 = data["selected"]
+    qid = data.get("queue_id")
     if qid is None:
-        recent = get_recent_queues(1)
+        recent = await get_recent_queues(1, group_id=gid)
         if not recent:
             await callback.answer("⚠️ Нет очереди", show_alert=True)
             return
         qid = recent[0][0]
     try:
-        swap_and_cascade(qid, p1, p2)
+        async with queue_locks.hold(qid):
+            await swap_and_cascade(qid, p1, p2, expected_version=data.get("version"))
     except Exception as e:
         logging.error(f"Swap cascade error: {e}")
         await callback.answer(f"Ошибка: {str(e)}", show_alert=True)
         return
-    user_selections.pop(u_id, None)
+    await state.clear()
     try:
-        await callback.message.edit_text("🔄 Очередь обновлена", reply_markup=get_keyboard(u_id, queue_id=qid))
+        await callback.message.edit_text("🔄 Очередь обновлена", reply_markup=get_keyboard(u_id, gid, queue_id=qid))
     except Exception as e:
         logging.error(f"Failed to edit swap message: {e}")
     await callback.answer()
 
 @router.callback_query(F.data.startswith("toggle_"))
-async def toggle_student(callback: CallbackQuery) -> None:
-    u_id = callback.from_user.id
-    if u_id not in user_selections:
+async def toggle_student(callback: CallbackQuery, state: FSMContext) -> None:
+    gid = chat_group(callback.message.chat)
+    data = await state.get_data()
+    if data.get("action") not in ("priority", "late", "enable", "disable"):
         return
     try:
         s_id = int(callback.data.replace("toggle_", ""))
     except Exception as e:
         logging.error(f"Toggle student parse error: {e}")
         return
-    selected = user_selections[u_id]["selected"]
-    if s_id in selected:
-        selected.remove(s_id)
-    else:
-        selected.append(s_id)
-    try:
-        await callback.message.edit_reply_markup(reply_markup=get_selection_keyboard(u_id))
-    except Exception as e:
-        logging.error(f"Failed to update toggle keyboard: {e}")
+    if toggle_selection(data, s_id) in ("added", "removed"):
+        await state.set_data(data)
+        try:
+            await callback.message.edit_reply_markup(reply_markup=await get_selection_keyboard(data, gid))
+        except Exception as e:
+            logging.error(f"Failed to update toggle keyboard: {e}")
     await callback.answer()
 
 @router.callback_query(F.data == "confirm_selection")
-async def confirm_selection(callback: CallbackQuery) -> None:
-    global priority_list, late_list
+async def confirm_selection(callback: CallbackQuery, state: FSMContext) -> None:
+    gid = chat_group(callback.message.chat)
     u_id = callback.from_user.id
-    if u_id not in user_selections:
+    data = await state.get_data()
+    if not data.get("action"):
         return
-    action, ids = user_selections[u_id]["action"], user_selections[u_id]["selected"]
-    if action == "priority":
-        priority_list = ids.copy()
-    elif action == "late":
-        late_list = ids.copy()
+    action, ids = data["action"], data["selected"]
+    if action in ("priority", "late"):
+        await set_marks(action, ids, gid)
     elif action == "enable":
         for s_id in ids:
-            toggle_student_status(s_id, 1)
+            await toggle_student_status(s_id, 1, gid)
     elif action == "disable":
         for s_id in ids:
-            toggle_student_status(s_id, 0)
-    user_selections.pop(u_id, None)
+            await toggle_student_status(s_id, 0, gid)
+    await state.clear()
     try:
-        await callback.message.edit_text("✅ Изменения применены", reply_markup=get_keyboard(u_id))
+        await callback.message.edit_text("✅ Изменения применены", reply_markup=get_keyboard(u_id, gid))
     except Exception as e:
         logging.error(f"Failed to edit text on confirm: {e}")
     await callback.answer()
 
 @router.callback_query(F.data.startswith("admin_"))
-async def handle_admin_btn(callback: CallbackQuery) -> None:
+async def handle_admin_btn(callback: CallbackQuery, state: FSMContext) -> None:
+    gid = chat_group(callback.message.chat)
     u_id = callback.from_user.id
-    if not is_admin(u_id):
+    if not is_admin(u_id, gid):
         await callback.answer("⛔ Нет прав! Знай свой место!", show_alert=True)
         return
     if callback.data == "admin_gen":
         await callback.message.answer("Введи название предмета для новой очереди (например, \"Физика\"):")
-        user_selections[u_id] = {"action": "await_subject_for_gen", "selected": None, "timestamp": time.time()}
+        await state.set_state(QueueStates.awaiting_subject)
         await callback.answer()
         return
     elif callback.data == "admin_enable_all":
-        enable_all_students()
-        await callback.message.answer("✅ Все включены", reply_markup=get_keyboard(u_id))
+        await enable_all_students(gid)
+        await callback.message.answer("✅ Все включены", reply_markup=get_keyboard(u_id, gid))
     await callback.answer()
 
 @router.message(Command("start"))
 async def cmd_start(message: Message) -> None:
+    gid = chat_group(message.chat)
     await message.answer(
         "🤖 qq чат! Я бот, который позволит вам знать своё место\n\n"
         "В моем алгоритме используется система весов, чтобы очередь была честной:\n"
@@ -678,13 +885,14 @@ async def cmd_start(message: Message) -> None:
         "• Был первым - вес падает. Был в конце - вес растет.\n"
         "• Система самобалансирующаяся.\n\n"
         "Введи /help, чтобы увидеть список команд.",
-        reply_markup=get_keyboard(message.from_user.id)
+        reply_markup=get_keyboard(message.from_user.id, gid)
     )
 
 @router.message(Command("help"))
 async def cmd_help(message: Message) -> None:
+    gid = chat_group(message.chat)
     user_id = message.from_user.id
-    if is_admin(user_id):
+    if is_admin(user_id, gid):
         text = (
             "👮‍♂️ <b>Админка</b>\n"
             "🎲 <b>Сгенерировать</b> — создать новую очередь (бот спросит название предмета).\n"
@@ -693,13 +901,21 @@ async def cmd_help(message: Message) -> None:
             "🐌 <b>Опоздания</b> — выделить студентов, которые должны быть внизу очереди.\n"
             "❌ <b>Исключить</b> — временно убрать человека из ротации (статус выключен).\n"
             "✅ <b>Включить</b> — вернуть человека в ротацию.\n"
-            "🔄 <b>Включить всех</b> — быстро восстановить всех студентов в ротацию.\n\n"
+            "🔄 <b>Включить всех</b> — быстро восстановить всех студентов в ротацию.\n"
+            "👥 <b>История группы</b> — веса всех студентов одной таблицей, с выгрузкой в CSV или графиком.\n\n"
+            "👥 <b>Группы (команды в чате группы):</b>\n"
+            "/setup — подключить чат как отдельную группу (нужны права администратора чата).\n"
+            "/add_student Имя — добавить студента в группу.\n"
+            "/admin — ответом на сообщение выдать права админа группы.\n"
+            "/params K MIN MAX — задать параметры весов группы (без аргументов — показать текущие).\n"
+            "/queues Предмет [с] [по] — очереди по предмету за период (даты ДД.ММ.ГГГГ).\n\n"
             "🧩 <b>Админские действия над очередью (появляются при просмотре конкретной очереди):</b>\n"
             "➕ <b>Добавить студента</b> — добавить выбранного студента в текущую очередь.\n"
             "➖ <b>Удалить студента</b> — удалить выбранного студента из текущей очереди.\n\n"
             "👤 <b>Общие команды (доступны всем):</b>\n"
             "📌 <b>Текущая очередь</b> — показать последнюю сохранённую очередь: позиции, пометки (приоритет/опоздание/добавлен) и отображаемые веса.\n"
             "📈 <b>История весов</b> — посмотреть историю изменений веса конкретного студента (переходы prev → cur с датами и местом в очереди, если доступно).\n"
+            "📊 <b>Статистика</b> — сколько раз студент был первым/последним, по четвертям очереди, среднее место и серии.\n"
             "📜 <b>Очереди</b> — список сохранённых очередей.\n"
             "📝 <b>Список</b> — посмотреть всех одногруппников и их статус (включён/выключен).\n"
             "📊 <b>Веса</b> — посмотреть текущие коэффициенты (шансы).\n"
@@ -709,52 +925,72 @@ async def cmd_help(message: Message) -> None:
             "👤 <b>Команды, на которые тебе хватит прав:</b>\n"
             "📌 <b>Текущая очередь</b> — показать последнюю сохранённую очередь с позициями и видимыми весами.\n"
             "📈 <b>История весов</b> — выбрать студента и посмотреть, как менялся его вес во времени.\n"
+            "📊 <b>Статистика</b> — сколько раз студент был первым/последним, по четвертям очереди, среднее место и серии.\n"
             "📜 <b>Очереди</b> — список сохранённых очередей.\n"
+            "/queues Предмет [с] [по] — очереди по предмету за период (даты ДД.ММ.ГГГГ).\n"
             "📝 <b>Список</b> — посмотреть всех одногруппников и их статус.\n"
             "📊 <b>Веса</b> — посмотреть текущие коэффициенты (шансы).\n"
         )
-    await message.answer(text, parse_mode="HTML", reply_markup=get_keyboard(user_id))
+    await message.answer(text, parse_mode="HTML", reply_markup=get_keyboard(user_id, gid))
+
+@router.inline_query()
+async def search_students_inline(inline_query: InlineQuery) -> None:
+    group_ids = group_directory.admin_groups(inline_query.from_user.id) | {DEFAULT_GROUP_ID}
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    found = student_directory.search(group_ids, inline_query.query.strip(), offset, INLINE_SEARCH_LIMIT + 1)
+    results = []
+    for sid, name, weight, active, gid in found[:INLINE_SEARCH_LIMIT]:
+        status = "активен" if active else "исключён"
+        title = group_directory.title(gid)
+        group_txt = f"\nГруппа: {title}" if title else ""
+        results.append(InlineQueryResultArticle(
+            id=str(sid),
+            title=name,
+            description=f"Вес {weight:.2f} · {status}",
+            input_message_content=InputTextMessageContent(message_text=f"👤 {name}\nВес: {weight:.2f}\nСтатус: {status}{group_txt}"),
+        ))
+    next_offset = str(offset + INLINE_SEARCH_LIMIT) if len(found) > INLINE_SEARCH_LIMIT else ""
+    await inline_query.answer(results, cache_time=5, is_personal=True, next_offset=next_offset)
 
-@router.message()
-async def generic_text_handler(message: Message) -> None:
+@router.message(StateFilter(QueueStates.awaiting_subject))
+async def generic_text_handler(message: Message, state: FSMContext) -> None:
+    gid = chat_group(message.chat)
     u_id = message.from_user.id
-    sel = user_selections.get(u_id)
-    cleanup_old_selections()
-    if sel and sel.get("action") == "await_subject_for_gen":
+    if message.text:
         subject = message.text.strip()
         try:
-            qid = generate_and_save_queue(subject, priority_ids=priority_list, late_ids=late_list)
+            qid = await generate_and_save_queue(subject, priority_ids=await get_marks("priority", gid), late_ids=await get_marks("late", gid), group_id=gid)
         except Exception as e:
             logging.error(f"Queue gen error: {e}")
             await message.answer(f"Ошибка генерации: {e}")
-            user_selections.pop(u_id, None)
+            await state.clear()
             return
 
-        priority_list.clear()
-        late_list.clear()
-        user_selections.pop(u_id, None)
+        await set_marks("priority", [], gid)
+        await set_marks("late", [], gid)
+        await state.clear()
 
-        q = get_queue(qid)
-        if q:
-            text = format_queue_message(q)
+        text = await render_queue(qid, gid)
+        if text:
             await message.answer(
                 text,
                 parse_mode="HTML",
-                reply_markup=get_keyboard(u_id, queue_id=qid)
+                reply_markup=get_keyboard(u_id, gid, queue_id=qid)
             )
         return
     return
 
 @router.message(Command("swap"))
 async def cmd_swap_text(message: Message, command: CommandObject) -> None:
-    if not is_admin(message.from_user.id):
+    gid = chat_group(message.chat)
+    if not is_admin(message.from_user.id, gid):
         return
-    recent = get_recent_queues(1)
+    recent = await get_recent_queues(1, group_id=gid)
     if not recent:
         await message.answer("Очередь пуста")
         return
     qid = recent[0][0]
-    current_q = get_queue(qid)
+    current_q = await get_queue(qid)
     if not current_q:
         await message.answer("Очередь пуста")
         return
@@ -777,26 +1013,112 @@ async def cmd_swap_text(message: Message, command: CommandObject) -> None:
     if s1_pre[2] or s1_pre[3] or (len(s1_pre) >= 7 and s1_pre[6]) or s2_pre[2] or s2_pre[3] or (len(s2_pre) >= 7 and s2_pre[6]):
         return await message.answer("⚠️ Нельзя менять приоритетных/опоздавших/добавленных!")
     try:
-        swap_and_cascade(qid, p1, p2)
+        async with queue_locks.hold(qid):
+            await swap_and_cascade(qid, p1, p2, expected_version=current_q["version"])
     except Exception as e:
         logging.error(f"Swap execution error: {e}")
         return await message.answer(f"Ошибка: {e}")
-    await message.answer(f"🔄 Очередь обновлена", reply_markup=get_keyboard(message.from_user.id))
+    await message.answer(f"🔄 Очередь обновлена", reply_markup=get_keyboard(message.from_user.id, gid))
+
+@router.message(Command("queues"))
+async def cmd_queues(message: Message, command: CommandObject) -> None:
+    gid = chat_group(message.chat)
+    args = (command.args or "").split()
+    dates = []
+    while args and len(dates) < 2:
+        try:
+            parse_date(args[-1])
+        except ValueError:
+            break
+        dates.insert(0, args.pop())
+    subject = " ".join(args)
+    if not subject:
+        await message.answer("Использование: /queues Предмет [с ДД.ММ.ГГГГ] [по ДД.ММ.ГГГГ]")
+        return
+    since = parse_date(dates[0]) if dates else None
+    until = parse_date(dates[1], end_of_day=True) if len(dates) > 1 else None
+    qlist = await get_queues_by_subject(subject, since, until, group_id=gid)
+    if not qlist:
+        await message.answer("⚠️ Очередей по этому предмету за период нет")
+        return
+    await message.answer(f"📜 <b>Очереди «{html.escape(subject)}»:</b>", parse_mode="HTML", reply_markup=queue_list_keyboard(qlist))
 
 @router.message(Command("reset"))
 async def cmd_reset(message: Message) -> None:
-    if not is_admin(message.from_user.id):
+    gid = chat_group(message.chat)
+    if not is_admin(message.from_user.id, gid):
         await message.answer("⛔ Нет прав! Знай свой место!")
         return
-    import sqlite3
-    from config import DB_NAME
     try:
-        with sqlite3.connect(DB_NAME) as conn:
-            cur = conn.cursor()
-            cur.execute("UPDATE students SET weight=1.0")
-            cur.execute("DELETE FROM weight_history")
-            conn.commit()
-        await message.answer("⚠️ Веса сброшены", reply_markup=get_keyboard(message.from_user.id))
+        await reset_all_weights(gid)
+        await message.answer("⚠️ Веса сброшены", reply_markup=get_keyboard(message.from_user.id, gid))
     except Exception as e:
         logging.error(f"Database reset error: {e}")
-        await message.answer("Ошибка сброса весов")
\ No newline at end of file
+        await message.answer("Ошибка сброса весов")
+
+@router.message(Command("setup"))
+async def cmd_setup(message: Message) -> None:
+    gid = chat_group(message.chat)
+    u_id = message.from_user.id
+    if message.chat.type not in ("group", "supergroup"):
+        await message.answer("Команда работает только в групповом чате")
+        return
+    if not is_admin(u_id, gid):
+        member = await message.bot.get_chat_member(message.chat.id, u_id)
+        if member.status not in ("creator", "administrator"):
+            await message.answer("⛔ Нет прав! Знай свой место!")
+            return
+    await save_group(gid, message.chat.title)
+    await add_group_admin(gid, u_id)
+    await message.answer("✅ Группа подключена. Добавь студентов командой /add_student Имя", reply_markup=get_keyboard(u_id, gid))
+
+@router.message(Command("add_student"))
+async def cmd_add_student(message: Message, command: CommandObject) -> None:
+    gid = chat_group(message.chat)
+    if not is_admin(message.from_user.id, gid):
+        await message.answer("⛔ Нет прав! Знай свой место!")
+        return
+    name = (command.args or "").strip()
+    if not name:
+        await message.answer("Использование: /add_student Фамилия Имя")
+        return
+    sid = await add_student(name, group_id=gid)
+    await message.answer(f"✅ Добавлен студент <code>{sid}</code>: {html.escape(name)}", parse_mode="HTML")
+
+@router.message(Command("admin"))
+async def cmd_grant_admin(message: Message, command: CommandObject) -> None:
+    gid = chat_group(message.chat)
+    if not is_admin(message.from_user.id, gid):
+        await message.answer("⛔ Нет прав! Знай свой место!")
+        return
+    target = message.reply_to_message.from_user.id if message.reply_to_message else None
+    if target is None:
+        try:
+            target = int((command.args or "").strip())
+        except ValueError:
+            await message.answer("Использование: ответь на сообщение командой /admin или /admin <user_id>")
+            return
+    await add_group_admin(gid, target)
+    await message.answer(f"✅ Пользователь <code>{target}</code> теперь админ группы", parse_mode="HTML")
+
+@router.message(Command("params"))
+async def cmd_params(message: Message, command: CommandObject) -> None:
+    gid = chat_group(message.chat)
+    args = (command.args or "").split()
+    if not args:
+        cur = await get_group_settings(gid)
+        await message.answer(f"K = {cur.k_factor}, вес от {cur.weight_min} до {cur.weight_max}")
+        return
+    if not is_admin(message.from_user.id, gid):
+        await message.answer("⛔ Нет прав! Знай свой место!")
+        return
+    try:
+        settings = GroupSettings(*map(float, args))
+        if len(args) != 3 or not 0 < settings.weight_min <= settings.weight_max:
+            raise ValueError
+    except (TypeError, ValueError) as e:
+        logging.error(f"Params parse error: {e}")
+        await message.answer("Использование: /params 1.0 0.1 10")
+        return
+    await save_group(gid, message.chat.title, settings)
+    await message.answer(f"✅ K = {settings.k_factor}, вес от {settings.weight_min} до {settings.weight_max}")
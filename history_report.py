@@ -0,0 +1,84 @@
+import csv
+import html
+import io
+from itertools import groupby
+from operator import itemgetter
+from typing import Callable, Dict, List, Optional, Tuple
+
+from timeutil import format_ts
+
+try:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+except ImportError:
+    plt = None
+
+HistoryRow = Tuple[float, int, Optional[str]]
+Transition = Tuple[int, int, float, float, Optional[str]]
+
+SPARK = "▁▂▃▄▅▆▇█"
+NAME_WIDTH = 18
+MESSAGE_LIMIT = 4000
+
+def transitions(history: List[HistoryRow]) -> List[Transition]:
+    return [
+        (prev_ts, cur_ts, prev_w, cur_w, place)
+        for (prev_w, prev_ts, _), (cur_w, cur_ts, place) in zip(history, history[1:])
+    ]
+
+def group_by_student(rows: List[Tuple[int, float, int, Optional[str]]]) -> Dict[int, List[HistoryRow]]:
+    return {sid: [r[1:] for r in student_rows] for sid, student_rows in groupby(rows, key=itemgetter(0))}
+
+def sparkline(values: List[float]) -> str:
+    lo, hi = min(values), max(values)
+    if hi - lo < 1e-9:
+        return SPARK[len(SPARK) // 2] * len(values)
+    return "".join(SPARK[round((v - lo) / (hi - lo) * (len(SPARK) - 1))] for v in values)
+
+def format_table(histories: Dict[int, List[HistoryRow]], name: Callable[[int], str]) -> List[str]:
+    lines = []
+    for sid, history in sorted(histories.items(), key=lambda h: name(h[0])):
+        weights = [w for w, _, _ in history]
+        delta = weights[-1] - weights[0]
+        label = name(sid)[:NAME_WIDTH].ljust(NAME_WIDTH)
+        lines.append(html.escape(f"{label} {weights[-1]:5.2f} {delta:+5.2f} {sparkline(weights)}"))
+    chunks, current = [], ""
+    for line in lines:
+        if current and len(current) + len(line) + 1 > MESSAGE_LIMIT:
+            chunks.append(current)
+            current = ""
+        current += line + "\n"
+    if current:
+        chunks.append(current)
+    return chunks
+
+def to_csv(histories: Dict[int, List[HistoryRow]], name: Callable[[int], str]) -> bytes:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(["student_id", "student", "timestamp", "time", "weight_before", "weight_after", "place_info"])
+    for sid, history in histories.items():
+        for prev_ts, cur_ts, prev_w, cur_w, place in transitions(history):
+            writer.writerow([sid, name(sid), cur_ts, format_ts(cur_ts), prev_w, cur_w, place or ""])
+    return buf.getvalue().encode("utf-8-sig")
+
+def render_chart(histories: Dict[int, List[HistoryRow]], name: Callable[[int], str], title: str = "") -> Optional[bytes]:
+    if plt is None or not histories:
+        return None
+    fig, ax = plt.subplots(figsize=(10, 6), dpi=100)
+    try:
+        for sid, history in histories.items():
+            ax.plot(range(-len(history) + 1, 1), [w for w, _, _ in history], marker=".", linewidth=1, label=name(sid))
+        ax.set_xlabel("изменения (0 — последнее)")
+        ax.set_ylabel("вес")
+        if title:
+            ax.set_title(title)
+        ax.grid(alpha=0.3)
+        if len(histories) <= 40:
+            ax.legend(fontsize=6, ncol=2, loc="center left", bbox_to_anchor=(1.0, 0.5))
+        fig.tight_layout()
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png")
+        return buf.getvalue()
+    finally:
+        plt.close(fig)
@@ -1,15 +1,104 @@
 import asyncio
+import signal
+from aiohttp import web
 from aiogram import Bot, Dispatcher
-from config import TOKEN
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from config import (
+    TOKEN, RUN_MODE, WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+    WEBAPP_HOST, WEBAPP_PORT, HEALTH_PATH, TELEGRAM_API_URL, METRICS_HOST, METRICS_PORT, OUTBOUND_THROTTLE,
+    ARCHIVE_INTERVAL_SECONDS
+)
 from handlers import router
-from database import init_db
+from storage import create_storage
+from throttle import OutboundThrottler
+from database import init_db, close_db
+from archive import run_compaction
+import async_db
+import metrics
+
+def create_bot() -> Bot:
+    if TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+        bot = Bot(token=TOKEN, session=session)
+    else:
+        bot = Bot(token=TOKEN)
+    if OUTBOUND_THROTTLE:
+        bot.session.middleware(OutboundThrottler())
+    return bot
+
+def create_dispatcher() -> Dispatcher:
+    dp = Dispatcher(storage=create_storage())
+    dp.include_router(router)
+    if METRICS_PORT:
+        metrics.install((("message", dp.message), ("callback_query", dp.callback_query)))
+    return dp
+
+async def on_webhook_startup(bot: Bot) -> None:
+    await bot.set_webhook(f"{WEBHOOK_BASE_URL}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET or None)
+
+async def on_webhook_shutdown(bot: Bot) -> None:
+    await bot.delete_webhook()
+
+async def health(request: web.Request) -> web.Response:
+    return web.json_response({"status": "ok", "mode": RUN_MODE})
+
+def create_webhook_app(bot: Bot, dp: Dispatcher) -> web.Application:
+    dp.startup.register(on_webhook_startup)
+    dp.shutdown.register(on_webhook_shutdown)
+    app = web.Application()
+    app.router.add_get(HEALTH_PATH, health)
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET or None).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+async def run_webhook(bot: Bot, dp: Dispatcher) -> None:
+    if not WEBHOOK_BASE_URL:
+        raise RuntimeError("WEBHOOK_BASE_URL is required in webhook mode")
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    runner = web.AppRunner(create_webhook_app(bot, dp))
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT).start()
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        await bot.session.close()
 
 async def main() -> None:
+    metrics_runner, lag_task, archive_task = None, None, None
+    if METRICS_PORT:
+        metrics.enable_db_metrics()
     init_db()
-    bot = Bot(token=TOKEN)
-    dp = Dispatcher()
-    dp.include_router(router)
-    await dp.start_polling(bot)
+    bot = create_bot()
+    dp = create_dispatcher()
+    try:
+        if METRICS_PORT:
+            metrics_runner = await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT)
+            lag_task = asyncio.create_task(metrics.monitor_event_loop())
+        if ARCHIVE_INTERVAL_SECONDS:
+            archive_task = asyncio.create_task(run_compaction())
+        if RUN_MODE == "webhook":
+            await run_webhook(bot, dp)
+        else:
+            await dp.start_polling(bot)
+    finally:
+        if lag_task is not None:
+            lag_task.cancel()
+        if archive_task is not None:
+            archive_task.cancel()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await dp.storage.close()
+        async_db.shutdown()
+        close_db()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
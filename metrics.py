@@ -0,0 +1,237 @@
+import asyncio
+import contextvars
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from aiohttp import web
+
+from config import METRICS_PATH, EVENT_LOOP_LAG_INTERVAL
+from database import register_trace_hook, register_timing_hook
+from render_cache import queue_render_cache
+import async_db
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+LabelKey = Tuple[str, ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for k, v in labels.items():
+        v = str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelKey:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _labels(self, key: LabelKey) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def samples(self) -> List[Sample]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            return [(self.name, self._labels(k), v) for k, v in self._values.items()]
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[LabelKey, float] = {}
+
+    def set(self, value: float, **labels: Any) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            return [(self.name, self._labels(k), v) for k, v in self._values.items()]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values: Dict[LabelKey, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = ([0] * len(self.buckets), [0.0])
+            counts, total = entry
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            total[0] += value
+
+    def samples(self) -> List[Sample]:
+        out = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                labels = self._labels(key)
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    out.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+                out.append((f"{self.name}_sum", labels, total[0]))
+                out.append((f"{self.name}_count", labels, cumulative))
+        return out
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], None]) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+handler_seconds = registry.register(Histogram("bot_handler_seconds", "Handler latency", ("event", "handler")))
+handler_errors = registry.register(Counter("bot_handler_errors_total", "Handlers that raised", ("event", "handler")))
+update_statements = registry.register(Histogram("bot_update_db_statements", "SQL statements issued per handled update", ("event", "handler"), COUNT_BUCKETS))
+db_statements = registry.register(Counter("db_statements_total", "SQL statements executed", ("kind",)))
+db_transaction_seconds = registry.register(Histogram("db_transaction_seconds", "Duration of read and write transactions", ("mode",)))
+cache_hits = registry.register(Gauge("cache_hits", "Cache hits since start", ("cache",)))
+cache_misses = registry.register(Gauge("cache_misses", "Cache misses since start", ("cache",)))
+cache_hit_ratio = registry.register(Gauge("cache_hit_ratio", "Cache hit ratio", ("cache",)))
+loop_lag = registry.register(Histogram("event_loop_lag_seconds", "Event loop lag"))
+loop_lag_last = registry.register(Gauge("event_loop_lag_last_seconds", "Last measured event loop lag"))
+executor_pending = registry.register(Gauge("db_executor_pending", "Calls waiting for a database executor thread", ("executor",)))
+
+_update_counter: "contextvars.ContextVar[Optional[List[int]]]" = contextvars.ContextVar("update_statements", default=None)
+_caches: Dict[str, Callable[[], Tuple[int, int]]] = {}
+
+def register_cache(name: str, stats: Callable[[], Tuple[int, int]]) -> None:
+    _caches[name] = stats
+
+def _collect_caches() -> None:
+    for name, stats in _caches.items():
+        hits, misses = stats()
+        cache_hits.set(hits, cache=name)
+        cache_misses.set(misses, cache=name)
+        cache_hit_ratio.set(hits / (hits + misses) if hits + misses else 0.0, cache=name)
+
+def _collect_executors() -> None:
+    for name, pending in async_db.pending().items():
+        executor_pending.set(pending, executor=name)
+
+def _on_statement(statement: str) -> None:
+    db_statements.inc(kind=statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "")
+    counter = _update_counter.get()
+    if counter is not None:
+        counter[0] += 1
+
+def _on_transaction(mode: str, seconds: float) -> None:
+    db_transaction_seconds.observe(seconds, mode=mode)
+
+register_cache("queue_render", lambda: (queue_render_cache.hits, queue_render_cache.misses))
+registry.register_collector(_collect_caches)
+registry.register_collector(_collect_executors)
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    def __init__(self, event: str) -> None:
+        self.event = event
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        counter = [0]
+        token = _update_counter.set(counter)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(event=self.event, handler=name)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - started, event=self.event, handler=name)
+            update_statements.observe(counter[0], event=self.event, handler=name)
+            _update_counter.reset(token)
+
+async def monitor_event_loop(interval: float = EVENT_LOOP_LAG_INTERVAL) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        loop_lag_last.set(lag)
+        loop_lag.observe(lag)
+
+async def metrics_view(request: web.Request) -> web.Response:
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+async def start_metrics_server(host: str, port: int, path: str = METRICS_PATH) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get(path, metrics_view)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+def enable_db_metrics() -> None:
+    register_trace_hook(_on_statement)
+    register_timing_hook(_on_transaction)
+
+def install(observers: Iterable[Tuple[str, Any]]) -> None:
+    for event, observer in observers:
+        observer.middleware(HandlerMetricsMiddleware(event))
@@ -0,0 +1,500 @@
+import json
+import logging
+import sqlite3
+import time
+from itertools import groupby
+from operator import itemgetter
+from typing import Callable, List, Tuple
+
+from config import DEFAULT_GROUP_ID, K_FACTOR, WEIGHT_MIN_LIMIT, WEIGHT_MAX_LIMIT
+from timeutil import parse_legacy_ts
+import position_stats
+
+Migration = Tuple[int, str, Callable[[sqlite3.Cursor], None]]
+
+def _column_names(cur: sqlite3.Cursor, table: str) -> List[str]:
+    cur.execute(f"PRAGMA table_info({table})")
+    return [r[1] for r in cur.fetchall()]
+
+def _add_is_added(cur: sqlite3.Cursor) -> None:
+    if 'is_added' not in _column_names(cur, "queue_items"):
+        cur.execute("ALTER TABLE queue_items ADD COLUMN is_added INTEGER NOT NULL DEFAULT 0")
+
+def _add_lookup_indexes(cur: sqlite3.Cursor) -> None:
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_queue_items_queue_position ON queue_items(queue_id, position)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_queue_items_queue_student ON queue_items(queue_id, student_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_weight_history_student ON weight_history(student_id, id)")
+
+def _add_queue_version(cur: sqlite3.Cursor) -> None:
+    if 'version' not in _column_names(cur, "queues"):
+        cur.execute("ALTER TABLE queues ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+def _add_fsm_storage(cur: sqlite3.Cursor) -> None:
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS fsm_storage (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT,
+        expires_at REAL NOT NULL
+    )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_fsm_storage_expires ON fsm_storage(expires_at)")
+
+def _add_groups(cur: sqlite3.Cursor) -> None:
+    for table in ("students", "queues"):
+        if 'group_id' not in _column_names(cur, table):
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN group_id INTEGER NOT NULL DEFAULT {DEFAULT_GROUP_ID}")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS groups (
+        id INTEGER PRIMARY KEY,
+        title TEXT,
+        k_factor REAL,
+        weight_min REAL,
+        weight_max REAL
+    )""")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS group_admins (
+        group_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        PRIMARY KEY (group_id, user_id)
+    ) WITHOUT ROWID""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_students_group ON students(group_id, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_queues_group ON queues(group_id, id)")
+    for kind in ("priority", "late"):
+        cur.execute("UPDATE meta SET key=? WHERE key=?", (f"marks:{DEFAULT_GROUP_ID}:{kind}", f"marks:{kind}"))
+
+def _add_ops_log(cur: sqlite3.Cursor) -> None:
+    for column in ("slot", "slot_total"):
+        if column not in _column_names(cur, "queue_items"):
+            cur.execute(f"ALTER TABLE queue_items ADD COLUMN {column} INTEGER")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS ops (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        group_id INTEGER NOT NULL,
+        queue_id INTEGER,
+        kind TEXT NOT NULL,
+        params TEXT NOT NULL,
+        seed INTEGER,
+        created_at TEXT NOT NULL
+    )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ops_group_queue ON ops(group_id, queue_id, id)")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS weight_snapshots (
+        group_id INTEGER NOT NULL,
+        queue_id INTEGER NOT NULL,
+        student_id INTEGER NOT NULL,
+        weight REAL NOT NULL,
+        PRIMARY KEY (group_id, queue_id, student_id)
+    ) WITHOUT ROWID""")
+
+    cur.execute("""
+        SELECT q.group_id, q.id, q.subject, q.created_at, i.position, i.student_id, i.is_priority, i.is_late, i.is_added, i.weight_before
+        FROM queues q JOIN queue_items i ON i.queue_id = q.id
+        ORDER BY q.group_id, q.id, i.position
+    """)
+    slots, ops, snapshots = [], [], []
+    for gid, group_rows in groupby(cur.fetchall(), key=itemgetter(0)):
+        entering = {}
+        for qid, rows in groupby(group_rows, key=itemgetter(1)):
+            rows = list(rows)
+            regulars = [r for r in rows if not r[6] and not r[7] and not r[8]]
+            slots += [(rel, len(regulars), qid, r[4]) for rel, r in enumerate(regulars, start=1)]
+            generated = [r for r in rows if not r[8]]
+            ops.append((gid, qid, "generate", json.dumps({
+                "subject": rows[0][2],
+                "order": [r[5] for r in generated],
+                "priority": [r[5] for r in generated if r[6]],
+                "late": [r[5] for r in generated if r[7]],
+            }), rows[0][3]))
+            added = [r[5] for r in rows if r[8]]
+            if added:
+                ops.append((gid, qid, "add", json.dumps({"students": added}), rows[0][3]))
+            for r in rows:
+                entering.setdefault(r[5], r[9])
+        cur.execute("SELECT id, weight FROM students WHERE group_id=?", (gid,))
+        weights = dict(cur.fetchall())
+        weights.update(entering)
+        cur.execute("SELECT MIN(id) FROM queues WHERE group_id=?", (gid,))
+        first = cur.fetchone()[0]
+        snapshots += [(gid, first, sid, w) for sid, w in weights.items()]
+    cur.executemany("UPDATE queue_items SET slot=?, slot_total=? WHERE queue_id=? AND position=?", slots)
+    cur.executemany("INSERT INTO ops (group_id, queue_id, kind, params, created_at) VALUES (?, ?, ?, ?, ?)", ops)
+    cur.executemany("INSERT OR REPLACE INTO weight_snapshots (group_id, queue_id, student_id, weight) VALUES (?, ?, ?, ?)", snapshots)
+
+def _add_student_name_index(cur: sqlite3.Cursor) -> None:
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_students_group_name ON students(group_id, name, id)")
+
+def _rebuild_table(cur: sqlite3.Cursor, table: str, create_sql: str, columns: List[str], convert: List[str]) -> None:
+    cur.execute(f"SELECT {', '.join(columns)} FROM {table}")
+    rows = cur.fetchall()
+    positions = [columns.index(c) for c in convert]
+    converted = []
+    for row in rows:
+        row = list(row)
+        for i in positions:
+            row[i] = parse_legacy_ts(row[i])
+        converted.append(row)
+    cur.execute("SELECT seq FROM sqlite_sequence WHERE name=?", (table,))
+    seq = cur.fetchone()
+    cur.execute(f"DROP TABLE {table}")
+    cur.execute(create_sql)
+    cur.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", converted)
+    if seq is not None:
+        cur.execute("DELETE FROM sqlite_sequence WHERE name=?", (table,))
+        cur.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, seq[0]))
+
+def _epoch_timestamps(cur: sqlite3.Cursor) -> None:
+    _rebuild_table(cur, "queues", f"""
+    CREATE TABLE queues (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        subject TEXT,
+        created_at INTEGER,
+        updated_at INTEGER,
+        change_log TEXT,
+        version INTEGER NOT NULL DEFAULT 0,
+        group_id INTEGER NOT NULL DEFAULT {DEFAULT_GROUP_ID}
+    )""", ["id", "subject", "created_at", "updated_at", "change_log", "version", "group_id"], ["created_at", "updated_at"])
+    _rebuild_table(cur, "weight_history", """
+    CREATE TABLE weight_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        student_id INTEGER NOT NULL,
+        weight REAL NOT NULL,
+        timestamp INTEGER NOT NULL,
+        place_info TEXT,
+        FOREIGN KEY(student_id) REFERENCES students(id)
+    )""", ["id", "student_id", "weight", "timestamp", "place_info"], ["timestamp"])
+    _rebuild_table(cur, "ops", """
+    CREATE TABLE ops (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        group_id INTEGER NOT NULL,
+        queue_id INTEGER,
+        kind TEXT NOT NULL,
+        params TEXT NOT NULL,
+        seed INTEGER,
+        created_at INTEGER NOT NULL
+    )""", ["id", "group_id", "queue_id", "kind", "params", "seed", "created_at"], ["created_at"])
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_queues_group ON queues(group_id, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_queues_group_subject_created ON queues(group_id, subject, created_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_weight_history_student ON weight_history(student_id, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_weight_history_student_ts ON weight_history(student_id, timestamp)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ops_group_queue ON ops(group_id, queue_id, id)")
+
+def _add_archive_tables(cur: sqlite3.Cursor) -> None:
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS queues_archive (
+        id INTEGER PRIMARY KEY,
+        subject TEXT,
+        created_at INTEGER,
+        updated_at INTEGER,
+        change_log TEXT,
+        version INTEGER NOT NULL DEFAULT 0,
+        group_id INTEGER NOT NULL DEFAULT {DEFAULT_GROUP_ID}
+    )""")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS queue_items_archive (
+        id INTEGER PRIMARY KEY,
+        queue_id INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        student_id INTEGER NOT NULL,
+        is_priority INTEGER NOT NULL DEFAULT 0,
+        is_late INTEGER NOT NULL DEFAULT 0,
+        weight_before REAL,
+        weight_after REAL,
+        is_added INTEGER NOT NULL DEFAULT 0,
+        slot INTEGER,
+        slot_total INTEGER
+    )""")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS weight_history_archive (
+        id INTEGER PRIMARY KEY,
+        student_id INTEGER NOT NULL,
+        weight REAL NOT NULL,
+        timestamp INTEGER NOT NULL,
+        place_info TEXT
+    )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_queues_archive_group ON queues_archive(group_id, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_queues_archive_group_subject_created ON queues_archive(group_id, subject, created_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_queue_items_archive_queue_pos ON queue_items_archive(queue_id, position)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_weight_history_archive_student ON weight_history_archive(student_id, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_weight_history_archive_student_ts ON weight_history_archive(student_id, timestamp)")
+
+_STUDENT_STATS_COUNTERS = ",\n        ".join(f"{c} INTEGER NOT NULL DEFAULT 0" for c in position_stats.COUNTERS)
+_STUDENT_STATS_TABLE = f"""
+    CREATE TABLE IF NOT EXISTS student_stats (
+        group_id INTEGER NOT NULL,
+        student_id INTEGER NOT NULL,
+        subject TEXT NOT NULL,
+        {_STUDENT_STATS_COUNTERS},
+        rel_sum REAL NOT NULL DEFAULT 0,
+        last_queue_id INTEGER,
+        streak INTEGER NOT NULL DEFAULT 0,
+        best_front INTEGER NOT NULL DEFAULT 0,
+        best_back INTEGER NOT NULL DEFAULT 0,
+        prev_streak INTEGER NOT NULL DEFAULT 0,
+        prev_best_front INTEGER NOT NULL DEFAULT 0,
+        prev_best_back INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (group_id, student_id, subject)
+    ) WITHOUT ROWID"""
+
+def _add_student_stats(cur: sqlite3.Cursor) -> None:
+    cur.execute(_STUDENT_STATS_TABLE)
+    cur.execute("DELETE FROM student_stats")
+    stats = {}
+    for items, queues in (("queue_items_archive", "queues_archive"), ("queue_items", "queues")):
+        cur.execute(f"""
+            SELECT q.group_id, q.id, q.subject, i.student_id, i.slot, i.slot_total, i.is_added
+            FROM {queues} q JOIN {items} i ON i.queue_id = q.id
+            ORDER BY q.id, i.position
+        """)
+        for gid, qid, subject, sid, slot, total, is_added in cur.fetchall():
+            for key in {subject or position_stats.ALL_SUBJECTS, position_stats.ALL_SUBJECTS}:
+                entry = stats.setdefault((gid, sid, key), position_stats.empty_stats())
+                position_stats.apply(entry, qid, (sid, slot, total, is_added))
+    columns = ("group_id", "student_id", "subject") + position_stats.FIELDS
+    cur.executemany(
+        f"INSERT INTO student_stats ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+        [(*key, *(entry[f] for f in position_stats.FIELDS)) for key, entry in stats.items()]
+    )
+
+def _freeze_legacy_queues(cur: sqlite3.Cursor) -> None:
+    for table in ("queues", "queues_archive"):
+        if "frozen" not in _column_names(cur, table):
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN frozen INTEGER NOT NULL DEFAULT 0")
+        cur.execute(f"""
+            UPDATE {table} SET frozen=1
+            WHERE id IN (SELECT queue_id FROM ops WHERE kind='generate' AND seed IS NULL)
+        """)
+
+    cur.execute("""
+        SELECT group_id, MAX(id) FROM (
+            SELECT group_id, id FROM queues WHERE frozen=1
+            UNION ALL
+            SELECT group_id, id FROM queues_archive WHERE frozen=1
+        ) GROUP BY group_id
+    """)
+    rebases = []
+    for gid, last_frozen in cur.fetchall():
+        cur.execute("""
+            SELECT student_id, weight_before FROM (
+                SELECT i.queue_id, i.position, i.student_id, i.weight_before FROM queue_items i
+                JOIN queues q ON q.id = i.queue_id WHERE q.group_id=? AND q.id > ?
+                UNION ALL
+                SELECT i.queue_id, i.position, i.student_id, i.weight_before FROM queue_items_archive i
+                JOIN queues_archive q ON q.id = i.queue_id WHERE q.group_id=? AND q.id > ?
+            ) WHERE weight_before IS NOT NULL ORDER BY queue_id, position
+        """, (gid, last_frozen, gid, last_frozen))
+        entering = {}
+        for sid, w in cur.fetchall():
+            entering.setdefault(sid, w)
+        cur.execute("SELECT id, weight FROM students WHERE group_id=?", (gid,))
+        weights = dict(cur.fetchall())
+        weights.update(entering)
+        cur.execute("SELECT created_at FROM ops WHERE group_id=? AND queue_id=? ORDER BY id DESC LIMIT 1", (gid, last_frozen))
+        created = cur.fetchone()
+        rebases.append((gid, last_frozen, json.dumps({"weights": weights}), created[0] if created else 0))
+    cur.executemany("INSERT INTO ops (group_id, queue_id, kind, params, created_at) VALUES (?, ?, 'rebase', ?, ?)", rebases)
+
+def _add_queue_settings(cur: sqlite3.Cursor) -> None:
+    for table in ("queues", "queues_archive"):
+        columns = _column_names(cur, table)
+        for column in ("k_factor", "weight_min", "weight_max"):
+            if column not in columns:
+                cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} REAL")
+        cur.execute(f"""
+            UPDATE {table} SET
+                k_factor=COALESCE((SELECT g.k_factor FROM groups g WHERE g.id={table}.group_id), ?),
+                weight_min=COALESCE((SELECT g.weight_min FROM groups g WHERE g.id={table}.group_id), ?),
+                weight_max=COALESCE((SELECT g.weight_max FROM groups g WHERE g.id={table}.group_id), ?)
+            WHERE k_factor IS NULL
+        """, (K_FACTOR, WEIGHT_MIN_LIMIT, WEIGHT_MAX_LIMIT))
+
+MIGRATIONS: List[Migration] = [
+    (1, "queue_items.is_added", _add_is_added),
+    (2, "indexes on queue_items and weight_history", _add_lookup_indexes),
+    (3, "queues.version", _add_queue_version),
+    (4, "fsm_storage", _add_fsm_storage),
+    (5, "groups and per-group indexes", _add_groups),
+    (6, "ops log, item slots and weight snapshots", _add_ops_log),
+    (7, "students(group_id, name) index for pickers", _add_student_name_index),
+    (8, "epoch timestamps and time-range indexes", _epoch_timestamps),
+    (9, "archive tables for compacted queues and history", _add_archive_tables),
+    (10, "per-student position statistics", _add_student_stats),
+    (11, "freeze weights of queues generated before the ops log", _freeze_legacy_queues),
+    (12, "scoring settings stored per queue", _add_queue_settings),
+]
+
+SCHEMA: List[str] = [
+    f"""
+    CREATE TABLE students (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        weight REAL NOT NULL DEFAULT 1.0,
+        active INTEGER NOT NULL DEFAULT 1,
+        group_id INTEGER NOT NULL DEFAULT {DEFAULT_GROUP_ID}
+    )""",
+    f"""
+    CREATE TABLE queues (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        subject TEXT,
+        created_at INTEGER,
+        updated_at INTEGER,
+        change_log TEXT,
+        version INTEGER NOT NULL DEFAULT 0,
+        group_id INTEGER NOT NULL DEFAULT {DEFAULT_GROUP_ID},
+        frozen INTEGER NOT NULL DEFAULT 0,
+        k_factor REAL,
+        weight_min REAL,
+        weight_max REAL
+    )""",
+    """
+    CREATE TABLE queue_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        queue_id INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        student_id INTEGER NOT NULL,
+        is_priority INTEGER NOT NULL DEFAULT 0,
+        is_late INTEGER NOT NULL DEFAULT 0,
+        weight_before REAL,
+        weight_after REAL,
+        is_added INTEGER NOT NULL DEFAULT 0,
+        slot INTEGER,
+        slot_total INTEGER,
+        FOREIGN KEY(queue_id) REFERENCES queues(id),
+        FOREIGN KEY(student_id) REFERENCES students(id)
+    )""",
+    """
+    CREATE TABLE weight_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        student_id INTEGER NOT NULL,
+        weight REAL NOT NULL,
+        timestamp INTEGER NOT NULL,
+        place_info TEXT,
+        FOREIGN KEY(student_id) REFERENCES students(id)
+    )""",
+    """
+    CREATE TABLE fsm_storage (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT,
+        expires_at REAL NOT NULL
+    )""",
+    """
+    CREATE TABLE groups (
+        id INTEGER PRIMARY KEY,
+        title TEXT,
+        k_factor REAL,
+        weight_min REAL,
+        weight_max REAL
+    )""",
+    """
+    CREATE TABLE group_admins (
+        group_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        PRIMARY KEY (group_id, user_id)
+    ) WITHOUT ROWID""",
+    """
+    CREATE TABLE ops (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        group_id INTEGER NOT NULL,
+        queue_id INTEGER,
+        kind TEXT NOT NULL,
+        params TEXT NOT NULL,
+        seed INTEGER,
+        created_at INTEGER NOT NULL
+    )""",
+    """
+    CREATE TABLE weight_snapshots (
+        group_id INTEGER NOT NULL,
+        queue_id INTEGER NOT NULL,
+        student_id INTEGER NOT NULL,
+        weight REAL NOT NULL,
+        PRIMARY KEY (group_id, queue_id, student_id)
+    ) WITHOUT ROWID""",
+    f"""
+    CREATE TABLE queues_archive (
+        id INTEGER PRIMARY KEY,
+        subject TEXT,
+        created_at INTEGER,
+        updated_at INTEGER,
+        change_log TEXT,
+        version INTEGER NOT NULL DEFAULT 0,
+        group_id INTEGER NOT NULL DEFAULT {DEFAULT_GROUP_ID},
+        frozen INTEGER NOT NULL DEFAULT 0,
+        k_factor REAL,
+        weight_min REAL,
+        weight_max REAL
+    )""",
+    """
+    CREATE TABLE queue_items_archive (
+        id INTEGER PRIMARY KEY,
+        queue_id INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        student_id INTEGER NOT NULL,
+        is_priority INTEGER NOT NULL DEFAULT 0,
+        is_late INTEGER NOT NULL DEFAULT 0,
+        weight_before REAL,
+        weight_after REAL,
+        is_added INTEGER NOT NULL DEFAULT 0,
+        slot INTEGER,
+        slot_total INTEGER
+    )""",
+    """
+    CREATE TABLE weight_history_archive (
+        id INTEGER PRIMARY KEY,
+        student_id INTEGER NOT NULL,
+        weight REAL NOT NULL,
+        timestamp INTEGER NOT NULL,
+        place_info TEXT
+    )""",
+    _STUDENT_STATS_TABLE,
+    "CREATE INDEX idx_students_group ON students(group_id, id)",
+    "CREATE INDEX idx_students_group_name ON students(group_id, name, id)",
+    "CREATE INDEX idx_queues_group ON queues(group_id, id)",
+    "CREATE INDEX idx_queues_group_subject_created ON queues(group_id, subject, created_at)",
+    "CREATE INDEX idx_queue_items_queue_position ON queue_items(queue_id, position)",
+    "CREATE INDEX idx_queue_items_queue_student ON queue_items(queue_id, student_id)",
+    "CREATE INDEX idx_weight_history_student ON weight_history(student_id, id)",
+    "CREATE INDEX idx_weight_history_student_ts ON weight_history(student_id, timestamp)",
+    "CREATE INDEX idx_fsm_storage_expires ON fsm_storage(expires_at)",
+    "CREATE INDEX idx_ops_group_queue ON ops(group_id, queue_id, id)",
+    "CREATE INDEX idx_queues_archive_group ON queues_archive(group_id, id)",
+    "CREATE INDEX idx_queues_archive_group_subject_created ON queues_archive(group_id, subject, created_at)",
+    "CREATE INDEX idx_queue_items_archive_queue_pos ON queue_items_archive(queue_id, position)",
+    "CREATE INDEX idx_weight_history_archive_student ON weight_history_archive(student_id, id)",
+    "CREATE INDEX idx_weight_history_archive_student_ts ON weight_history_archive(student_id, timestamp)",
+]
+
+def get_schema_version(cur: sqlite3.Cursor) -> int:
+    cur.execute("SELECT value FROM meta WHERE key='schema_version'")
+    r = cur.fetchone()
+    return int(r[0]) if r else 0
+
+def _set_schema_version(cur: sqlite3.Cursor, version: int) -> None:
+    cur.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('schema_version', ?)", (str(version),))
+
+def _create_schema(cur: sqlite3.Cursor) -> None:
+    for statement in SCHEMA:
+        cur.execute(statement)
+    _set_schema_version(cur, MIGRATIONS[-1][0])
+
+def run_migrations(conn: sqlite3.Connection) -> List[Tuple[int, str, float]]:
+    cur = conn.cursor()
+    cur.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='students'")
+    if cur.fetchone() is None:
+        _create_schema(cur)
+        logging.info(f"Created database schema (version {MIGRATIONS[-1][0]})")
+        return []
+    current = get_schema_version(cur)
+    applied = []
+    for version, name, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        started = time.perf_counter()
+        migrate(cur)
+        _set_schema_version(cur, version)
+        elapsed = time.perf_counter() - started
+        applied.append((version, name, elapsed))
+        logging.info(f"Migration {version} ({name}) applied in {elapsed * 1000:.1f} ms")
+    if not applied:
+        logging.info(f"Database schema is up to date (version {current})")
+    return applied
@@ -0,0 +1,74 @@
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+ALL_SUBJECTS = ""
+BUCKETS = 4
+
+COUNTERS = ("queues", "first_count", "last_count", "q1", "q2", "q3", "q4", "added_count")
+STREAK_FIELDS = ("last_queue_id", "streak", "best_front", "best_back", "prev_streak", "prev_best_front", "prev_best_back")
+FIELDS = COUNTERS + ("rel_sum",) + STREAK_FIELDS
+
+Placement = Tuple[int, Optional[int], Optional[int], int]
+StatsKey = Tuple[int, str]
+
+def empty_stats() -> Dict[str, Any]:
+    stats: Dict[str, Any] = {f: 0 for f in FIELDS}
+    stats["rel_sum"] = 0.0
+    stats["last_queue_id"] = None
+    return stats
+
+def relative_position(slot: int, total: int) -> float:
+    return (slot - 0.5) / total
+
+def _half(rel: float) -> int:
+    return 1 if rel < 0.5 else -1 if rel > 0.5 else 0
+
+def _advance(streak: int, half: int) -> int:
+    if half == 0:
+        return 0
+    if streak * half > 0:
+        return streak + half
+    return half
+
+def apply_placement(stats: Dict[str, Any], queue_id: int, slot: int, total: int, sign: int = 1) -> None:
+    rel = relative_position(slot, total)
+    stats["queues"] += sign
+    stats["first_count"] += sign if slot == 1 else 0
+    stats["last_count"] += sign if slot == total else 0
+    stats[f"q{min(BUCKETS, int(rel * BUCKETS) + 1)}"] += sign
+    stats["rel_sum"] += sign * rel
+
+    last = stats["last_queue_id"]
+    if sign < 0:
+        if queue_id == last:
+            stats["streak"] = stats["prev_streak"]
+            stats["best_front"] = stats["prev_best_front"]
+            stats["best_back"] = stats["prev_best_back"]
+        return
+    if last is None or queue_id > last:
+        stats["prev_streak"] = stats["streak"]
+        stats["prev_best_front"] = stats["best_front"]
+        stats["prev_best_back"] = stats["best_back"]
+        stats["last_queue_id"] = queue_id
+    elif queue_id < last:
+        return
+    streak = _advance(stats["prev_streak"], _half(rel))
+    stats["streak"] = streak
+    stats["best_front"] = max(stats["prev_best_front"], streak)
+    stats["best_back"] = max(stats["prev_best_back"], -streak)
+
+def apply(stats: Dict[str, Any], queue_id: int, placement: Placement, sign: int = 1) -> None:
+    _, slot, total, is_added = placement
+    if slot:
+        apply_placement(stats, queue_id, slot, total, sign)
+    elif is_added:
+        stats["added_count"] += sign
+
+def rebuild_streaks(stats: Dict[str, Any], placements: Iterable[Tuple[int, int, int]]) -> None:
+    fresh = empty_stats()
+    for queue_id, slot, total in placements:
+        apply_placement(fresh, queue_id, slot, total)
+    for f in STREAK_FIELDS:
+        stats[f] = fresh[f]
+
+def mean_position(stats: Dict[str, Any]) -> Optional[float]:
+    return stats["rel_sum"] / stats["queues"] if stats["queues"] else None
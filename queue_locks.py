@@ -0,0 +1,27 @@
+import asyncio
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+class QueueLockManager:
+    def __init__(self) -> None:
+        self._locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def get(self, queue_id: int) -> asyncio.Lock:
+        lock = self._locks.get(queue_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[queue_id] = lock
+        return lock
+
+    def locked(self, queue_id: int) -> bool:
+        lock = self._locks.get(queue_id)
+        return lock is not None and lock.locked()
+
+    @asynccontextmanager
+    async def hold(self, queue_id: int) -> AsyncIterator[None]:
+        lock = self.get(queue_id)
+        async with lock:
+            yield
+
+queue_locks = QueueLockManager()
@@ -1,51 +1,75 @@
 import random
 import math
-from typing import List, Tuple, Optional, Dict, Any, Set
-from config import K_FACTOR, MIN_WEIGHT_THRESHOLD, WEIGHT_MIN_LIMIT, WEIGHT_MAX_LIMIT
+from itertools import groupby
+from operator import itemgetter
+from typing import List, Tuple, Optional, Dict, Any, Callable, Iterable
+from config import K_FACTOR, MIN_WEIGHT_THRESHOLD, WEIGHT_MIN_LIMIT, WEIGHT_MAX_LIMIT, DEFAULT_GROUP_ID
+from render_cache import queue_render_cache
+from group_directory import GroupSettings, DEFAULT_SETTINGS
+import position_stats
 from database import (
-    update_weight, get_active_students, set_student_weight_direct,
-    create_queue_record, add_queue_item, get_recent_queues, get_queue,
-    set_queue_item_weights, get_following_queue_ids, get_student_current_weight,
-    get_weight_history, add_student_to_existing_queue, delete_queue_item, update_queue_timestamp_and_log,
-    get_student_name, swap_queue_positions
+    get_group_settings, get_active_students, get_group_weights, create_queue_record, add_queue_items,
+    apply_weight_updates, set_student_weights, record_weight_history, transaction,
+    get_recent_queues, get_queue, set_queue_items_weights, get_queue_items_from, get_student_current_weight,
+    add_student_to_existing_queue, update_queue_timestamp_and_log,
+    delete_queue_items, add_students_to_existing_queue,
+    get_student_name, swap_queue_positions,
+    append_op, get_reset_queue_ids, get_snapshot_queue_ids, get_frozen_queue_ids, get_rebases, get_queue_settings, write_snapshots, get_snapshot, get_queue_items_between, snapshot_due,
+    get_position_stats, save_position_stats, get_queue_placements, get_student_placements
 )
 
-def calculate_new_weight(current_weight: float, position: int, total_n: int) -> float:
-    if total_n <= 1:
-        return current_weight
+class QueueConflictError(RuntimeError):
+    pass
+
+def _check_version(q: Dict[str, Any], expected_version: Optional[int]) -> None:
+    if expected_version is not None and q["version"] != expected_version:
+        raise QueueConflictError("Очередь уже изменили, открой её заново")
+
+FROZEN_MESSAGE = "Очередь создана до журнала операций: перестановки и удаления в ней не меняют веса и запрещены"
+
+def _check_editable(q: Dict[str, Any]) -> None:
+    if q["frozen"]:
+        raise RuntimeError(FROZEN_MESSAGE)
+
+def weight_factor(position: Any, total_n: int, k_factor: float = K_FACTOR, exp: Callable[[Any], Any] = math.exp) -> Any:
     mid = (total_n + 1) / 2.0
     delta = (position - mid) / total_n
-    new_weight = current_weight * math.exp(K_FACTOR * delta)
-    new_weight = max(WEIGHT_MIN_LIMIT, min(new_weight, WEIGHT_MAX_LIMIT))
-    return new_weight
+    return exp(k_factor * delta)
+
+def clamp_weight(weight: Any, lo: float = WEIGHT_MIN_LIMIT, hi: float = WEIGHT_MAX_LIMIT, clip: Optional[Callable[[Any, float, float], Any]] = None) -> Any:
+    if clip is not None:
+        return clip(weight, lo, hi)
+    return max(lo, min(weight, hi))
 
-def weighted_permutation(students: List[Tuple[int, str, float]], priority_ids: Optional[List[int]] = None, late_ids: Optional[List[int]] = None) -> List[Tuple[int, str, float]]:
+def sampling_key(u: Any, weight: Any, log: Callable[[Any], Any] = math.log, floor: Callable[[float, Any], Any] = max) -> Any:
+    return log(u) / floor(MIN_WEIGHT_THRESHOLD, weight)
+
+def calculate_new_weight(current_weight: float, position: int, total_n: int, settings: GroupSettings = DEFAULT_SETTINGS) -> float:
+    if total_n <= 1:
+        return current_weight
+    return clamp_weight(current_weight * weight_factor(position, total_n, settings.k_factor), settings.weight_min, settings.weight_max)
+
+def weighted_permutation(students: List[Tuple[int, str, float]], priority_ids: Optional[List[int]] = None, late_ids: Optional[List[int]] = None, rng: Optional[random.Random] = None) -> List[Tuple[int, str, float]]:
     priority_ids = set(priority_ids or [])
     late_ids = set(late_ids or [])
+    draw = rng.random if rng is not None else random.random
 
     prios = [s for s in students if s[0] in priority_ids]
     lates = [s for s in students if s[0] in late_ids]
     pool = [s for s in students if s[0] not in priority_ids and s[0] not in late_ids]
 
-    random_part = []
-    available = pool.copy()
-    while available:
-        total_weight = sum(max(MIN_WEIGHT_THRESHOLD, a[2]) for a in available)
-        r = random.uniform(0, total_weight)
-        upto = 0.0
-        for s in available:
-            upto += max(MIN_WEIGHT_THRESHOLD, s[2])
-            if upto >= r:
-                random_part.append(s)
-                available.remove(s)
-                break
+    keys = [sampling_key(1.0 - draw(), s[2]) for s in pool]
+    order = sorted(range(len(pool)), key=keys.__getitem__, reverse=True)
+    random_part = [pool[i] for i in order]
 
     return prios + random_part + lates
 
-def _validate_swap(queue_id: int, pos1: int, pos2: int) -> Dict[str, Any]:
+def _validate_swap(queue_id: int, pos1: int, pos2: int, expected_version: Optional[int] = None) -> Dict[str, Any]:
     q = get_queue(queue_id)
     if not q:
         raise ValueError("Очередь не найдена")
+    _check_version(q, expected_version)
+    _check_editable(q)
     items = q["items"]
     pos_map = {itm[0]: itm for itm in items}
     if pos1 not in pos_map or pos2 not in pos_map:
@@ -59,177 +83,229 @@ def _validate_swap(queue_id: int, pos1: int, pos2: int) -> Dict[str, Any]:
 def _perform_swap(queue_id: int, pos1: int, pos2: int) -> None:
     swap_queue_positions(queue_id, pos1, pos2)
 
-def _recalculate_queue_weights(queue_id: int) -> List[Tuple[int, float]]:
-    q_after = get_queue(queue_id)
-    items_after = q_after["items"]
-    regulars = [(itm[0], itm[1], itm[4]) for itm in items_after if itm[2]==0 and itm[3]==0 and (len(itm) < 7 or itm[6]==0)]
-    total_reg = len(regulars)
-    updated_weights = []
-    rel = 1
-    for pos_full, sid, w_before in regulars:
-        new_w = calculate_new_weight(w_before, rel, total_reg)
-        set_queue_item_weights(queue_id, pos_full, w_before, new_w)
-        update_weight(sid, new_w, place_info=f"очередь {queue_id}: место {rel}/{total_reg} (смена мест)")
-        updated_weights.append((sid, new_w))
-        rel += 1
-    for itm in items_after:
-        pos_full, sid, is_p, is_l, w_before, w_after, is_added = itm
-        if is_p or is_l or is_added:
-            set_queue_item_weights(queue_id, pos_full, w_before, w_before)
-    return updated_weights
-
-def _cascade_update(queue_id: int, affected_student_ids: Set[int]) -> None:
-    following = get_following_queue_ids(queue_id)
-    for fq in following:
-        fq_data = get_queue(fq)
-        if not fq_data:
-            continue
-        fq_items = fq_data["items"]
-        regulars_ordered = []
-        for itm in fq_items:
-            pos_full, sid, is_p, is_l, w_before, w_after, is_added = itm
-            if not is_p and not is_l and not is_added:
-                regulars_ordered.append((pos_full, sid, w_before))
-        total_reg = len(regulars_ordered)
-        rel_pos_map = {}
-        rel_index = 1
-        for pos_full, sid, w_before in regulars_ordered:
-            rel_pos_map[sid] = rel_index
-            rel_index += 1
-        for sid in list(affected_student_ids):
-            if sid in rel_pos_map:
-                relp = rel_pos_map[sid]
-                cur_w = get_student_current_weight(sid)
-                new_w = calculate_new_weight(cur_w, relp, total_reg)
-                pos_in_queue = next((itm[0] for itm in fq_items if itm[1]==sid), None)
-                if pos_in_queue is not None:
-                    set_queue_item_weights(fq, pos_in_queue, cur_w, new_w)
-                    update_weight(sid, new_w, place_info=f"очередь {fq}: место {relp}/{total_reg} (каскад)")
-
-def swap_and_cascade(queue_id: int, pos1: int, pos2: int) -> bool:
-    validation_data = _validate_swap(queue_id, pos1, pos2)
-    s1 = validation_data["s1"]
-    s2 = validation_data["s2"]
-    _perform_swap(queue_id, pos1, pos2)
-    _recalculate_queue_weights(queue_id)
-    affected_student_ids = {s1[1], s2[1]}
-    _cascade_update(queue_id, affected_student_ids)
-    name1 = get_student_name(s1[1])
-    name2 = get_student_name(s2[1])
-    update_queue_timestamp_and_log(queue_id, f"Смена мест: {pos1} {name1} ↔ {pos2} {name2}")
-    return True
+def replay_weights(rows: Iterable[Tuple], weights: Dict[int, float], settings: GroupSettings = DEFAULT_SETTINGS, resets: Iterable[int] = (), snapshot_ids: Iterable[int] = (), frozen: Iterable[int] = (), rebases: Optional[Dict[int, Dict[int, float]]] = None, queue_settings: Optional[Dict[int, GroupSettings]] = None) -> Tuple[List[Tuple[Tuple, float, float]], Dict[int, Dict[int, float]]]:
+    resets = set(resets)
+    rebases = rebases or {}
+    queue_settings = queue_settings or {}
+    snapshot_ids = set(snapshot_ids)
+    frozen = set(frozen)
+    results = []
+    snapshots = {}
+    for qid, q_rows in groupby(rows, key=itemgetter(0)):
+        if qid in snapshot_ids:
+            snapshots[qid] = dict(weights)
+        q_settings = queue_settings.get(qid, settings)
+        for row in q_rows:
+            sid, slot, slot_total = row[2], row[8], row[9]
+            w_before = weights.get(sid, 1.0)
+            if qid in frozen:
+                w_before = row[5] if row[5] is not None else w_before
+                w_after = row[6] if row[6] is not None else w_before
+            else:
+                w_after = calculate_new_weight(w_before, slot, slot_total, q_settings) if slot else w_before
+            weights[sid] = w_after
+            results.append((row, w_before, w_after))
+        if qid in rebases:
+            weights.update(rebases[qid])
+        if qid in resets:
+            for sid in weights:
+                weights[sid] = 1.0
+    return results, snapshots
+
+def _entering_weights(queue_id: int, group_id: int) -> Dict[int, float]:
+    snapshot = get_snapshot(group_id, queue_id)
+    start, weights = snapshot if snapshot else (0, {})
+    replay_weights(
+        get_queue_items_between(group_id, start, queue_id), weights, get_group_settings(group_id),
+        get_reset_queue_ids(group_id, start), (), get_frozen_queue_ids(group_id, start), get_rebases(group_id, start),
+        get_queue_settings(group_id, start),
+    )
+    return weights
 
-def generate_and_save_queue(subject: str, priority_ids: Optional[List[int]] = None, late_ids: Optional[List[int]] = None) -> int:
-    students = get_active_students()
-    if not students:
-        raise RuntimeError("Нет активных студентов")
+def _replay_from(queue_id: int, group_id: int, weights: Dict[int, float], reason: str, cascade_reason: str = "каскад", forced: Iterable[int] = ()) -> List[int]:
+    results, snapshots = replay_weights(
+        get_queue_items_from(queue_id, group_id), weights, get_group_settings(group_id),
+        get_reset_queue_ids(group_id, queue_id), get_snapshot_queue_ids(group_id, queue_id + 1),
+        get_frozen_queue_ids(group_id, queue_id), get_rebases(group_id, queue_id), get_queue_settings(group_id, queue_id),
+    )
+    forced = set(forced)
+    item_updates = []
+    history = []
+    for row, w_before, w_after in results:
+        qid, pos, sid = row[:3]
+        if (w_before, w_after) != (row[5], row[6]):
+            item_updates.append((qid, pos, w_before, w_after))
+        if row[8] and (w_after != row[6] or (qid == queue_id and sid in forced)):
+            history.append((sid, w_after, f"очередь {qid}: место {row[8]}/{row[9]} ({reason if qid == queue_id else cascade_reason})"))
+    set_queue_items_weights(item_updates)
+    record_weight_history(history)
+    set_student_weights([(sid, w) for sid, w in weights.items() if w != get_student_current_weight(sid)])
+    write_snapshots(group_id, snapshots)
+    return sorted({queue_id} | {u[0] for u in item_updates})
 
+def _update_position_stats(group_id: int, queue_id: int, subject: str, removed: Iterable[position_stats.Placement] = (), added: Iterable[position_stats.Placement] = ()) -> None:
+    removed, added = list(removed), list(added)
+    subjects = {subject or position_stats.ALL_SUBJECTS, position_stats.ALL_SUBJECTS}
+    stats = get_position_stats(group_id, [(p[0], subj) for p in removed + added for subj in subjects])
+    for sign, placements in ((-1, removed), (1, added)):
+        for p in placements:
+            for subj in subjects:
+                position_stats.apply(stats[(p[0], subj)], queue_id, p, sign)
+    stale = [key for key, entry in stats.items() if entry["last_queue_id"] is not None and entry["last_queue_id"] > queue_id]
+    if stale:
+        placements: Dict[position_stats.StatsKey, List[Tuple[int, int, int]]] = {key: [] for key in stale}
+        for sid, qid, subj, slot, total in get_student_placements(group_id, {key[0] for key in stale}):
+            for key in {(sid, subj or position_stats.ALL_SUBJECTS), (sid, position_stats.ALL_SUBJECTS)}:
+                if key in placements:
+                    placements[key].append((qid, slot, total))
+        for key, ordered in placements.items():
+            position_stats.rebuild_streaks(stats[key], ordered)
+    save_position_stats(group_id, stats)
+
+def swap_and_cascade(queue_id: int, pos1: int, pos2: int, expected_version: Optional[int] = None) -> bool:
+    with transaction():
+        validation_data = _validate_swap(queue_id, pos1, pos2, expected_version)
+        s1 = validation_data["s1"]
+        s2 = validation_data["s2"]
+        group_id = validation_data["queue"]["group_id"]
+        weights = _entering_weights(queue_id, group_id)
+        placements = get_queue_placements(queue_id, [pos1, pos2])
+        _perform_swap(queue_id, pos1, pos2)
+        p1, p2 = placements[pos1], placements[pos2]
+        _update_position_stats(group_id, queue_id, validation_data["queue"]["meta"][1], [p1, p2],
+                               [(p2[0], *p1[1:]), (p1[0], *p2[1:])])
+        touched = _replay_from(queue_id, group_id, weights, "смена мест", forced={s1[1], s2[1]})
+        append_op(group_id, queue_id, "swap", {"pos1": pos1, "pos2": pos2, "students": [s1[1], s2[1]]})
+        name1 = get_student_name(s1[1])
+        name2 = get_student_name(s2[1])
+        update_queue_timestamp_and_log(queue_id, f"Смена мест: {pos1} {name1} ↔ {pos2} {name2}")
+    queue_render_cache.invalidate(touched)
+    return True
+
+def generate_and_save_queue(subject: str, priority_ids: Optional[List[int]] = None, late_ids: Optional[List[int]] = None, seed: Optional[int] = None, group_id: int = DEFAULT_GROUP_ID) -> int:
     priority_ids = priority_ids or []
     late_ids = late_ids or []
-    raw_queue = weighted_permutation(students, priority_ids=priority_ids, late_ids=late_ids)
-    qid = create_queue_record(subject)
-
-    position = 1
-    for s in raw_queue:
-        sid, name, w = s
-        is_p = 1 if sid in priority_ids else 0
-        is_l = 1 if sid in late_ids else 0
-        add_queue_item(qid, position, sid, is_p, is_l, w, None)
-        position += 1
-
-    q = get_queue(qid)
-    items = q["items"]
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    with transaction():
+        students = get_active_students(group_id)
+        if not students:
+            raise RuntimeError("Нет активных студентов")
+
+        settings = get_group_settings(group_id)
+        raw_queue = weighted_permutation(students, priority_ids=priority_ids, late_ids=late_ids, rng=random.Random(seed))
+        snapshot = get_group_weights(group_id) if snapshot_due(group_id) else None
+        qid = create_queue_record(subject, group_id, settings)
 
-    regulars_ordered = []
-    for itm in items:
-        pos_full, student_id, is_p, is_l, weight_before, _, is_added = itm
-        if not is_p and not is_l:
-            regulars_ordered.append((pos_full, student_id, weight_before))
-
-    total_reg = len(regulars_ordered)
-    rel_pos = 1
-    for pos_full, sid, w_before in regulars_ordered:
-        new_w = calculate_new_weight(w_before, rel_pos, total_reg)
-        set_queue_item_weights(qid, pos_full, w_before, new_w)
-        update_weight(sid, new_w, place_info=f"очередь {qid}: место {rel_pos}/{total_reg} (генерация)")
-        rel_pos += 1
-
-    for itm in items:
-        pos_full, sid, is_p, is_l, w_before, w_after, is_added = itm
-        if is_p or is_l or is_added:
-            set_queue_item_weights(qid, pos_full, w_before, w_before)
+        prio_set = set(priority_ids)
+        late_set = set(late_ids)
+        total_reg = sum(1 for s in raw_queue if s[0] not in prio_set and s[0] not in late_set)
+        items = []
+        weight_updates = []
+        rel_pos = 1
+        for position, (sid, name, w) in enumerate(raw_queue, start=1):
+            is_p = 1 if sid in prio_set else 0
+            is_l = 1 if sid in late_set else 0
+            if is_p or is_l:
+                items.append((position, sid, is_p, is_l, w, w, None, None))
+                continue
+            new_w = calculate_new_weight(w, rel_pos, total_reg, settings)
+            items.append((position, sid, 0, 0, w, new_w, rel_pos, total_reg))
+            weight_updates.append((sid, new_w, f"очередь {qid}: место {rel_pos}/{total_reg} (генерация)"))
+            rel_pos += 1
 
+        add_queue_items(qid, items)
+        _update_position_stats(group_id, qid, subject, added=[(itm[1], itm[6], itm[7], 0) for itm in items if itm[6]])
+        apply_weight_updates(weight_updates)
+        order = [s[0] for s in raw_queue]
+        append_op(group_id, qid, "generate", {
+            "subject": subject,
+            "order": order,
+            "priority": [sid for sid in order if sid in prio_set],
+            "late": [sid for sid in order if sid in late_set],
+        }, seed)
+        if snapshot is not None:
+            write_snapshots(group_id, {qid: snapshot})
     return qid
 
-def delete_student_from_queue_and_apply_penalty(queue_id: int, position: int, defer_log: bool = False) -> int:
-    import database as db
-    q = db.get_queue(queue_id)
-    if not q:
-        raise ValueError("Очередь не найдена")
-    row = next((it for it in q["items"] if it[0]==position), None)
-    if not row:
+def _remove_from_queue(queue_id: int, q: Dict[str, Any], positions: List[int]) -> Tuple[List[int], List[int]]:
+    _check_editable(q)
+    by_pos = {it[0]: it for it in q["items"]}
+    positions = sorted(set(positions))
+    if not positions or any(p not in by_pos for p in positions):
         raise ValueError("Позиция не найдена")
-    
-    pos_full, sid, is_p, is_l, weight_before, weight_after, is_added = row
-    
-    db.set_student_weight_direct(sid, weight_before)
-    db.update_weight(sid, weight_before, place_info=f"удалён из очереди {queue_id} (откат к весу до генерации)")
-    
-    db.delete_queue_item(queue_id, position)
-    if not defer_log:
-        update_queue_timestamp_and_log(queue_id, f"Удалён студент {db.get_student_name(sid)} с места {position}")
-    
-    following = get_following_queue_ids(queue_id)
-    affected_student_ids = {sid}
-    
-    for fq in following:
-        fq_data = db.get_queue(fq)
-        if not fq_data:
-            continue
-        fq_items = fq_data["items"]
-        
-        student_in_fq = next((it for it in fq_items if it[1] == sid), None)
-        if not student_in_fq:
-            continue
-        
-        regulars_ordered = []
-        for itm in fq_items:
-            pos_full, s_id, is_p, is_l, w_before, w_after, is_added = itm
-            if not is_p and not is_l and not is_added:
-                regulars_ordered.append((pos_full, s_id, w_before))
-        
-        total_reg = len(regulars_ordered)
-        
-        rel_pos_map = {}
-        rel_index = 1
-        for pos_full, s_id, w_before in regulars_ordered:
-            rel_pos_map[s_id] = rel_index
-            rel_index += 1
-        
-        if sid in rel_pos_map:
-            relp = rel_pos_map[sid]
-            cur_w = db.get_student_current_weight(sid)
-            new_w = calculate_new_weight(cur_w, relp, total_reg)
-            pos_in_queue = next((itm[0] for itm in fq_items if itm[1]==sid), None)
-            if pos_in_queue is not None:
-                set_queue_item_weights(fq, pos_in_queue, cur_w, new_w)
-                db.update_weight(sid, new_w, place_info=f"очередь {fq}: место {relp}/{total_reg} (каскад после удаления)")
-    
+    group_id = q["group_id"]
+    sids = [by_pos[p][1] for p in positions]
+    weights = _entering_weights(queue_id, group_id)
+    placements = get_queue_placements(queue_id, positions)
+    delete_queue_items(queue_id, positions)
+    _update_position_stats(group_id, queue_id, q["meta"][1], removed=placements.values())
+    record_weight_history([(sid, weights.get(sid, 1.0), f"удалён из очереди {queue_id} (откат к весу до генерации)") for sid in sids])
+    touched = _replay_from(queue_id, group_id, weights, "удаление", "каскад после удаления")
+    append_op(group_id, queue_id, "delete", {"positions": positions, "students": sids})
+    return sids, touched
+
+def delete_student_from_queue_and_apply_penalty(queue_id: int, position: int, defer_log: bool = False, expected_version: Optional[int] = None) -> int:
+    with transaction():
+        q = get_queue(queue_id)
+        if not q:
+            raise ValueError("Очередь не найдена")
+        _check_version(q, expected_version)
+        (sid,), touched = _remove_from_queue(queue_id, q, [position])
+        if not defer_log:
+            update_queue_timestamp_and_log(queue_id, f"Удалён студент {get_student_name(sid)} с места {position}")
+    queue_render_cache.invalidate(touched)
     return sid
 
-def add_new_student_to_queue_and_penalize(queue_id: int, student_id: int, is_priority: int = 0, is_late: int = 0) -> int:
-    import database as db
-    q = db.get_queue(queue_id)
-    if not q:
-        raise ValueError("Очередь не найдена")
-    if any(it[1]==student_id for it in q["items"]):
-        raise ValueError("Студент уже в очереди")
-    cur_w = db.get_student_current_weight(student_id)
-    pos, w_before = db.add_student_to_existing_queue(queue_id, student_id, is_priority, is_late)
-    set_queue_item_weights(queue_id, pos, w_before, cur_w)
-    update_queue_timestamp_and_log(queue_id, f"Добавлен студент {db.get_student_name(student_id)} в конец очереди")
+def remove_students(queue_id: int, positions: List[int], expected_version: Optional[int] = None) -> List[int]:
+    with transaction():
+        q = get_queue(queue_id)
+        if not q:
+            raise ValueError("Очередь не найдена")
+        _check_version(q, expected_version)
+        sids, touched = _remove_from_queue(queue_id, q, positions)
+        names = ", ".join(get_student_name(sid) for sid in sids)
+        update_queue_timestamp_and_log(queue_id, f"Удалён студент {names}" if len(sids) == 1 else f"Удалены студенты: {names}")
+    queue_render_cache.invalidate(touched)
+    return sids
+
+def add_students(queue_id: int, student_ids: List[int], expected_version: Optional[int] = None) -> List[int]:
+    with transaction():
+        q = get_queue(queue_id)
+        if not q:
+            raise ValueError("Очередь не найдена")
+        _check_version(q, expected_version)
+        present = {it[1] for it in q["items"]}
+        student_ids = list(dict.fromkeys(student_ids))
+        if not student_ids:
+            raise ValueError("Ничего не выбрано")
+        if any(sid in present for sid in student_ids):
+            raise ValueError("Студент уже в очереди")
+        weights = _entering_weights(queue_id, q["group_id"])
+        added = add_students_to_existing_queue(queue_id, student_ids)
+        _update_position_stats(q["group_id"], queue_id, q["meta"][1], added=[(sid, None, None, 1) for sid in student_ids])
+        touched = _replay_from(queue_id, q["group_id"], weights, "добавление")
+        names = ", ".join(get_student_name(sid) for sid in student_ids)
+        update_queue_timestamp_and_log(queue_id, f"Добавлен студент {names}" if len(student_ids) == 1 else f"Добавлены студенты: {names}")
+    queue_render_cache.invalidate(touched)
+    return [pos for pos, _ in added]
+
+def add_new_student_to_queue_and_penalize(queue_id: int, student_id: int, is_priority: int = 0, is_late: int = 0, expected_version: Optional[int] = None) -> int:
+    with transaction():
+        q = get_queue(queue_id)
+        if not q:
+            raise ValueError("Очередь не найдена")
+        _check_version(q, expected_version)
+        if any(it[1]==student_id for it in q["items"]):
+            raise ValueError("Студент уже в очереди")
+        weights = _entering_weights(queue_id, q["group_id"])
+        pos, _ = add_student_to_existing_queue(queue_id, student_id, is_priority, is_late)
+        _update_position_stats(q["group_id"], queue_id, q["meta"][1], added=[(student_id, None, None, 1)])
+        touched = _replay_from(queue_id, q["group_id"], weights, "добавление")
+        update_queue_timestamp_and_log(queue_id, f"Добавлен студент {get_student_name(student_id)} в конец очереди")
+    queue_render_cache.invalidate(touched)
     return pos
 
-def get_latest_queue() -> Optional[Tuple[int, str, str, str, str]]:
-    recent = get_recent_queues(1)
+def get_latest_queue(group_id: int = DEFAULT_GROUP_ID) -> Optional[Tuple[int, str, str, str, str]]:
+    recent = get_recent_queues(1, group_id)
     return recent[0] if recent else None
\ No newline at end of file
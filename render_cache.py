@@ -0,0 +1,44 @@
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+
+from config import RENDER_CACHE_SIZE
+
+class RenderCache:
+    def __init__(self, maxsize: int = RENDER_CACHE_SIZE) -> None:
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[int, Tuple[int, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, queue_id: int, version: int) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(queue_id)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(queue_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, queue_id: int, version: int, text: str) -> None:
+        with self._lock:
+            current = self._entries.get(queue_id)
+            if current is not None and current[0] > version:
+                return
+            self._entries[queue_id] = (version, text)
+            self._entries.move_to_end(queue_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, queue_ids: Iterable[int]) -> None:
+        with self._lock:
+            for queue_id in queue_ids:
+                self._entries.pop(queue_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+queue_render_cache = RenderCache()
@@ -0,0 +1,125 @@
+import argparse
+import json
+import sys
+from typing import Any, Dict, List, Tuple
+
+from config import DEFAULT_GROUP_ID
+from database import (
+    init_db, transaction, get_ops, get_snapshot, get_queue_items_from, get_group_settings,
+    get_group_weights, set_queue_items_weights, set_student_weights, get_frozen_items, get_compactable_groups, get_queue_settings,
+)
+from queue_logic import replay_weights
+from render_cache import queue_render_cache
+
+Row = List[Any]
+
+def _generated_rows(params: Dict[str, Any]) -> List[Row]:
+    marked = set(params.get("priority", ())) | set(params.get("late", ()))
+    prio = set(params.get("priority", ()))
+    total = sum(1 for sid in params["order"] if sid not in marked)
+    rows, rel = [], 1
+    for sid in params["order"]:
+        if sid in marked:
+            rows.append([sid, 1 if sid in prio else 0, 0 if sid in prio else 1, 0, None, None])
+            continue
+        rows.append([sid, 0, 0, 0, rel, total])
+        rel += 1
+    return rows
+
+def rebuild_queues(ops: List[Tuple[int, int, str, Dict[str, Any], Any]]) -> Tuple[Dict[int, List[Row]], List[int], Dict[int, Dict[int, float]]]:
+    queues: Dict[int, List[Row]] = {}
+    resets = []
+    rebases = {}
+    for _, qid, kind, params, _ in ops:
+        if kind == "reset":
+            resets.append(qid)
+            continue
+        if kind == "rebase":
+            rebases[qid] = {int(sid): w for sid, w in params["weights"].items()}
+            continue
+        if kind == "generate":
+            queues[qid] = _generated_rows(params)
+            continue
+        rows = queues.get(qid)
+        if rows is None:
+            continue
+        if kind == "swap":
+            a, b = rows[params["pos1"] - 1], rows[params["pos2"] - 1]
+            a[0], b[0] = b[0], a[0]
+        elif kind == "delete":
+            for pos in sorted(params["positions"], reverse=True):
+                del rows[pos - 1]
+        elif kind == "add":
+            is_p, is_l = params.get("priority", 0), params.get("late", 0)
+            rows.extend([sid, is_p, is_l, 1, None, None] for sid in params["students"])
+    return queues, resets, rebases
+
+def rebuild_group(group_id: int = DEFAULT_GROUP_ID, write: bool = False) -> Dict[str, Any]:
+    stored = get_queue_items_from(0, group_id)
+    if not stored:
+        return {"group_id": group_id, "queues": 0, "item_mismatches": [], "weight_mismatches": []}
+    first = stored[0][0]
+    snapshot = get_snapshot(group_id, first)
+    if snapshot is None:
+        raise RuntimeError(f"Нет снимка весов для группы {group_id}")
+    start, weights = snapshot
+
+    frozen_rows = get_frozen_items(group_id, start)
+    frozen = {r[0] for r in frozen_rows}
+    ops = [op for op in get_ops(group_id, start) if op[1] not in frozen or op[2] in ("reset", "rebase")]
+    queues, resets, rebases = rebuild_queues(ops)
+    rows = sorted(frozen_rows + [
+        (qid, pos, sid, is_p, is_l, None, None, is_added, slot, total)
+        for qid in queues
+        for pos, (sid, is_p, is_l, is_added, slot, total) in enumerate(queues[qid], start=1)
+    ], key=lambda r: (r[0], r[1]))
+    results, _ = replay_weights(rows, weights, get_group_settings(group_id), resets, frozen=frozen, rebases=rebases,
+                                queue_settings=get_queue_settings(group_id, start))
+
+    expected = {(r[0], r[1]): (r[2], wb, wa) for r, wb, wa in results if r[0] >= first}
+    item_mismatches, item_fixes = [], []
+    for r in stored:
+        want = expected.get((r[0], r[1]))
+        if want is None or want[0] != r[2]:
+            item_mismatches.append({"queue_id": r[0], "position": r[1], "student_id": r[2], "expected_student_id": want and want[0]})
+        elif abs(want[1] - r[5]) > 1e-9 or abs(want[2] - r[6]) > 1e-9:
+            item_mismatches.append({"queue_id": r[0], "position": r[1], "student_id": r[2],
+                                    "stored": [r[5], r[6]], "replayed": [want[1], want[2]]})
+            item_fixes.append((r[0], r[1], want[1], want[2]))
+
+    current = get_group_weights(group_id)
+    weight_fixes = [(sid, w) for sid, w in weights.items() if sid in current and abs(current[sid] - w) > 1e-9]
+    weight_mismatches = [{"student_id": sid, "stored": current[sid], "replayed": w} for sid, w in weight_fixes]
+
+    if write and (item_fixes or weight_fixes):
+        with transaction():
+            set_queue_items_weights(item_fixes)
+            set_student_weights(weight_fixes)
+        queue_render_cache.invalidate({f[0] for f in item_fixes})
+
+    return {
+        "group_id": group_id,
+        "snapshot_queue_id": start,
+        "queues": len({r[0] for r in stored}),
+        "item_mismatches": item_mismatches,
+        "weight_mismatches": weight_mismatches,
+        "written": bool(write and (item_fixes or weight_fixes)),
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Пересчёт весов группы по журналу операций")
+    parser.add_argument("--group", type=int, default=DEFAULT_GROUP_ID)
+    parser.add_argument("--write", action="store_true", help="записать пересчитанные веса в базу")
+    parser.add_argument("--check", action="store_true", help="проверить все группы и завершиться с ошибкой при расхождениях")
+    args = parser.parse_args()
+    init_db()
+    if args.check:
+        reports = [rebuild_group(gid) for gid in get_compactable_groups()]
+        bad = [r for r in reports if r["item_mismatches"] or r["weight_mismatches"]]
+        for r in bad:
+            print(f"Группа {r['group_id']}: {len(r['item_mismatches'])} расхождений в очередях, {len(r['weight_mismatches'])} в весах")
+        sys.exit(1 if bad else 0)
+    print(json.dumps(rebuild_group(args.group, write=args.write), ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
-import sqlite3
-from database import init_db, DB_NAME
+from database import init_db, transaction, student_directory
+from config import DEFAULT_GROUP_ID
 
 def main():
      
@@ -16,15 +16,14 @@ def main():
         "Черсков Никита", "Эрендженов Арслан", "Юлдашев Всеволод", "Яблоков Александр",
         "Ященко Максим",
     ]
-    with sqlite3.connect(DB_NAME) as conn:
+    with transaction() as conn:
         cursor = conn.cursor()
-        cursor.execute("DELETE FROM students") 
-        for name in students:
-            cursor.execute(
-                "INSERT INTO students (name, weight, active) VALUES (?, 1.0, 1)",
-                (name,)
-            )
-        conn.commit()
+        cursor.execute("DELETE FROM students WHERE group_id=?", (DEFAULT_GROUP_ID,))
+        cursor.executemany(
+            "INSERT INTO students (name, weight, active, group_id) VALUES (?, 1.0, 1, ?)",
+            [(name, DEFAULT_GROUP_ID) for name in students]
+        )
+    student_directory.reload()
     print("База данных успешно обновлена и заполнена.")
 
 if __name__ == "__main__":
@@ -0,0 +1,111 @@
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+MODEL_KEY = "keyboard"
+ROW_WIDTH = 2
+ALPHABET_ROW_WIDTH = 8
+
+Button = Tuple[int, str, str]
+Confirm = Tuple[str, str, str, Optional[int]]
+FooterButton = Union[Tuple[str, str], Dict[str, str]]
+
+def _footer_button(button: FooterButton) -> Dict[str, str]:
+    if isinstance(button, dict):
+        return dict(button)
+    text, callback_data = button
+    return {"text": text, "callback_data": callback_data}
+
+def page_rows(
+    prefix: str,
+    first: Optional[int],
+    last: Optional[int],
+    has_prev: bool,
+    has_next: bool,
+    initials: Sequence[str] = (),
+    search: bool = True,
+) -> List[List[FooterButton]]:
+    rows: List[List[FooterButton]] = []
+    nav: List[FooterButton] = []
+    if has_prev and first is not None:
+        nav.append(("◀️", f"{prefix}prev_{first}"))
+    if has_next and last is not None:
+        nav.append(("▶️", f"{prefix}next_{last}"))
+    if nav:
+        rows.append(nav)
+    if has_prev or has_next:
+        for i in range(0, len(initials), ALPHABET_ROW_WIDTH):
+            rows.append([(letter, f"{prefix}jump_{letter}") for letter in initials[i:i + ALPHABET_ROW_WIDTH]])
+    if search:
+        rows.append([{"text": "🔍 Поиск", "switch_inline_query_current_chat": ""}])
+    return rows
+
+def parse_page(callback_data: str, prefix: str) -> Optional[List[str]]:
+    kind, _, value = callback_data[len(prefix):].partition("_")
+    if kind not in ("prev", "next", "jump") or not value:
+        return None
+    if kind != "jump" and not value.isdigit():
+        return None
+    return [kind, value]
+
+def build_model(
+    buttons: Iterable[Button],
+    footer: Sequence[Sequence[FooterButton]] = (),
+    confirm: Optional[Confirm] = None,
+    locked: Iterable[int] = (),
+) -> Dict[str, Any]:
+    keys: List[int] = []
+    labels: List[str] = []
+    callbacks: List[str] = []
+    for key, label, callback_data in buttons:
+        keys.append(key)
+        labels.append(label)
+        callbacks.append(callback_data)
+    return {
+        "keys": keys,
+        "labels": labels,
+        "callbacks": callbacks,
+        "locked": list(locked),
+        "confirm": list(confirm) if confirm else None,
+        "footer": [[_footer_button(b) for b in row] for row in footer],
+    }
+
+def render(model: Dict[str, Any], selected: Iterable[int]) -> InlineKeyboardMarkup:
+    selected = set(selected)
+    rows = []
+    row = []
+    for key, label, callback_data in zip(model["keys"], model["labels"], model["callbacks"]):
+        row.append(InlineKeyboardButton(text=f"✅ {label}" if key in selected else label, callback_data=callback_data))
+        if len(row) == ROW_WIDTH:
+            rows.append(row)
+            row = []
+    if row:
+        rows.append(row)
+    if model["confirm"]:
+        callback_data, ready, pending, needed = model["confirm"]
+        text = ready if needed is None or len(selected) == needed else pending
+        rows.append([InlineKeyboardButton(text=text, callback_data=callback_data)])
+    for footer_row in model["footer"]:
+        rows.append([InlineKeyboardButton(**b) for b in footer_row])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+def toggle(data: Dict[str, Any], key: int, limit: Optional[int] = None) -> str:
+    model = data.get(MODEL_KEY)
+    if model is None or key not in model["keys"]:
+        return "missing"
+    if key in model["locked"]:
+        return "locked"
+    selected = data["selected"]
+    if key in selected:
+        selected.remove(key)
+        return "removed"
+    if limit is not None and len(selected) >= limit:
+        return "full"
+    selected.append(key)
+    return "added"
+
+def clear(data: Dict[str, Any]) -> bool:
+    if not data.get("selected"):
+        return False
+    data["selected"] = []
+    return True
@@ -0,0 +1,106 @@
+import argparse
+import json
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+
+from config import K_FACTOR, WEIGHT_MIN_LIMIT, WEIGHT_MAX_LIMIT
+from queue_logic import weight_factor, clamp_weight, sampling_key
+
+def simulate(
+    n_students: int,
+    n_queues: int,
+    trials: int,
+    k_factor: float = K_FACTOR,
+    weight_min: float = WEIGHT_MIN_LIMIT,
+    weight_max: float = WEIGHT_MAX_LIMIT,
+    initial_weights: Optional[Sequence[float]] = None,
+    seed: Optional[int] = None,
+    tolerance: float = 0.05,
+) -> Dict[str, Any]:
+    if n_students < 2:
+        raise ValueError("Нужно минимум два студента")
+    rng = np.random.default_rng(seed)
+    if initial_weights is None:
+        weights = np.ones((trials, n_students))
+    else:
+        weights = np.tile(np.asarray(initial_weights, dtype=float), (trials, 1))
+    ranks = np.arange(n_students)
+    factors = weight_factor(ranks + 1, n_students, k_factor, exp=np.exp)
+    student_offsets = ranks * n_students
+
+    position_counts = np.zeros(n_students * n_students, dtype=np.int64)
+    position_sums = np.zeros((trials, n_students))
+    spread = np.empty(n_queues)
+    drift = np.empty(n_queues)
+
+    for m in range(n_queues):
+        u = 1.0 - rng.random((trials, n_students))
+        keys = sampling_key(u, weights, log=np.log, floor=np.maximum)
+        order = np.argsort(-keys, axis=1)
+        positions = np.empty_like(order)
+        np.put_along_axis(positions, order, ranks[np.newaxis, :], axis=1)
+
+        new_weights = clamp_weight(weights * factors[positions], weight_min, weight_max, clip=np.clip)
+        log_new = np.log(new_weights)
+        drift[m] = np.abs(log_new - np.log(weights)).mean()
+        spread[m] = log_new.std(axis=1).mean()
+        weights = new_weights
+
+        position_counts += np.bincount((student_offsets + positions).ravel(), minlength=n_students * n_students)
+        position_sums += positions
+
+    plateau = float(spread[-max(1, n_queues // 10):].mean())
+    outside = np.flatnonzero(np.abs(spread - plateau) > tolerance * max(plateau, 1e-12))
+    equilibrium = int(outside[-1]) + 2 if outside.size else 1
+    if equilibrium > n_queues:
+        equilibrium = None
+
+    distribution = position_counts.reshape(n_students, n_students) / float(trials * n_queues)
+    mean_positions = position_sums / n_queues + 1
+    final = weights.ravel()
+    return {
+        "params": {
+            "n_students": n_students, "n_queues": n_queues, "trials": trials,
+            "k_factor": k_factor, "weight_min": weight_min, "weight_max": weight_max, "seed": seed,
+        },
+        "position_distribution": distribution.tolist(),
+        "first_rate": distribution[:, 0].tolist(),
+        "last_rate": distribution[:, -1].tolist(),
+        "mean_position_std": float(mean_positions.std(axis=1).mean()),
+        "weight_spread": spread.tolist(),
+        "weight_drift": drift.tolist(),
+        "final_weights": {
+            "mean": float(final.mean()),
+            "p5": float(np.percentile(final, 5)),
+            "p50": float(np.percentile(final, 50)),
+            "p95": float(np.percentile(final, 95)),
+            "at_min": float((final <= weight_min).mean()),
+            "at_max": float((final >= weight_max).mean()),
+        },
+        "equilibrium_queue": equilibrium,
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Monte-Carlo симуляция системы весов")
+    parser.add_argument("--students", type=int, default=33)
+    parser.add_argument("--queues", type=int, default=50)
+    parser.add_argument("--trials", type=int, default=2000)
+    parser.add_argument("--k", type=float, default=K_FACTOR)
+    parser.add_argument("--min", type=float, default=WEIGHT_MIN_LIMIT)
+    parser.add_argument("--max", type=float, default=WEIGHT_MAX_LIMIT)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--tolerance", type=float, default=0.05)
+    parser.add_argument("--full", action="store_true", help="вывести матрицу позиций и траектории целиком")
+    args = parser.parse_args()
+    report = simulate(
+        args.students, args.queues, args.trials, k_factor=args.k,
+        weight_min=args.min, weight_max=args.max, seed=args.seed, tolerance=args.tolerance,
+    )
+    if not args.full:
+        for key in ("position_distribution", "first_rate", "last_rate", "weight_drift"):
+            report.pop(key)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import heapq
+import itertools
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+import async_db
+from config import FSM_STORAGE, SELECTION_TIMEOUT_SECONDS, FSM_PURGE_INTERVAL_SECONDS
+
+def _state_name(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+@dataclass
+class _Record:
+    state: Optional[str] = None
+    data: Dict[str, Any] = field(default_factory=dict)
+    expires_at: float = 0.0
+
+class MemoryTTLStorage(BaseStorage):
+    def __init__(self, ttl: float = SELECTION_TIMEOUT_SECONDS) -> None:
+        self.ttl = ttl
+        self._records: Dict[StorageKey, _Record] = {}
+        self._expiry: List[Tuple[float, int, StorageKey]] = []
+        self._seq = itertools.count()
+
+    def _purge(self, now: float) -> None:
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, _, key = heapq.heappop(self._expiry)
+            record = self._records.get(key)
+            if record is not None and record.expires_at <= now:
+                del self._records[key]
+
+    def _touch(self, key: StorageKey) -> _Record:
+        now = time.time()
+        self._purge(now)
+        record = self._records.get(key)
+        if record is None:
+            record = self._records[key] = _Record()
+        record.expires_at = now + self.ttl
+        heapq.heappush(self._expiry, (record.expires_at, next(self._seq), key))
+        return record
+
+    def _get(self, key: StorageKey) -> Optional[_Record]:
+        self._purge(time.time())
+        return self._records.get(key)
+
+    def _drop_if_empty(self, key: StorageKey, record: _Record) -> None:
+        if record.state is None and not record.data:
+            self._records.pop(key, None)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = self._touch(key)
+        record.state = _state_name(state)
+        self._drop_if_empty(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self._get(key)
+        return record.state if record else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        record = self._touch(key)
+        record.data = dict(data)
+        self._drop_if_empty(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self._get(key)
+        return dict(record.data) if record else {}
+
+    async def close(self) -> None:
+        self._records.clear()
+        self._expiry.clear()
+
+class SQLiteStorage(BaseStorage):
+    def __init__(self, ttl: float = SELECTION_TIMEOUT_SECONDS, purge_interval: float = FSM_PURGE_INTERVAL_SECONDS) -> None:
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._next_purge = 0.0
+
+    async def _maybe_purge(self, now: float) -> None:
+        if now >= self._next_purge:
+            self._next_purge = now + self.purge_interval
+            await async_db.fsm_purge(now)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        now = time.time()
+        await self._maybe_purge(now)
+        await async_db.fsm_set_state(self._key_builder.build(key), _state_name(state), now + self.ttl)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = await async_db.fsm_get(self._key_builder.build(key), time.time())
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        now = time.time()
+        await self._maybe_purge(now)
+        payload = json.dumps(dict(data), ensure_ascii=False) if data else None
+        await async_db.fsm_set_data(self._key_builder.build(key), payload, now + self.ttl)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        row = await async_db.fsm_get(self._key_builder.build(key), time.time())
+        return json.loads(row[1]) if row and row[1] else {}
+
+    async def close(self) -> None:
+        pass
+
+def create_storage() -> BaseStorage:
+    if FSM_STORAGE == "sqlite":
+        return SQLiteStorage()
+    return MemoryTTLStorage()
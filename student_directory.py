@@ -0,0 +1,122 @@
+import threading
+from array import array
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+class StudentDirectory:
+    def __init__(self, loader: Callable[[], Iterable[Tuple[int, str, float, int, int]]]) -> None:
+        self._loader = loader
+        self._lock = threading.RLock()
+        self._index: Optional[Dict[int, int]] = None
+        self._members: Dict[int, array] = {}
+        self._ids = array("q")
+        self._groups = array("q")
+        self._names: List[str] = []
+        self._weights = array("d")
+        self._active = array("b")
+
+    def reload(self) -> None:
+        rows = list(self._loader())
+        with self._lock:
+            self._ids = array("q", (r[0] for r in rows))
+            self._names = [r[1] for r in rows]
+            self._weights = array("d", (r[2] for r in rows))
+            self._active = array("b", (1 if r[3] else 0 for r in rows))
+            self._groups = array("q", (r[4] for r in rows))
+            self._members = {}
+            for i, gid in enumerate(self._groups):
+                self._members.setdefault(gid, array("q")).append(i)
+            self._index = {sid: i for i, sid in enumerate(self._ids)}
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._index = None
+
+    def _slot(self, student_id: int) -> Optional[int]:
+        index = self._index
+        if index is None:
+            self.reload()
+            index = self._index
+        return index.get(student_id)
+
+    def __contains__(self, student_id: int) -> bool:
+        return self._slot(student_id) is not None
+
+    def name(self, student_id: int) -> str:
+        i = self._slot(student_id)
+        return self._names[i] if i is not None else str(student_id)
+
+    def weight(self, student_id: int) -> Optional[float]:
+        i = self._slot(student_id)
+        return self._weights[i] if i is not None else None
+
+    def is_active(self, student_id: int) -> bool:
+        i = self._slot(student_id)
+        return i is not None and bool(self._active[i])
+
+    def group(self, student_id: int) -> Optional[int]:
+        i = self._slot(student_id)
+        return self._groups[i] if i is not None else None
+
+    def in_group(self, student_id: int, group_id: int) -> bool:
+        return self.group(student_id) == group_id
+
+    def rows(self, group_id: int) -> List[Tuple[int, str, float, int]]:
+        with self._lock:
+            if self._index is None:
+                self.reload()
+            return [(self._ids[i], self._names[i], self._weights[i], self._active[i]) for i in self._members.get(group_id, ())]
+
+    def search(self, group_ids: Iterable[int], text: str, offset: int = 0, limit: int = 20) -> List[Tuple[int, str, float, int, int]]:
+        needle = text.casefold()
+        found = []
+        with self._lock:
+            if self._index is None:
+                self.reload()
+            for gid in sorted(set(group_ids)):
+                for i in self._members.get(gid, ()):
+                    if needle in self._names[i].casefold():
+                        found.append((self._ids[i], self._names[i], self._weights[i], self._active[i], gid))
+                        if len(found) >= offset + limit:
+                            return found[offset:]
+        return found[offset:]
+
+    def put(self, student_id: int, name: str, weight: float, active: int, group_id: int) -> None:
+        with self._lock:
+            if self._index is None:
+                return
+            i = self._index.get(student_id)
+            if i is None:
+                i = self._index[student_id] = len(self._ids)
+                self._ids.append(student_id)
+                self._names.append(name)
+                self._weights.append(weight)
+                self._active.append(1 if active else 0)
+                self._groups.append(group_id)
+                self._members.setdefault(group_id, array("q")).append(i)
+            else:
+                self._names[i] = name
+                self._weights[i] = weight
+                self._active[i] = 1 if active else 0
+
+    def set_weights(self, updates: Iterable[Tuple[int, float]]) -> None:
+        with self._lock:
+            if self._index is not None:
+                for student_id, weight in updates:
+                    i = self._index.get(student_id)
+                    if i is not None:
+                        self._weights[i] = weight
+
+    def set_active(self, student_id: int, active: int) -> None:
+        with self._lock:
+            if self._index is not None and student_id in self._index:
+                self._active[self._index[student_id]] = 1 if active else 0
+
+    def set_all_weights(self, weight: float, group_id: int) -> None:
+        with self._lock:
+            for i in self._members.get(group_id, ()):
+                self._weights[i] = weight
+
+    def set_all_active(self, active: int, group_id: int) -> None:
+        with self._lock:
+            for i in self._members.get(group_id, ()):
+                self._active[i] = 1 if active else 0
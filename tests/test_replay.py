@@ -0,0 +1,37 @@
+import os
+import tempfile
+import unittest
+
+from database import open_db, close_db, init_db, add_student, get_queue, reset_all_weights, toggle_student_status
+from queue_logic import generate_and_save_queue, add_new_student_to_queue_and_penalize
+from replay import rebuild_group
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self._tmp = tempfile.TemporaryDirectory()
+        open_db(os.path.join(self._tmp.name, "test.db"))
+        init_db()
+
+    def tearDown(self) -> None:
+        close_db()
+        self._tmp.cleanup()
+
+    def test_add_after_reset_replays_cleanly(self) -> None:
+        ids = [add_student(f"Студент {i}") for i in range(12)]
+        for seed in range(3):
+            generate_and_save_queue("Предмет", seed=seed)
+        toggle_student_status(ids[0], 0)
+        old = generate_and_save_queue("Предмет", seed=3)
+        toggle_student_status(ids[0], 1)
+        reset_all_weights()
+        generate_and_save_queue("Предмет", seed=4)
+        self.assertNotIn(ids[0], {it[1] for it in get_queue(old)["items"]})
+
+        add_new_student_to_queue_and_penalize(old, ids[0], is_priority=1)
+
+        report = rebuild_group()
+        self.assertEqual(report["item_mismatches"], [])
+        self.assertEqual(report["weight_mismatches"], [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.methods import DeleteMessage, EditMessageReplyMarkup, EditMessageText, Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import Message
+
+from config import (
+    OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST, OUTBOUND_GROUP_RATE,
+    OUTBOUND_MAX_RETRIES, OUTBOUND_TRACKED_MESSAGES
+)
+
+MessageKey = Tuple[Any, int]
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity and self.blocked_until <= self.updated
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    async def wait(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= 1:
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    async def acquire(self) -> None:
+        await self.wait()
+        self.tokens -= 1
+
+class _PendingEdit:
+    def __init__(self, method: TelegramMethod) -> None:
+        self.method = method
+        self.future: "asyncio.Future[Response]" = asyncio.get_running_loop().create_future()
+
+    def merge(self, method: TelegramMethod) -> None:
+        if isinstance(method, EditMessageReplyMarkup) and isinstance(self.method, EditMessageText):
+            self.method = self.method.model_copy(update={"reply_markup": method.reply_markup})
+        else:
+            self.method = method
+
+def _markup_fingerprint(markup: Any) -> Optional[str]:
+    return markup.model_dump_json(exclude_none=True) if markup is not None else None
+
+def _message_key(method: TelegramMethod) -> Optional[MessageKey]:
+    chat_id = getattr(method, "chat_id", None)
+    message_id = getattr(method, "message_id", None)
+    if chat_id is None or message_id is None:
+        return None
+    return chat_id, message_id
+
+class OutboundThrottler(BaseRequestMiddleware):
+    def __init__(
+        self,
+        global_rate: float = OUTBOUND_GLOBAL_RATE,
+        chat_rate: float = OUTBOUND_CHAT_RATE,
+        chat_burst: float = OUTBOUND_CHAT_BURST,
+        group_rate: float = OUTBOUND_GROUP_RATE,
+        max_retries: int = OUTBOUND_MAX_RETRIES,
+        tracked_messages: int = OUTBOUND_TRACKED_MESSAGES,
+    ) -> None:
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.tracked_messages = tracked_messages
+        self._chats: Dict[Any, TokenBucket] = {}
+        self._pending: Dict[MessageKey, _PendingEdit] = {}
+        self._contents: "OrderedDict[MessageKey, Tuple[Optional[str], Optional[str]]]" = OrderedDict()
+        self.dropped = 0
+        self.coalesced = 0
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > self.tracked_messages:
+                for key in [k for k, b in self._chats.items() if b.idle()]:
+                    del self._chats[key]
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            rate = self.group_rate if is_group else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self.chat_burst)
+        return bucket
+
+    def _remember(self, key: MessageKey, text: Optional[str], markup: Optional[str]) -> None:
+        self._contents[key] = (text, markup)
+        self._contents.move_to_end(key)
+        while len(self._contents) > self.tracked_messages:
+            self._contents.popitem(last=False)
+
+    def _is_noop(self, key: MessageKey, method: TelegramMethod) -> bool:
+        known = self._contents.get(key)
+        if known is None:
+            return False
+        if isinstance(method, EditMessageText):
+            return known == (method.text, _markup_fingerprint(method.reply_markup))
+        return known[1] == _markup_fingerprint(method.reply_markup)
+
+    def _track(self, method: TelegramMethod, result: Any) -> None:
+        if isinstance(method, DeleteMessage):
+            self._contents.pop((method.chat_id, method.message_id), None)
+            return
+        if isinstance(method, EditMessageText):
+            self._remember((method.chat_id, method.message_id), method.text, _markup_fingerprint(method.reply_markup))
+        elif isinstance(method, EditMessageReplyMarkup):
+            key = (method.chat_id, method.message_id)
+            text = self._contents.get(key, (None, None))[0]
+            self._remember(key, text, _markup_fingerprint(method.reply_markup))
+        elif isinstance(result, Message) and hasattr(method, "text"):
+            self._remember((method.chat_id, result.message_id), method.text, _markup_fingerprint(getattr(method, "reply_markup", None)))
+
+    async def _send(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot, method: TelegramMethod[TelegramType], chat_id: Any) -> Response[TelegramType]:
+        bucket = self._chat_bucket(chat_id)
+        attempt = 0
+        while True:
+            await bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                logging.warning(f"Flood control on chat {chat_id}, retry in {e.retry_after}s")
+                bucket.block(e.retry_after)
+                continue
+            except TelegramBadRequest as e:
+                if "message is not modified" in e.message:
+                    return Response[bool](ok=True, result=True)
+                raise
+            self._track(method, response.result)
+            return response
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot, method: TelegramMethod[TelegramType]) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+        if not isinstance(method, (EditMessageText, EditMessageReplyMarkup)):
+            return await self._send(make_request, bot, method, chat_id)
+
+        key = _message_key(method)
+        pending = self._pending.get(key)
+        if pending is not None:
+            pending.merge(method)
+            self.coalesced += 1
+            return await asyncio.shield(pending.future)
+        if self._is_noop(key, method):
+            self.dropped += 1
+            return Response[bool](ok=True, result=True)
+
+        pending = self._pending[key] = _PendingEdit(method)
+        try:
+            await self._chat_bucket(chat_id).wait()
+        finally:
+            del self._pending[key]
+        latest = pending.method
+        try:
+            if latest is not method and self._is_noop(key, latest):
+                self.dropped += 1
+                response = Response[bool](ok=True, result=True)
+            else:
+                response = await self._send(make_request, bot, latest, chat_id)
+        except BaseException as e:
+            if not pending.future.done():
+                pending.future.set_exception(e)
+                pending.future.exception()
+            raise
+        pending.future.set_result(response)
+        return response
@@ -0,0 +1,42 @@
+import time
+from datetime import datetime, timedelta
+from typing import Any, Optional
+
+DISPLAY_FORMAT = "%d.%m.%Y %H:%M:%S"
+LEGACY_FORMAT = "%d.%m.%Y %H:%M:%S"
+DATE_FORMATS = ("%d.%m.%Y", "%d.%m.%y", "%Y-%m-%d")
+
+def now_ts() -> int:
+    return int(time.time())
+
+def format_ts(ts: Optional[int], fmt: str = DISPLAY_FORMAT) -> str:
+    if ts is None:
+        return "—"
+    return datetime.fromtimestamp(ts).strftime(fmt)
+
+def parse_legacy_ts(value: Any) -> Optional[int]:
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value).strip()
+    if text.isdigit():
+        return int(text)
+    try:
+        return int(datetime.strptime(text, LEGACY_FORMAT).timestamp())
+    except ValueError:
+        return None
+
+def parse_date(text: str, end_of_day: bool = False) -> int:
+    for fmt in DATE_FORMATS:
+        try:
+            day = datetime.strptime(text.strip(), fmt)
+        except ValueError:
+            continue
+        if end_of_day:
+            day += timedelta(days=1, seconds=-1)
+        return int(day.timestamp())
+    raise ValueError(f"Не удалось разобрать дату: {text}")
+
+def days_ago(days: int) -> int:
+    return now_ts() - days * 86400